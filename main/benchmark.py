@@ -0,0 +1,388 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+
+#
+# BSD License
+#
+# Copyright (c) 2012, Alexander Ljungberg
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""Benchmarks for CappBot internals, run on synthetic data.
+
+    python benchmark.py memory --issues 100000
+    python benchmark.py startup --issues 10000 100000
+    python benchmark.py snapshot --issues 10000 100000
+    python benchmark.py scanner --sizes 1000 2000 4000 8000
+    python benchmark.py rules --sets 1000000
+    python benchmark.py paper-trail --issues 100000
+    python benchmark.py analysis --issues 2000 --processes 1 2 4 8
+
+"""
+
+import argparse
+import imp
+import json
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import command_scanner
+from database import Database, IssueRecord, compress_snapshot, decode_snapshot, encode_snapshot, open_database
+from label_rules import LabelRules
+from paper_trail import PaperTrailRenderer
+from reference import apply_rules_by_scanning, random_label_sets, scan_with_regexes
+
+
+LABELS = [u'#new', u'#needs-review', u'#needs-patch', u'#needs-test', u'#accepted', u'#ready-to-commit', u'#fixed', u'#duplicate', u'#wont-fix', u'#works-for-me', u'bug', u'enhancement', u'documentation', u'AppKit', u'Foundation', u'Objective-J', u'Tools']
+
+
+def synthetic_database(issues, seed=0):
+    """Return a database in the JSON layout with the given number of plausible looking issue records."""
+
+    rng = random.Random(seed)
+    records = {}
+    for n in range(issues):
+        issue_id = 3000000 + n * 7
+        records[unicode(issue_id)] = {
+            'id': issue_id,
+            'number': n + 1,
+            'comments_count': rng.randint(0, 30),
+            'milestone_number': rng.choice([None, 1, 2, 3, 4]),
+            'assignee_id': rng.choice([None, None, 84731, 1022439, 66911]),
+            'labels': sorted(rng.sample(LABELS, rng.randint(0, 4))),
+            'updated_at': '2012-%02d-%02dT%02d:%02d:%02dZ' % (rng.randint(1, 12), rng.randint(1, 28), rng.randint(0, 23), rng.randint(0, 59), rng.randint(0, 59)),
+            'votes': rng.choice([None, None, None, 0, 1, 2, -1]),
+            'latest_seen_comment_id': rng.randint(5000000, 9000000),
+        }
+    return {'first_run': '2012-01-01T00:00:00', 'issues': records}
+
+
+def deep_size(obj, seen):
+    """Return the size in bytes of `obj` and everything it refers to, counting objects in `seen` only once."""
+
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(k, seen) + deep_size(v, seen) for k, v in obj.iteritems())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(deep_size(v, seen) for v in obj)
+    elif hasattr(obj, '__slots__'):
+        size += sum(deep_size(getattr(obj, name), seen) for name in obj.__slots__)
+    return size
+
+
+def records_size(records):
+    # None, True, small ints and the like are shared by everything; count them as free like the interned labels.
+    seen = set(id(v) for v in (None, True, False))
+    return sum(deep_size(record, seen) for record in records)
+
+
+def benchmark_memory(args):
+    text = json.dumps(synthetic_database(args.issues))
+    print "Synthetic database of %d issues, %.1f MB of JSON." % (args.issues, len(text) / 1e6)
+
+    start = time.time()
+    data = json.loads(text)
+    load_time = time.time() - start
+    before = records_size(data['issues'].values())
+
+    start = time.time()
+    data = json.loads(text)
+    database = Database(data)
+    compact_load_time = time.time() - start
+    after = records_size(data['issues'].values())
+
+    assert all(isinstance(record, IssueRecord) for issue_id, record in database.iter_issues())
+    assert json.loads(database.dumps()) == json.loads(text)
+
+    print "%-16s %12s %14s %10s" % ("", "bytes", "bytes/issue", "load (s)")
+    print "%-16s %12d %14.1f %10.2f" % ("dict records", before, before / float(args.issues), load_time)
+    print "%-16s %12d %14.1f %10.2f" % ("IssueRecord", after, after / float(args.issues), compact_load_time)
+    print "Saved %.0f%% of the memory used by issue records." % (100.0 * (before - after) / before)
+
+
+def benchmark_startup(args):
+    """Time opening each backend and reading a few records, as a run with few updated issues would."""
+
+    print "%-10s %10s %12s %12s" % ("backend", "issues", "open (ms)", "RSS (MB)")
+    directory = tempfile.mkdtemp()
+    try:
+        for issues in args.issues:
+            data = synthetic_database(issues)
+            for backend in args.backends:
+                path = os.path.join(directory, '%s-%d' % (backend, issues))
+                database = open_database(backend, path)
+                database.import_dict(json.loads(json.dumps(data)))
+                database.close()
+                del database
+
+                # Measure in a new process so that each starts with nothing loaded.
+                elapsed, rss = json.loads(subprocess.check_output([sys.executable, __file__, 'open', backend, path, str(issues)]))
+                print "%-10s %10d %12.1f %12.1f" % (backend, issues, elapsed * 1000, rss / 1024.0)
+    finally:
+        shutil.rmtree(directory)
+
+
+def benchmark_snapshot(args):
+    """Compare the JSON database format with binary snapshots, uncompressed and compressed."""
+
+    formats = [
+        ('json', lambda database: database.dumps(indent=1, sort_keys=True)),
+        ('binary', lambda database: compress_snapshot(encode_snapshot(database.data), None)),
+        ('zlib', lambda database: compress_snapshot(encode_snapshot(database.data), 'zlib')),
+        ('bz2', lambda database: compress_snapshot(encode_snapshot(database.data), 'bz2')),
+    ]
+
+    print "%-8s %10s %10s %10s %12s" % ("format", "issues", "save (s)", "load (s)", "size (MB)")
+    for issues in args.issues:
+        database = Database(synthetic_database(issues))
+        for name, dump in formats:
+            start = time.time()
+            contents = dump(database)
+            save_time = time.time() - start
+
+            start = time.time()
+            loaded = Database(decode_snapshot(contents)[0])
+            load_time = time.time() - start
+            assert len(loaded.data['issues']) == issues
+
+            print "%-8s %10d %10.2f %10.2f %12.2f" % (name, issues, save_time, load_time, len(contents) / 1e6)
+
+
+# Comment bodies which make backtracking regular expressions slow, each given its size in characters.
+ADVERSARIAL_BODIES = [
+    ('long label', lambda n: u'+' + u'a' * n + u'!'),
+    ('hyphenated', lambda n: u'-' + u'a-' * (n // 2) + u'.'),
+    ('spaced', lambda n: u'#' + u'a ' * (n // 2) + u'!'),
+    ('log paste', lambda n: u'\n'.join([u'    at org.cappuccino.Foo-bar_baz (Foo.j:12) +1 #tag'] * (n // 50))),
+]
+
+
+def benchmark_scanner(args):
+    """Time scanning adversarial comment bodies with the command scanner and the regular expressions it replaced."""
+
+    print "%-12s %8s %14s %14s" % ("body", "size", "scanner (ms)", "regexes (ms)")
+    for name, make_body in ADVERSARIAL_BODIES:
+        for size in args.sizes:
+            body = make_body(size)
+            timings, results = [], []
+            for scan in (command_scanner.scan, scan_with_regexes):
+                start = time.time()
+                results.append(scan(body))
+                timings.append((time.time() - start) * 1000)
+            assert results[0] == results[1]
+            print "%-12s %8d %14.2f %14.2f" % (name, size, timings[0], timings[1])
+
+
+def benchmark_rules(args):
+    """Time applying the label rules of the default settings to random label sets, compiled and by scanning lists."""
+
+    settings = imp.load_source('settings', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'default_settings.py'))
+    label_sets = list(random_label_sets(settings, args.sets))
+
+    start = time.time()
+    rules = LabelRules.from_settings(settings)
+    compile_time = time.time() - start
+
+    # Most issues already satisfy the rules, so also time sets the rules leave alone.
+    workloads = (('random', label_sets), ('settled', [rules.apply(labels)[0] for labels in label_sets]))
+
+    order = LabelRules.rule_order(settings.WHEN_LABEL_REMOVE_LABELS)
+    print "%-10s %16s %16s" % ("sets", "compiled (s)", "scanning (s)")
+    for name, sets in workloads:
+        timings = []
+        for apply_rules in (rules.apply, lambda labels: apply_rules_by_scanning(settings, labels, order)):
+            start = time.time()
+            for labels in sets:
+                apply_rules(labels)
+            timings.append(time.time() - start)
+        print "%-10s %16.2f %16.2f" % (name, timings[0], timings[1])
+    print "Compiling the rules took %.2f ms." % (compile_time * 1000)
+
+
+# How often each label, milestone and so on turns up, roughly as in a real project's issues.
+PAPER_TRAIL_WEIGHTS = [
+    [(u'#new', 40), (u'#accepted', 20), (u'#acknowledged', 10), (u'#fixed', 15), (u'#wont-fix', 5), (u'#duplicate', 5), (u'#works-for-me', 5)],
+    [(None, 30), (u'bug', 40), (u'enhancement', 25), (u'documentation', 5)],
+    [(None, 60), (u'#needs-patch', 15), (u'#needs-review', 10), (u'#needs-confirmation', 5), (u'#needs-unit-test', 5), (u'#ready-to-commit', 5)],
+    [(None, 80), (u'AppKit', 10), (u'Foundation', 7), (u'Tools', 3)],
+]
+MILESTONE_WEIGHTS = [(u'Someday', 50), (None, 20), (u'1.0', 15), (u'1.1', 10), (u'2.0', 5)]
+ASSIGNEE_WEIGHTS = [(None, 70), (u'aljungberg', 15), (u'boucher', 10), (u'cappbot', 5)]
+VOTE_WEIGHTS = [(None, 80), (0, 5), (1, 8), (2, 4), (-1, 3)]
+
+
+def weighted_choice(rng, weights):
+    n = rng.uniform(0, sum(weight for value, weight in weights))
+    for value, weight in weights:
+        n -= weight
+        if n <= 0:
+            return value
+    return weights[-1][0]
+
+
+def benchmark_paper_trail(args):
+    """Time rendering the paper trail messages of synthetic issues with the settings function and with the renderer."""
+
+    settings = imp.load_source('settings', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'default_settings.py'))
+    rng = random.Random(0)
+    messages = []
+    for n in xrange(args.issues):
+        labels = [label for label in (weighted_choice(rng, weights) for weights in PAPER_TRAIL_WEIGHTS) if label]
+        messages.append((weighted_choice(rng, ASSIGNEE_WEIGHTS), weighted_choice(rng, MILESTONE_WEIGHTS), labels, weighted_choice(rng, VOTE_WEIGHTS)))
+
+    compiled = PaperTrailRenderer(settings)
+    # What a custom getPaperTrailMessage gets: the messages it rendered recently are remembered.
+    custom = imp.load_source('settings', settings.__file__.replace('.pyc', '.py'))
+    stock = custom.getPaperTrailMessage
+    custom.getPaperTrailMessage = lambda *args: stock(*args)
+    memoised = PaperTrailRenderer(custom, args.cache_size)
+
+    print "%-12s %10s %10s" % ("renderer", "seconds", "hit rate")
+    for name, render in (('settings', settings.getPaperTrailMessage), ('compiled', compiled.render), ('memoised', memoised.render)):
+        start = time.time()
+        for message in messages:
+            render(*message)
+        elapsed = time.time() - start
+        print "%-12s %10.2f %10s" % (name, elapsed, "%.0f%%" % (100.0 * memoised.hits / len(messages)) if render == memoised.render else "-")
+
+
+class SyntheticComment(object):
+    def __init__(self, body):
+        self.body = body
+
+
+COMMENT_LINES = [u'I can reproduce this in Safari but not in Firefox.', u'+1', u'-1', u'+#needs-review', u'#accepted', u'-#needs-info', u'milestone=1.0', u'assignee=aljungberg', u'', u'    [CPView setFrame:] at AppKit/CPView.j:512', u'Fixed in a1b2c3d, thanks!', u'Could you attach a reduction?']
+
+
+def synthetic_comments(issues, comments_per_issue, seed=0):
+    """Return lists of comments with plausible looking bodies of a few to a few dozen lines, one list per issue."""
+
+    rng = random.Random(seed)
+    return [[SyntheticComment(u'\n'.join(rng.choice(COMMENT_LINES) for k in xrange(rng.randint(1, 40)))) for m in xrange(rng.randint(0, 2 * comments_per_issue))] for n in xrange(issues)]
+
+
+def benchmark_analysis(args):
+    """Time scanning the comments of many issues serially and in process pools of different sizes."""
+
+    bodies = [[comment.body for comment in comments] for comments in synthetic_comments(args.issues, args.comments)]
+    print "%d comments of %d issues, %d core(s)." % (sum(len(b) for b in bodies), args.issues, multiprocessing.cpu_count())
+
+    def fresh_comments():
+        return [[SyntheticComment(body) for body in issue_bodies] for issue_bodies in bodies]
+
+    comment_lists = fresh_comments()
+    start = time.time()
+    serial = [[command_scanner.comment_commands(comment) for comment in comments] for comments in comment_lists]
+    serial_time = time.time() - start
+
+    print "%-10s %12s %12s %10s" % ("processes", "start (s)", "scan (s)", "speedup")
+    print "%-10s %12s %12.2f %10s" % ("serial", "-", serial_time, "1.00")
+    for processes in args.processes:
+        comment_lists = fresh_comments()
+        start = time.time()
+        pool = multiprocessing.Pool(processes)
+        started = time.time()
+        for n in xrange(0, len(comment_lists), args.batch):
+            command_scanner.analyse_comments(pool, comment_lists[n:n + args.batch])
+        elapsed = time.time() - started
+        pool.terminate()
+        assert [[command_scanner.comment_commands(comment) for comment in comments] for comments in comment_lists] == serial
+        print "%-10d %12.2f %12.2f %10.2f" % (processes, started - start, elapsed, serial_time / elapsed)
+
+
+def benchmark_open(args):
+    start = time.time()
+    database = open_database(args.backend, args.path, read_only=True)
+    for n in range(0, args.issues, max(1, args.issues // 10)):
+        database.get_issue(3000000 + n * 7)
+    elapsed = time.time() - start
+    print json.dumps([elapsed, resident_kb()])
+
+
+def resident_kb():
+    """Return the resident memory of this process in kB."""
+
+    # On Linux ru_maxrss would include the memory of the parent process, which survives exec.
+    if os.path.exists('/proc/self/status'):
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers()
+
+    memory_parser = subparsers.add_parser('memory', help='compare the memory used per issue record by plain dicts and by IssueRecord')
+    memory_parser.add_argument('--issues', type=int, default=100000,
+        help='number of synthetic issues (default: 100000)')
+    memory_parser.set_defaults(func=benchmark_memory)
+
+    startup_parser = subparsers.add_parser('startup', help='compare the time and memory it takes each backend to open a database and read a few records')
+    startup_parser.add_argument('--issues', type=int, nargs='+', default=[10000, 100000],
+        help='sizes of the synthetic databases (default: 10000 100000)')
+    startup_parser.add_argument('--backends', nargs='+', default=['json', 'sqlite', 'indexed'],
+        help='backends to compare (default: json sqlite indexed)')
+    startup_parser.set_defaults(func=benchmark_startup)
+
+    snapshot_parser = subparsers.add_parser('snapshot', help='compare save and load times and file sizes of the database snapshot formats')
+    snapshot_parser.add_argument('--issues', type=int, nargs='+', default=[10000, 100000],
+        help='sizes of the synthetic databases (default: 10000 100000)')
+    snapshot_parser.set_defaults(func=benchmark_snapshot)
+
+    scanner_parser = subparsers.add_parser('scanner', help='compare the command scanner with regular expressions on adversarial comment bodies')
+    scanner_parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 2000, 4000, 8000],
+        help='sizes of the comment bodies in characters (default: 1000 2000 4000 8000)')
+    scanner_parser.set_defaults(func=benchmark_scanner)
+
+    rules_parser = subparsers.add_parser('rules', help='compare the compiled label rules with scanning the label settings')
+    rules_parser.add_argument('--sets', type=int, default=1000000,
+        help='number of random label sets (default: 1000000)')
+    rules_parser.set_defaults(func=benchmark_rules)
+
+    paper_trail_parser = subparsers.add_parser('paper-trail', help='compare rendering paper trail messages with the settings function and with the renderer')
+    paper_trail_parser.add_argument('--issues', type=int, default=100000,
+        help='number of synthetic issues (default: 100000)')
+    paper_trail_parser.add_argument('--cache-size', type=int, default=1024,
+        help='number of messages remembered for a custom message function (default: 1024)')
+    paper_trail_parser.set_defaults(func=benchmark_paper_trail)
+
+    analysis_parser = subparsers.add_parser('analysis', help='compare scanning comments for commands serially and in process pools')
+    analysis_parser.add_argument('--issues', type=int, default=2000,
+        help='number of synthetic issues (default: 2000)')
+    analysis_parser.add_argument('--comments', type=int, default=25,
+        help='average number of comments per issue (default: 25)')
+    analysis_parser.add_argument('--batch', type=int, default=100,
+        help='issues per batch, like ANALYSIS_BATCH (default: 100)')
+    analysis_parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4, 8],
+        help='pool sizes to compare (default: 1 2 4 8)')
+    analysis_parser.set_defaults(func=benchmark_analysis)
+
+    open_parser = subparsers.add_parser('open', help='open a database and read a few records (used by startup)')
+    open_parser.add_argument('backend')
+    open_parser.add_argument('path')
+    open_parser.add_argument('issues', type=int)
+    open_parser.set_defaults(func=benchmark_open)
+
+    args = parser.parse_args()
+    args.func(args)
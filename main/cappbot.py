@@ -63,27 +63,33 @@ from operator import attrgetter
 import argparse
 import datetime
 import imp
+import itertools
 import json
 import logbook
+import multiprocessing
 import os
 import re
+import signal
 import sys
+import threading
 import time
-import shutil
 
 import iso8601
 
+from comment_store import CommentStore
+from database import Database, IssueRecord, compact_string, label_mask, open_database
+from label_rules import LabelRules
+from metadata_catalog import MetadataCatalog
+from webhook import WebhookServer
+from paper_trail import PaperTrailRenderer
 from mini_github3 import GitHub
-
-ADD_LABEL_REGEX = re.compile(r'^\+([-\w\d _#]*[-\w\d_#]+)$|^(#[-\w\d _#]*[-\w\d_#]+)$')
-REMOVE_LABEL_REGEX = re.compile(r'^-([-\w\d _#]*[-\w\d_#]+)$')
-SET_MILESTONE_REGEX = re.compile(r'^milestone=(.*)$')  # Assume pretty much any character is valid in a milestone title.
-SET_ASSIGNEE_REGEX = re.compile(r'^assignee=([-\w\d_#]*)$')
-
-VOTE_REGEX = re.compile(r'^[-\+][01]$')
+import command_scanner
 
 TITLE_VOTE_REGEX = re.compile(r' \[[-+]\d+\]$')
 
+# The issue fields CappBot changes, in the order to change them in one at a time.
+MUTATION_FIELDS = ('labels', 'milestone', 'assignee', 'title', 'state')
+
 
 def is_issue_new(issue):
     """Return True if an issue hasn't been manually configured before CappBot got to it."""
@@ -101,15 +107,43 @@ def get_user_login(user):
     return user.login if user else None
 
 
+# Issues updated this long before a listing started are listed again by the next run, in case GitHub's
+# `since` filter and its `Date` header don't quite agree.
+SYNC_SKEW = datetime.timedelta(seconds=60)
+
+# The types of events in the repository events feed which change an issue, by where their payload has its number.
+ISSUE_EVENTS = ('IssuesEvent', 'IssueCommentEvent')
+PULL_REQUEST_EVENTS = ('PullRequestEvent', 'PullRequestReviewCommentEvent')
+
+
 class CappBot(object):
-    def __init__(self, settings, database, dry_run=False, memorise_forgotten=False, ignore=None):
+    def __init__(self, settings, database, dry_run=False, memorise_forgotten=False, ignore=None, full_crawl=False, comment_store=None, catalog=None, pool=None):
         self.settings = settings
-        self.github = GitHub(api_token=settings.GITHUB_TOKEN)
+        self.github = GitHub(api_token=settings.GITHUB_TOKEN, extra_tokens=settings.GITHUB_EXTRA_TOKENS, pool_size=settings.HTTP_POOL_SIZE, pool_idle_timeout=settings.HTTP_POOL_IDLE_TIMEOUT, pool_stats=settings.HTTP_POOL_STATS, page_cache_path=settings.PAGE_CACHE, page_cache_size=settings.PAGE_CACHE_SIZE, page_concurrency=settings.PAGE_FETCH_CONCURRENCY, rate_limit_burst=settings.RATE_LIMIT_BURST if settings.AVOID_RATE_LIMIT else None, writes_per_hour=settings.WRITES_PER_HOUR, write_burst=settings.WRITE_BURST)
         self.repo_user, self.repo_name = settings.GITHUB_REPOSITORY.split("/")
-        self.database = database
+        # A plain dict is taken to be a database in the JSON layout, held in memory.
+        self.database = database if isinstance(database, Database) else Database(database)
         self.dry_run = dry_run
         self.memorise_forgotten = memorise_forgotten
         self.ignore = set(ignore) if ignore else set()
+        self.full_crawl = full_crawl
+        self.comment_store = comment_store if comment_store is not None else CommentStore()
+        self.catalog = catalog if catalog is not None else MetadataCatalog()
+        self.metadata_refreshed = False
+        # Collaborators get permissions on top of these, as they are at the time.
+        self.configured_permissions = dict((login, list(rights)) for login, rights in settings.PERMISSIONS.items())
+        self.label_rules = LabelRules.from_settings(settings)
+        # A multiprocessing.Pool to scan comments in, shared by every run.
+        self.pool = pool
+        self.paper_trail = PaperTrailRenderer(settings, settings.PAPER_TRAIL_CACHE_SIZE)
+        self.lost_comment_downloads = 0
+        self.run_started = None
+        self.stop_requested = False
+        self.events_poll_interval = None
+        self.events_seen = None
+        self.listing_started = None
+        self.listing_requested_at = None
+        self.wake = threading.Event()
 
     def get_current_user(self):
         if not getattr(self, '_current_user', None):
@@ -120,9 +154,7 @@ class CappBot(object):
     def has_seen_issue(self, issue):
         """Return true if the issue is in our database."""
 
-        db = self.database
-
-        return 'issues' in db and db['issues'].get(unicode(issue.id)) is not None
+        return self.database.get_issue(issue.id) is not None
 
     def last_seen_issue_update(self, issue):
         """Return the last seen updated_at time in YYYY-MM-DDTHH:MM:SSZ string format.
@@ -133,69 +165,203 @@ class CappBot(object):
 
         if not self.has_seen_issue(issue):
             return None
-        return self.database['issues'][unicode(issue.id)].get('updated_at')
+        return self.database.get_issue(issue.id).updated_at
 
     def get_first_run_date(self):
-        if not self.database.get('first_run'):
-            self.database['first_run'] = datetime.datetime.now().isoformat()
-        return iso8601.parse_date(self.database['first_run'])
+        if not self.database.get_meta('first_run'):
+            self.database.set_meta('first_run', datetime.datetime.now().isoformat())
+        return iso8601.parse_date(self.database.get_meta('first_run'))
     first_run_date = property(get_first_run_date)
 
+    def get_issues_synced_until(self):
+        """Return the time, as a string like `updated_at`, before which every updated issue has been handled, or None."""
+
+        return self.database.get_meta('issues_synced_until')
+
+    def set_issues_synced_until(self, updated_at):
+        self.database.set_meta('issues_synced_until', updated_at)
+    issues_synced_until = property(get_issues_synced_until, set_issues_synced_until)
+
+    def iter_issues(self):
+        """Yield the issues to examine: only the issues updated since the last run when possible, otherwise all of them.
+
+        Issues are yielded as each page of them arrives, while the next page is being downloaded.
+
+        """
+
+        self.listing_started = None
+        self.listing_requested_at = datetime.datetime.utcnow()
+        # Poll even when the events won't be used, to know where to start next time.
+        numbers = self.poll_events() if self.settings.POLL_EVENTS else None
+        since = self.issues_synced_until
+        if self.settings.INCREMENTAL_SYNC and since and not self.full_crawl:
+            if numbers is not None:
+                logbook.debug("Events since the last run touched %d issue(s)." % len(numbers))
+                # Only a listing moves the point from which the next listing starts, so that an event the feed
+                # never showed is still found by one.
+                self.listing_requested_at = None
+                return (self.github.Issue.by_number(self.repo_user, self.repo_name, number) for number in sorted(numbers))
+            logbook.debug("Looking for issues updated since %s." % since)
+            return self.github.Issues.iter_by_repository(self.repo_user, self.repo_name, state='all', since=since, on_page=self.note_listing_page, per_page=100)
+
+        return self.github.Issues.iter_by_repository_all(self.repo_user, self.repo_name, on_page=self.note_listing_page, per_page=100)
+
+    def note_listing_page(self, page):
+        """Note when GitHub sent the first page of issues of the run, by the clock `updated_at` goes by."""
+
+        if self.listing_started is None:
+            self.listing_started = page.server_date
+
+    def get_listing_synced_until(self):
+        """Return the time from which on the next run must list updated issues, as a string like `updated_at`.
+
+        Any issue updated after the listing started may have been listed before it was updated, so that's where the
+        next run should start: not at the newest `updated_at` seen, which includes CappBot's own changes.
+
+        """
+
+        started = self.listing_started or self.listing_requested_at
+        return (started - SYNC_SKEW).strftime('%Y-%m-%dT%H:%M:%SZ') if started else None
+
+    def poll_events(self):
+        """Return the numbers of the issues touched by events not seen by a previous run, or None if that can't be
+        told: on the first poll, or when GitHub no longer has all events since.
+
+        GitHub may publish an event after newer ones, so the feed is read back to EVENTS_OVERLAP_SECONDS before the
+        newest event of the previous poll, skipping the events seen then. What was seen this time is kept in
+        `events_seen`, to be recorded once the run is complete.
+
+        """
+
+        seen = self.database.get_meta('events_seen')
+        overlap = datetime.timedelta(seconds=self.settings.EVENTS_OVERLAP_SECONDS)
+        cutoff = iso8601.parse_date(seen['newest_at']) - overlap if seen else None
+        seen_ids = frozenset(seen['ids']) if seen else frozenset()
+        numbers = set()
+        newest_at = None
+        recent_ids = []
+        # Unless something happened, the first page is answered with a 304 from the page cache.
+        page = self.github.Events.by_repository(self.repo_user, self.repo_name, per_page=100)
+        page.deliver()
+        self.events_poll_interval = page.poll_interval
+        while page is not None:
+            for event in page:
+                created_at = iso8601.parse_date(event.created_at)
+                if newest_at is None:
+                    newest_at = created_at
+                    self.events_seen = {'newest_at': event.created_at, 'ids': recent_ids}
+                if created_at >= newest_at - overlap:
+                    recent_ids.append(event.id)
+                if seen is None:
+                    continue
+                if created_at < cutoff:
+                    return numbers
+                if event.id in seen_ids:
+                    continue
+                # Pull requests are issues too, and are listed as such when looking for changed issues.
+                if event.type in ISSUE_EVENTS:
+                    numbers.add(int(event.payload['issue']['number']))
+                elif event.type in PULL_REQUEST_EVENTS:
+                    numbers.add(int(event.payload['pull_request']['number']))
+            if seen is None:
+                # The first poll only notes where to start next time, so the older pages aren't needed.
+                return None
+            page = page.next_page()
+
+        logbook.info("Events since %s may have been dropped. Looking for changed issues the usual way." % seen['newest_at'])
+        return None
+
     def record_issue(self, issue):
         """Record the information we need to detect whether an issue has been changed."""
 
-        db = self.database
-
-        if not 'issues' in db:
-            db['issues'] = {}
-
-        db_issue = {
-            'id': int(issue.id),
-            'number': int(issue.number),
-            'comments_count': int(issue.comments),
-            'milestone_number': int(issue.milestone.number) if issue.milestone else None,
-            'assignee_id': int(issue.assignee.id) if issue.assignee else None,
-            'labels': sorted(label.name for label in issue.labels),
-            'updated_at': issue.updated_at  # (as a string)
-        }
-
-        # Note we need to use string keys for our JSON database's sake.
-        key = unicode(issue.id)
-        if key in db['issues']:
-            db['issues'][key].update(db_issue)
-        else:
-            db_issue['votes'] = None
-            db_issue['latest_seen_comment_id'] = None
-            db['issues'][key] = db_issue
+        record = self.database.get_issue(issue.id) or IssueRecord()
+        record.id = int(issue.id)
+        record.number = int(issue.number)
+        record.comments_count = int(issue.comments)
+        record.milestone_number = int(issue.milestone.number) if issue.milestone else None
+        record.assignee_id = int(issue.assignee.id) if issue.assignee else None
+        record.labels = [label.name for label in issue.labels]
+        record.updated_at = compact_string(issue.updated_at)  # (as a string)
+        self.database.put_issue(issue.id, record)
 
     def record_latest_seen_comment(self, issue):
         """Record the id of the newest comment so we can recognise new comments in the future,
         and the time of the last update so that we can skip
 
+        The comments new since the previous call are folded into the state derived from comments.
+
         """
 
-        db = self.database
+        record = self.database.get_issue(issue.id)
+        if record.vote_map is None or record.bot_commented is None:
+            self.rebuild_derived_state(record, issue._comments)
+        else:
+            self.update_derived_state(record, self.get_new_comments(issue))
+        record.latest_seen_comment_id = issue._comments[-1].id if issue._comments else None
+        self.database.put_issue(issue.id, record)
+
+    def update_derived_state(self, record, comments):
+        """Update the state kept in the record which is derived from the comments of the issue, each user's latest
+        vote and whether we've commented, with the given comments. The comments must be newer than any seen before.
 
-        db['issues'][unicode(issue.id)]['latest_seen_comment_id'] = issue._comments[-1].id if issue._comments else None
+        """
+
+        vote_map = dict(record.vote_map or ())
+        bot_commented = bool(record.bot_commented)
+        for comment in comments:
+            if comment.user.login == self.current_user.login:
+                bot_commented = True
+            for command in command_scanner.comment_commands(comment):
+                if command.kind == command_scanner.VOTE:
+                    # If a user votes more than once, the final vote is what will count.
+                    vote_map[comment.user.login] = command.argument
+        record.vote_map = tuple(sorted(vote_map.items()))
+        record.bot_commented = bot_commented
+
+    def rebuild_derived_state(self, record, comments):
+        """Work out the state derived from comments from scratch, given all comments of the issue."""
+
+        record.vote_map = ()
+        record.bot_commented = False
+        self.update_derived_state(record, comments)
+
+    def repair_derived_state(self):
+        """Rebuild the state derived from comments of every recorded issue, using the stored comments. Issues
+        without stored comments get theirs rebuilt when next changed.
+
+        """
+
+        count = 0
+        for issue_id, record in self.database.iter_issues():
+            stored = self.comment_store.get(issue_id)
+            if stored is None:
+                record.vote_map = record.bot_commented = None
+            else:
+                # Only comments up to the latest seen one have been taken into account.
+                comments = [self.github.Comment.from_dict(c) for c in stored if record.latest_seen_comment_id is not None and c['id'] <= record.latest_seen_comment_id]
+                self.rebuild_derived_state(record, comments)
+                count += 1
+            self.database.put_issue(issue_id, record)
+        logbook.info("Rebuilt the derived state of %d issue(s) from stored comments." % count)
 
     def get_issue_changes(self, issue):
         """Examine the given issue against what is stored in the database to see how it's been changed, if it has."""
 
         # Issue must be recorded at this point.
-        record = self.database['issues'][unicode(issue.id)]
+        record = self.database.get_issue(issue.id)
 
         r = set()
-        if set(record['labels']) != set(label.name for label in issue.labels):
+        if record.label_mask != label_mask(label.name for label in issue.labels):
             r.add('labels')
 
-        if record['assignee_id'] != (int(issue.assignee.id) if issue.assignee else None):
+        if record.assignee_id != (int(issue.assignee.id) if issue.assignee else None):
             r.add('assignee')
 
-        if record['milestone_number'] != (int(issue.milestone.number) if issue.milestone else None):
+        if record.milestone_number != (int(issue.milestone.number) if issue.milestone else None):
             r.add('milestone')
 
         # _comments might not have been loaded yet in which case we can't detect changes there.
-        if hasattr(issue, '_comments') and issue.comments and (record['latest_seen_comment_id'] is None or record['latest_seen_comment_id'] != int(issue._comments[-1].id)):
+        if hasattr(issue, '_comments') and issue.comments and (record.latest_seen_comment_id is None or record.latest_seen_comment_id != int(issue._comments[-1].id)):
             r.add('comments')
 
         if issue._force_paper_trail:
@@ -213,6 +379,7 @@ class CappBot(object):
         milestone_title = defs.get('milestone')
         if milestone_title:
             milestone = self.github.Milestones.get_or_create_in_repository(self.repo_user, self.repo_name, milestone_title)
+            self.catalog.add_milestone(milestone.title)
             patch['milestone'] = milestone.number
 
         if defs.get('labels') is not None:
@@ -230,11 +397,44 @@ class CappBot(object):
                     raise
             logbook.info(u"Installed defaults %r for issue %s." % (patch, issue))
 
+    def load_comments(self, issue):
+        """Return the comments of the issue, downloading only the comments updated since the stored copy when possible."""
+
+        stored = self.comment_store.get(issue.id)
+        if stored is None and issue.comments and self.has_seen_issue(issue):
+            # We've seen the issue before but not kept its comments, e.g. because a previous run was killed before
+            # saving them.
+            self.lost_comment_downloads += 1
+        if stored is None or not issue.comments:
+            comments = self.github.Comments.by_issue(issue, per_page=100, all_pages=True)
+        else:
+            since = self.comment_store.since(issue.id)
+            comments = self.github.Comments.by_issue(issue, since=since, per_page=100, all_pages=True)
+
+            # Merge edited and new comments into the stored ones.
+            updated = dict((comment.id, comment) for comment in comments)
+            merged = [updated.pop(c['id'], None) or self.github.Comment.from_dict(c) for c in stored]
+            merged.extend(sorted(updated.values(), key=attrgetter('id')))
+
+            if len(merged) != issue.comments:
+                # Comments must have been deleted (or the store is out of date somehow.) Start over.
+                logbook.debug(u"Stored comments of %s are out of date. Downloading all comments." % issue)
+                comments = self.github.Comments.by_issue(issue, per_page=100, all_pages=True)
+            else:
+                logbook.debug(u"Downloaded %d new or updated comment(s) for %s since %s." % (len(comments), issue, since))
+                comments.entries = merged
+
+        # Post new comments to the plain comments URL, without any `since` parameter.
+        comments._location = '%s/comments' % issue.url
+
+        self.comment_store.put(issue.id, comments)
+        return comments
+
     def get_new_comments(self, issue):
         """Get all comments which are new since the last call to record_latest_seen_comment."""
 
-        record = self.database['issues'][unicode(issue.id)]
-        latest_seen_comment_id = record['latest_seen_comment_id']
+        record = self.database.get_issue(issue.id)
+        latest_seen_comment_id = record.latest_seen_comment_id
 
         comments = issue._comments
 
@@ -251,6 +451,17 @@ class CappBot(object):
 
         return []
 
+    def comments_to_scan(self, issue):
+        """Return the comments of the issue which handling it will scan for commands and votes: the new ones, or
+        all of them if the state derived from comments has to be worked out from scratch.
+
+        """
+
+        record = self.database.get_issue(issue.id)
+        if record is None or record.vote_map is None or record.bot_commented is None:
+            return issue._comments
+        return self.get_new_comments(issue)
+
     def send_message(self, user, subject, body):
         # TODO
         return
@@ -272,13 +483,19 @@ class CappBot(object):
     def user_may_set_milestone(self, user):
         return 'milestone' in self.settings.PERMISSIONS.get(user.login, ())
 
+    def lookup_metadata(self, lookup, name):
+        """Look up a name in the catalog, refreshing it from GitHub first if the name is missing from a catalog left by a previous run."""
+
+        found = lookup(name)
+        if found is None and not self.metadata_refreshed:
+            logbook.debug(u"%s not in the metadata catalog, refreshing it." % name)
+            self.refresh_metadata()
+            found = lookup(name)
+        return found
+
     def get_label_by_name(self, aLabel):
         """Get the label with the proper capitalisation among those available, or None if the label is not available."""
-        aLabel = aLabel.lower()
-        for label in self.known_labels:
-            if label.lower() == aLabel:
-                return label
-        return None
+        return self.lookup_metadata(self.catalog.label, aLabel)
 
     def get_milestone_title_by_title(self, aMilestone):
         """Get the milestone title with the proper capitalisation among those available, or None if the milestone is not available."""
@@ -286,11 +503,7 @@ class CappBot(object):
         if not aMilestone or not aMilestone.strip():
             return None
 
-        aMilestone = aMilestone.lower()
-        for milestone in self.known_milestones:
-            if milestone.lower() == aMilestone:
-                return milestone
-        return None
+        return self.lookup_metadata(self.catalog.milestone, aMilestone)
 
     def get_assignee_login_by_name(self, anAssignee):
         """Get the assignee login with the proper capitalisation among those available, or None if the assignee is not available.
@@ -302,11 +515,7 @@ class CappBot(object):
         if not anAssignee or not anAssignee.strip():
             return None
 
-        anAssignee = anAssignee.lower()
-        for assignee in self.collaborator_logins:
-            if assignee.lower() == anAssignee:
-                return assignee
-        return None
+        return self.lookup_metadata(self.catalog.collaborator, anAssignee)
 
     def add_label(self, new_label, issue_working_state):
         new_label_proper = self.get_label_by_name(new_label)
@@ -316,7 +525,7 @@ class CappBot(object):
             # label was added last later.
             issue_working_state['labels'].remove(new_label_proper)
         issue_working_state['labels'].append(new_label_proper)
-        if any(l.lower() == new_label_proper.lower() for l in self.settings.CLOSE_ISSUE_WHEN_CAPPBOT_ADDS_LABEL) or self.should_open_issue is new_label_proper:
+        if self.label_rules.closes_issue(new_label_proper) or self.should_open_issue is new_label_proper:
             self.should_open_issue = False
             self.should_close_issue = new_label_proper
 
@@ -341,14 +550,17 @@ class CappBot(object):
             return
 
         issue_working_state['labels'].remove(remove_label_proper)
-        if any(l.lower() == remove_label_proper.lower() for l in self.settings.OPEN_ISSUE_WHEN_CAPPBOT_REMOVES_LABEL) or self.should_close_issue is remove_label_proper:
+        self.label_removed(remove_label_proper)
+
+    def label_removed(self, remove_label_proper):
+        if self.label_rules.opens_issue(remove_label_proper) or self.should_close_issue == remove_label_proper:
             self.should_open_issue = remove_label_proper
             self.should_close_issue = False
 
     def remove_label_due_to_comment(self, remove_label, comment, issue_working_state):
         remove_label_proper = self.get_label_by_name(remove_label)
 
-        if not remove_label_proper in self.known_labels:
+        if remove_label_proper is None:
             logbook.info(u'Ignoring unknown label %s in comment %s by %s.' % (remove_label, comment.id, comment.user.login))
             self.send_message(comment.user, u'Unknown label', u'(Your comment)[%s] appears to request that the label `%s` is removed from the issue but this does not seems to be a valid label.' % (comment.url, remove_label))
             return
@@ -424,63 +636,26 @@ class CappBot(object):
         logbook.debug(u"Examining %d new comment(s) for %s" % (len(new_comments), issue))
 
         for comment in new_comments:
-            if not comment.body:
-                continue
-
-            for line in comment.body.split('\n'):
-                line = line.strip()
-
-                # Votes look just like +<label> or -<label> where the label is the number 1 or 0.
-                if VOTE_REGEX.match(line):
-                    continue
-
-                m = ADD_LABEL_REGEX.match(line)
-                if m:
-                    new_label = (m.group(1) or m.group(2)).lower()
-                    self.add_label_due_to_comment(new_label, comment, issue_working_state)
-                    continue
-
-                m = REMOVE_LABEL_REGEX.match(line)
-                if m:
-                    remove_label = m.group(1).lower()
-                    self.remove_label_due_to_comment(remove_label, comment, issue_working_state)
-                    continue
-
-                m = SET_MILESTONE_REGEX.match(line)
-                if m:
-                    new_milestone = m.group(1).lower()
-                    self.set_milestone_due_to_comment(new_milestone, comment, issue_working_state)
-                    continue
-
-                m = SET_ASSIGNEE_REGEX.match(line)
-                if m:
-                    new_assignee = m.group(1).lower()
-                    self.set_assignee_due_to_comment(new_assignee, comment, issue_working_state)
-                    continue
+            for command in command_scanner.comment_commands(comment):
+                if command.kind == command_scanner.ADD_LABEL:
+                    self.add_label_due_to_comment(command.argument.lower(), comment, issue_working_state)
+                elif command.kind == command_scanner.REMOVE_LABEL:
+                    self.remove_label_due_to_comment(command.argument.lower(), comment, issue_working_state)
+                elif command.kind == command_scanner.SET_MILESTONE:
+                    self.set_milestone_due_to_comment(command.argument.lower(), comment, issue_working_state)
+                elif command.kind == command_scanner.SET_ASSIGNEE:
+                    self.set_assignee_due_to_comment(command.argument.lower(), comment, issue_working_state)
 
         return issue_working_state
 
     def updated_state_per_label_removal_rules(self, issue, issue_working_state):
         issue_working_state = issue_working_state.copy()
-        for trigger_label, labels_to_remove in self.settings.WHEN_LABEL_REMOVE_LABELS.items():
-            if trigger_label in issue_working_state['labels']:
-                for label in labels_to_remove:
-                    if label in issue_working_state['labels']:
-                        logbook.info("Removing label %s due to label %s being set." % (label, trigger_label))
-                        # This ensures that side effects of removing the label kick in.
-                        self.remove_label(label, issue_working_state)
-
-        # Remove conflicting labels.
-        backwards = list(reversed(issue_working_state['labels']))
-        for n, label in enumerate(backwards):
-            if label in self.settings.MUTUALLY_EXCLUSIVE_LABELS:
-                for other_label in backwards[n + 1:]:
-                    if other_label in self.settings.MUTUALLY_EXCLUSIVE_LABELS:
-                        logbook.info("Removing label %s due to label %s being set." % (other_label, label))
-                        # This ensures that side effects of removing the label kick in.
-                        self.remove_label(other_label, issue_working_state)
-                # We've removed all conflicting labels at this stage so we're done.
-                break
+        # Remove superseded and conflicting labels.
+        issue_working_state['labels'], removed = self.label_rules.apply(issue_working_state['labels'])
+        for label, trigger_label in removed:
+            logbook.info("Removing label %s due to label %s being set." % (label, trigger_label))
+            # This ensures that side effects of removing the label kick in.
+            self.label_removed(label)
 
         return issue_working_state
 
@@ -490,37 +665,38 @@ class CappBot(object):
         The special syntax 0, +0 or -0 is also allowed to reset a previously made vote or to express a non counted
         opinion.
 
-        """
-
-        votes = {}
-        for comment in issue._comments:
-            if not comment.body:
-                continue
+        The votes are kept up to date by record_latest_seen_comment, so only the first count reads all comments.
 
-            for line in comment.body.split('\n'):
-                line = line.strip()
+        """
 
-                if VOTE_REGEX.match(line):
-                    # If a user votes more than once, the final vote is what will count.
-                    votes[comment.user.login] = int(line)
+        record = self.database.get_issue(issue.id)
+        rebuilt = record.vote_map is None
+        if rebuilt:
+            self.rebuild_derived_state(record, issue._comments)
 
         # Differentiate between a vote of 0 (e.g. +1, -1) and no votes.
-        score = sum(votes.values()) if len(votes) else None
-        record = self.database['issues'][unicode(issue.id)]
-        if score != record['votes']:
-            record['votes'] = score
+        score = sum(vote for login, vote in record.vote_map) if record.vote_map else None
+        if score != record.votes:
+            record.votes = score
+            self.database.put_issue(issue.id, record)
             return True
+        if rebuilt:
+            self.database.put_issue(issue.id, record)
         return False
 
     def get_vote_count(self, issue):
         """Return the vote tally for the issue."""
 
-        record = self.database['issues'][unicode(issue.id)]
-        return record['votes']
+        record = self.database.get_issue(issue.id)
+        return record.votes
 
     def did_comment_on(self, issue):
         """Return true if we've commented previously on this issue."""
 
+        record = self.database.get_issue(issue.id)
+        if record is not None and record.bot_commented is not None:
+            return record.bot_commented or any(comment.user.login == self.current_user.login for comment in self.get_new_comments(issue))
+
         return issue.comments > 0 and any(comment for comment in issue._comments if comment.user.login == self.current_user.login)
 
     def ensure_referenced_labels_exist(self):
@@ -528,16 +704,42 @@ class CappBot(object):
 
         defs = self.settings.NEW_ISSUE_DEFAULTS
         for label in defs.get('labels', []):
-            self.github.Labels.get_or_create_in_repository(self.repo_user, self.repo_name, label)
+            if label not in self.catalog.labels:
+                self.github.Labels.get_or_create_in_repository(self.repo_user, self.repo_name, label)
+                self.catalog.add_label(label)
+
+    def refresh_metadata(self):
+        """Read the labels, milestones and collaborators of the repository into the catalog.
 
-    def delay_after_update(self):
-        """Cause a delay after each paper trail message is posted to limit the maximum rate of
-        paper trail messages per minute.
+        The pages are requested conditionally, so when nothing has changed this costs no rate limit.
 
         """
 
-        if self.settings.UPDATE_DELAY:
-            time.sleep(self.settings.UPDATE_DELAY)
+        labels = [label.name for label in self.github.Labels.by_repository(self.repo_user, self.repo_name, per_page=100, all_pages=True)]
+        milestones = [milestone.title for milestone in self.github.Milestones.by_repository_all(self.repo_user, self.repo_name, per_page=100, all_pages=True)]
+        collaborators = [c.login for c in self.github.Collaborators.by_repository(self.repo_user, self.repo_name, per_page=100, all_pages=True)]
+        self.catalog.update(labels, milestones, collaborators)
+        self.metadata_refreshed = True
+        self.grant_collaborator_permissions()
+
+    def grant_collaborator_permissions(self):
+        # Everyone who's a collborator automatically has permissions to do everything. Someone who no longer is
+        # loses them again, even if CappBot keeps running.
+        permissions = dict((login, list(rights)) for login, rights in self.configured_permissions.items())
+        for login in self.catalog.collaborators:
+            permissions[login] = ['labels', 'assignee', 'milestone']
+        self.settings.PERMISSIONS = permissions
+
+    def prepare_metadata(self):
+        """Make the labels, milestones and collaborators of the repository known, from the catalog while it's fresh."""
+
+        if self.catalog.is_fresh() and not self.full_crawl:
+            logbook.debug(u"Using the metadata catalog from %s." % datetime.datetime.fromtimestamp(self.catalog.refreshed_at).isoformat())
+            self.grant_collaborator_permissions()
+        else:
+            self.refresh_metadata()
+
+        self.ensure_referenced_labels_exist()
 
     def check_prepare_issue(self, issue):
         """Phase 1 issue work: record new issues, install issue defaults, mark déjà vu issues,
@@ -545,6 +747,12 @@ class CappBot(object):
 
         """
 
+        self.check_issue(issue)
+        self.prepare_issue(issue)
+
+    def check_issue(self, issue):
+        """Decide whether the issue needs any work and if so retrieve its comments."""
+
         issue._should_ignore = False
         issue._force_paper_trail = False
 
@@ -563,17 +771,13 @@ class CappBot(object):
             return
 
         # We'll need this now or later, or both.
-        issue._comments = self.github.Comments.by_issue(issue, per_page=100, all_pages=True)
+        issue._comments = self.load_comments(issue)
 
-        if self.settings.AVOID_RATE_LIMIT:
-            remaining = issue._comments.get_rate_limit_remaining()
+    def prepare_issue(self, issue):
+        """Record new issues, install issue defaults and mark déjà vu issues."""
 
-            # Remaining will be None if the 'empty comments' optimisation kicked in.
-            if not remaining is None:
-                delay = 3600.0 / max(1, remaining)
-                if delay > 1:
-                    logbook.debug("Approaching rate limit (%d requests remaining). Sleeping for %.1fs." % (remaining, delay))
-                    time.sleep(delay)
+        if issue._should_ignore:
+            return
 
         if self.has_seen_issue(issue):
             # It's not a new issue if we have recorded it previously.
@@ -606,6 +810,57 @@ class CappBot(object):
 
         self.record_issue(issue)
 
+    def apply_issue_mutation(self, issue, mutation):
+        """Apply the changes in `mutation` to the issue with a single PATCH request.
+
+        The mutation is a dict of issue fields. The milestone is given by title and created if necessary.
+        If the combined request fails, each change is retried on its own so that the error can be pinned
+        to a field and the other changes still go through.
+
+        """
+
+        if not mutation or self.dry_run:
+            return
+
+        patch = dict(mutation)
+        if 'milestone' in patch:
+            try:
+                milestone = self.github.Milestones.get_or_create_in_repository(self.repo_user, self.repo_name, patch['milestone'])
+            except:
+                logbook.error(self.mutation_error_message(issue, 'milestone', patch['milestone']))
+                raise
+            patch['milestone'] = milestone.number if milestone else None
+
+        try:
+            issue.patch(**patch)
+            return
+        except:
+            if len(patch) == 1:
+                field = patch.keys()[0]
+                logbook.error(self.mutation_error_message(issue, field, mutation[field]))
+                raise
+            logbook.warning(u"Unable to change %s with attributes %r. Trying one change at a time." % (issue, patch))
+
+        error = None
+        for field in MUTATION_FIELDS:
+            if field not in patch:
+                continue
+            try:
+                issue.patch(**{field: patch[field]})
+            except:
+                logbook.error(self.mutation_error_message(issue, field, mutation[field]))
+                error = error or sys.exc_info()
+
+        if error:
+            raise error[0], error[1], error[2]
+
+    def mutation_error_message(self, issue, field, value):
+        if field == 'state':
+            return u"Unable to %s %s" % ('open' if value == 'open' else 'close', issue)
+        if field == 'title':
+            return u"Unable to set the title of %s to %s" % (issue, value)
+        return u"Unable to set %s %s to %s" % (issue, field, value)
+
     def handle_issue_changes(self, issue):
         if not self.did_comment_on(issue):
             # This issue might not have been changed since we first saw it, but we've never commented
@@ -641,36 +896,21 @@ class CappBot(object):
         # Remove labels superseded by new labels.
         issue_working_state = self.updated_state_per_label_removal_rules(issue, issue_working_state)
 
-        # Perform each patch separately so that an error with one does not disrupt the others.
+        # Collect all changes to the issue into a single mutation, applied with as few requests as possible.
+        mutation = {}
+
         if set(issue_working_state['labels']) != set(original_labels):
             changes.add('labels')
-            if not self.dry_run:
-                try:
-                    issue.patch(labels=sorted(map(unicode, issue_working_state['labels'])))
-                except:
-                    logbook.error(u"Unable to set %s labels to %s" % (issue, sorted(map(unicode, issue_working_state['labels']))))
-                    raise
+            mutation['labels'] = sorted(map(unicode, issue_working_state['labels']))
 
         if issue_working_state['milestone'] != get_milestone_title(issue.milestone):
             changes.add('milestone')
-            if not self.dry_run:
-                try:
-                    milestone = self.github.Milestones.get_or_create_in_repository(self.repo_user, self.repo_name, issue_working_state['milestone'])
-                    issue.patch(milestone=milestone.number if milestone else None)
-                except:
-                    logbook.error(u"Unable to set %s milestone to %s" % (issue, issue_working_state['milestone']))
-                    raise
+            mutation['milestone'] = issue_working_state['milestone']
 
         if issue_working_state['assignee'] != get_user_login(issue.assignee):
             changes.add('assignee')
-            if not self.dry_run:
-                try:
-                    issue.patch(assignee=issue_working_state['assignee'])
-                except:
-                    logbook.error(u"Unable to set %s assignee to %s" % (issue, issue_working_state['assignee']))
-                    raise
+            mutation['assignee'] = issue_working_state['assignee']
 
-        # Post paper trail.
         changes = changes.difference(set(['comments']))
         if did_change_votes:
             changes.add('votes')
@@ -687,30 +927,24 @@ class CappBot(object):
             elif m:
                 logbook.info(u"Clearing vote from title of %s: '%s'" % (issue, issue_title))
 
-            if not self.dry_run:
-                try:
-                    issue.patch(title=issue_title)
-                except:
-                    logbook.error(u"Unable to set the title of %s to %s" % (issue, issue_title))
-                    raise
+            mutation['title'] = issue_title
 
         if issue_working_state['labels'] != original_labels:
             changes.add('labels')
-        if len(changes):
-            # If we're going to reopen the issue, do that before leaving the paper trail.
-            if self.should_open_issue and issue.state != 'open':
-                logbook.info(u'Reopening %s due to label %s being removed' % (issue, self.should_open_issue))
-                if not self.dry_run:
-                    try:
-                        issue.patch(state="open")
-                    except:
-                        logbook.error(u"Unable to open %s" % issue)
-                        raise
 
+        # If we're going to reopen the issue, do that before leaving the paper trail, so along with the rest.
+        if len(changes) and self.should_open_issue and issue.state != 'open':
+            logbook.info(u'Reopening %s due to label %s being removed' % (issue, self.should_open_issue))
+            mutation['state'] = 'open'
+
+        self.apply_issue_mutation(issue, mutation)
+
+        # Post paper trail.
+        if len(changes):
             # Note that we assume the issue_working_state has been properly installed into the issue. This
             # makes the messages appear right in dry-run mode. However, if say the assignee wasn't successfully
             # changed, CappBot's message might suggest it was. I think that's fine.
-            msg = self.settings.getPaperTrailMessage(issue_working_state['assignee'], issue_working_state['milestone'], issue_working_state['labels'], self.get_vote_count(issue))
+            msg = self.paper_trail.render(issue_working_state['assignee'], issue_working_state['milestone'], issue_working_state['labels'], self.get_vote_count(issue))
             comment = self.github.Comment()
             comment.body = msg
             logbook.info(u"Adding paper trail for %s (changes: %s): '%s'" % (issue, ", ".join(changes), msg))
@@ -720,8 +954,8 @@ class CappBot(object):
                 except:
                     logbook.error(u"Unable to comment on %s" % issue)
                     raise
+                self.comment_store.put(issue.id, issue._comments)
                 self.record_latest_seen_comment(issue)
-                self.delay_after_update()
 
             # Close the issue after leaving the paper trail. It looks more natural.
             if self.should_close_issue and issue.state != 'closed':
@@ -736,37 +970,167 @@ class CappBot(object):
         # Now record the latest labels etc so we don't react to these same changes the next time.
         self.record_issue(issue)
 
-    def run(self):
-        logbook.debug("Logged in as %s." % self.current_user.login)
+    def stop(self):
+        """Ask a run, or serve or run_forever, to stop after the issue at hand. Safe to call from a signal handler."""
 
-        self.ensure_referenced_labels_exist()
+        self.stop_requested = True
+        self.wake.set()
 
-        self.known_labels = set(label.name for label in self.github.Labels.by_repository(self.repo_user, self.repo_name, per_page=100, all_pages=True))
+    def run_forever(self, interval, save=None):
+        """Run every `interval` seconds until stopped, keeping everything learnt in between, like the current user,
+        the metadata catalog and cached pages.
 
-        self.known_milestones = set(milestone.title for milestone in self.github.Milestones.by_repository_all(self.repo_user, self.repo_name, per_page=100, all_pages=True))
+        `save` is called after each run. A run which fails is logged and tried again next time.
 
-        # Everyone who's a collborator automatically has permissions to do everything.
-        self.collaborator_logins = set(c.login for c in self.github.Collaborators.by_repository(self.repo_user, self.repo_name, per_page=100, all_pages=True))
-        for login in self.collaborator_logins:
-            self.settings.PERMISSIONS[login] = ['labels', 'assignee', 'milestone']
+        """
 
-        # Find all issues.
-        issues = self.github.Issues.by_repository_all(self.repo_user, self.repo_name, per_page=100, all_pages=True)
+        while not self.stop_requested:
+            started = time.time()
+            try:
+                self.run()
+            except Exception:
+                logbook.exception(u"The run started at %s failed." % datetime.datetime.fromtimestamp(started).isoformat())
+            if save:
+                save()
+            # GitHub may ask for events to be polled less often, e.g. when it's busy.
+            self.wake.wait(max(0, max(interval, self.events_poll_interval or 0) - (time.time() - started)))
+
+    def run_issue(self, number):
+        """Examine and handle the single issue `number`, e.g. after being told that it changed."""
+
+        if number in self.ignore:
+            return
 
-        logbook.debug("Found %d issue(s)." % len(issues))
+        issue = self.github.Issue.by_number(self.repo_user, self.repo_name, number)
+        self.check_prepare_issue(issue)
+        if not issue._should_ignore:
+            self.handle_issue_changes(issue)
 
-        # Phase 1: check, prepare and record issues.
-        for issue in issues:
-            if issue.number in self.ignore:
-                continue
-            self.check_prepare_issue(issue)
+    def serve(self, issues, save=None):
+        """Handle the issues whose numbers arrive on the `IssueQueue` `issues` one at a time, until interrupted.
+
+        `save` is called after each issue. Issues handled this way don't count towards INCREMENTAL_SYNC, so a
+        regular run still picks up any changes no webhook was delivered for.
+
+        """
+
+        logbook.debug("Logged in as %s." % self.current_user.login)
+        self.prepare_metadata()
 
-        # Phase 2: react to changed issues.
-        for issue in issues:
-            if issue.number in self.ignore or issue._should_ignore:
+        while not self.stop_requested:
+            # Wake up now and then so that KeyboardInterrupt gets through.
+            number = issues.get(timeout=1)
+            if number is None:
                 continue
 
-            self.handle_issue_changes(issue)
+            if not self.catalog.is_fresh():
+                self.refresh_metadata()
+            else:
+                # A comment may use a label, milestone or collaborator added since the last refresh.
+                self.metadata_refreshed = False
+            try:
+                self.run_issue(number)
+            except Exception:
+                # One bad issue mustn't stop the server. It will be retried on the next event or run.
+                logbook.exception(u"Unable to handle issue %d." % number)
+            if save:
+                save()
+
+    def checkpoint(self, examined):
+        """Save everything done so far and note how far into the run we've come."""
+
+        self.database.set_meta('checkpoint', {'started': self.run_started, 'at': datetime.datetime.now().isoformat(), 'issues': examined})
+        if not self.dry_run:
+            self.database.save()
+            self.comment_store.save()
+            self.catalog.save()
+            self.github.save()
+        self.last_checkpoint = (examined, time.time())
+
+    def should_checkpoint(self, examined):
+        last_examined, last_time = self.last_checkpoint
+        return examined - last_examined >= self.settings.CHECKPOINT_ISSUES or time.time() - last_time >= self.settings.CHECKPOINT_SECONDS
+
+    def run(self):
+        logbook.debug("Logged in as %s." % self.current_user.login)
+
+        self.run_started = datetime.datetime.now().isoformat()
+        self.last_checkpoint = (0, time.time())
+        self.lost_comment_downloads = 0
+        self.events_seen = None
+        # A name missing from the catalog may cause one refresh per run.
+        self.metadata_refreshed = False
+        # A checkpoint left by the previous run means it never finished.
+        interrupted = self.database.get_meta('checkpoint')
+        if interrupted:
+            logbook.warning("The previous run, started at %(started)s, was interrupted. Its last checkpoint was at %(at)s after %(issues)d issue(s); work done after that may have been lost." % interrupted)
+            self.database.set_meta('interrupted_runs', (self.database.get_meta('interrupted_runs') or 0) + 1)
+
+        self.prepare_metadata()
+
+        # Go through all issues, or just the ones changed since last time. Each issue is fully handled
+        # before the next one is looked at, so work starts as soon as the first page of issues arrives.
+        # With a pool of analysis processes, the comments of a batch of issues are downloaded first and
+        # scanned in the pool, and then the issues of the batch are handled one by one as usual.
+        pool = self.pool
+        batch_size = self.settings.ANALYSIS_BATCH if pool else 1
+        # Ignored issues count as examined, like the issues handled.
+        ignored = 0
+        handled = 0
+        issues = self.iter_issues()
+        try:
+            while not self.stop_requested:
+                batch = list(itertools.islice(issues, batch_size))
+                if not batch:
+                    break
+                listed = len(batch)
+                batch = [issue for issue in batch if issue.number not in self.ignore]
+                ignored += listed - len(batch)
+
+                # Phase 1: check the issue and retrieve its comments.
+                for issue in batch:
+                    self.check_issue(issue)
+                if pool:
+                    command_scanner.analyse_comments(pool, [self.comments_to_scan(issue) for issue in batch if not issue._should_ignore])
+
+                for issue in batch:
+                    if self.stop_requested:
+                        break
+                    handled += 1
+                    # Phase 2: prepare and record the issue.
+                    self.prepare_issue(issue)
+
+                    # Phase 3: react to changes.
+                    if not issue._should_ignore:
+                        self.handle_issue_changes(issue)
+
+                    if self.should_checkpoint(ignored + handled):
+                        self.checkpoint(ignored + handled)
+        finally:
+            # Don't leave a page of issues downloading in the background after stopping early.
+            if hasattr(issues, 'close'):
+                issues.close()
+
+        logbook.debug("Examined %d issue(s)." % (ignored + handled))
+        synced_until = self.get_listing_synced_until()
+        if self.stop_requested:
+            # The issues not yet examined have to be listed again next time.
+            logbook.info("Stopped early as requested.")
+            synced_until = None
+        if interrupted or self.lost_comment_downloads:
+            logbook.info("Lost work: downloaded all comments again for %d issue(s) whose stored comments were missing. %d run(s) interrupted so far." % (self.lost_comment_downloads, self.database.get_meta('interrupted_runs') or 0))
+
+        # Every issue updated before the listing started has now been handled. Issues updated since, including
+        # by CappBot itself, will be listed again next time, which is harmless.
+        if synced_until and (self.issues_synced_until is None or synced_until > self.issues_synced_until):
+            self.issues_synced_until = synced_until
+        if self.events_seen is not None and not self.stop_requested:
+            self.database.set_meta('events_seen', self.events_seen)
+        self.database.set_meta('checkpoint', None)
+
+        if self.settings.HTTP_POOL_STATS:
+            for stats in self.github.connection_stats():
+                logbook.debug(u"Connection %(connection)d: %(requests)d request(s), %(errors)d error(s), %(reconnects)d reconnect(s), %(bytes_received)d bytes received in %(seconds).1fs." % stats)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description=__doc__)
@@ -783,32 +1147,45 @@ if __name__ == '__main__':
         help='in case of déjà vu, record the issue as fully up to date')
     parser.add_argument('--ignore', metavar='NUMBER', action='append',
         help='complete ignore issue NUMBER during this run. Can be specified multiple times.')
+    parser.add_argument('--full-crawl', action='store_true', default=False, dest='full_crawl',
+        help='examine all issues rather than only those updated since the last run')
+    parser.add_argument('--processes', metavar='N', type=int, default=None,
+        help='scan comments for commands and votes in N processes (default: ANALYSIS_PROCESSES from the settings)')
+    parser.add_argument('--serve', action='store_true', default=False,
+        help='instead of examining all changed issues, receive webhooks and handle each issue they are about (see WEBHOOK_SECRET)')
+    parser.add_argument('--daemon', action='store_true', default=False,
+        help='keep running, examining changed issues every DAEMON_INTERVAL seconds')
+    parser.add_argument('--export-json', metavar='FILE',
+        help='write the database to FILE as JSON and exit')
+    parser.add_argument('--rebuild-derived-state', action='store_true', default=False, dest='rebuild_derived_state',
+        help='rebuild the votes and other state derived from comments of every issue from the stored comments, and exit')
 
     args = parser.parse_args()
 
     settings = imp.load_source('settings', args.settings if os.path.exists(args.settings) else os.path.join(os.path.dirname(__file__), 'default_settings.py'))
 
-    DATABASE = settings.DATABASE
-    NEW_DATABASE = DATABASE + ".new"
+    # Start the analysis processes while this is still the only thread, since a process forked while another thread
+    # holds a lock would wait for that lock forever. The same processes serve every run of --daemon.
+    processes = args.processes or settings.ANALYSIS_PROCESSES
+    pool = multiprocessing.Pool(processes) if processes > 1 and not args.export_json else None
+
+    database_options = {'compact_size': settings.DATABASE_COMPACT_SIZE, 'snapshot_format': settings.DATABASE_SNAPSHOT_FORMAT, 'compression': settings.DATABASE_COMPRESSION} if settings.DATABASE_BACKEND == 'json' else {}
+    database = open_database(settings.DATABASE_BACKEND, settings.DATABASE, read_only=args.dry_run or bool(args.export_json), **database_options)
 
-    if os.path.exists(NEW_DATABASE):
-        # If we failed to mv the new database to the old name, that might have been because we crashed while writing the
-        # new one, in which case the old database might be better to preserve. Or it might be that we wrote .new but
-        # failed to mv() in which case the new is better to preserve. So this error situation requires manual
-        # intervention.
-        raise Exception("{} exists. Manually resolve if {} or {} is less bad and then mv and rm by hand to resolve.".format(NEW_DATABASE, DATABASE, NEW_DATABASE))
+    if args.export_json:
+        with open(args.export_json, 'wb') as f:
+            json.dump(database.to_dict(), f, indent=1, sort_keys=True)
+        database.close()
+        sys.exit(0)
 
-    if os.path.exists(DATABASE):
-        with open(DATABASE, 'rb') as f:
-            database = json.load(f)
-    else:
-        database = {}
+    comment_store = CommentStore(settings.COMMENT_STORE)
+    catalog = MetadataCatalog(settings.METADATA_CATALOG, settings.METADATA_TTL)
 
     def save_database():
         if not args.dry_run:
-            with open(NEW_DATABASE, 'wb') as f:
-                json.dump(database, f, indent=1, sort_keys=True)
-            shutil.move(NEW_DATABASE, DATABASE)
+            database.save()
+            comment_store.save()
+            catalog.save()
 
     # Write to the database immediately to verify we have write permission and disk space.
     # We don't want to find out that there is a problem at the end and lose all the data.
@@ -819,7 +1196,36 @@ if __name__ == '__main__':
     with null_handler.applicationbound():
         with logbook.StreamHandler(args.log, level=log_level, bubble=False) as log_handler:
             with log_handler.applicationbound():
+                cappbot = CappBot(settings, database, dry_run=args.dry_run, memorise_forgotten=args.memorise_forgotten, ignore=[int(n) for n in args.ignore] if args.ignore else [], full_crawl=args.full_crawl, comment_store=comment_store, catalog=catalog, pool=pool)
+                # Finish the issue at hand and save everything before exiting.
+                signal.signal(signal.SIGTERM, lambda signum, frame: cappbot.stop())
                 try:
-                    CappBot(settings, database, dry_run=args.dry_run, memorise_forgotten=args.memorise_forgotten, ignore=[int(n) for n in args.ignore] if args.ignore else []).run()
+                    if args.rebuild_derived_state:
+                        cappbot.repair_derived_state()
+                    elif args.daemon:
+                        def save_all():
+                            save_database()
+                            if not args.dry_run:
+                                cappbot.github.save()
+
+                        try:
+                            cappbot.run_forever(settings.DAEMON_INTERVAL, save=save_all)
+                        except KeyboardInterrupt:
+                            pass
+                    elif args.serve:
+                        server = WebhookServer((settings.WEBHOOK_HOST, settings.WEBHOOK_PORT), settings.WEBHOOK_SECRET, settings.GITHUB_REPOSITORY)
+                        server.start()
+                        try:
+                            cappbot.serve(server.issues, save=save_database)
+                        except KeyboardInterrupt:
+                            pass
+                        finally:
+                            server.stop()
+                    else:
+                        cappbot.run()
                 finally:
                     save_database()
+                    database.close()
+                    cappbot.github.close()
+                    if pool:
+                        pool.terminate()
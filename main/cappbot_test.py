@@ -15,14 +15,20 @@
 # THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #
 
-from mock import Mock, call
+from mock import Mock, call, patch
+import doctest
 import imp
 import json
 import logbook
+import multiprocessing
 import os
 import unittest
 
 from cappbot import CappBot
+from metadata_catalog import MetadataCatalog
+from webhook import IssueQueue
+import command_scanner
+import metadata_catalog
 import mini_github3
 
 
@@ -47,7 +53,7 @@ class TestCappBot(unittest.TestCase):
         self.settings.GITHUB_REPOSITORY = "alice_tester/blox"
         self.settings.PERMISSIONS['bob'] = ['labels']
         self.settings.AVOID_RATE_LIMIT = False
-        self.settings.UPDATE_DELAY = 0
+        self.settings.WRITES_PER_HOUR = None
         self.database = {'first_run': '2012-01-01T22:06:51Z'}
         self.cappbot = CappBot(self.settings, self.database)
         # Replace the GitHub API with a mock.
@@ -164,16 +170,35 @@ class TestCappBot(unittest.TestCase):
 
         self.cappbot.github.Issues.by_repository = Mock(return_value=issues)
         self.cappbot.github.Issues.by_repository_all = Mock(return_value=issues)
+        # GitHub sends the first page of the listing a few days after the fixture issues were last updated.
+        issues_page = mini_github3.Issues.from_dict([])
+        issues_page._date = 'Wed, 25 Apr 2012 12:00:00 GMT'
+
+        def iter_by_repository(*args, **kwargs):
+            if kwargs.get('on_page'):
+                kwargs['on_page'](issues_page)
+            return iter(issues)
+
+        self.cappbot.github.Issues.iter_by_repository = Mock(side_effect=iter_by_repository)
+        self.cappbot.github.Issues.iter_by_repository_all = Mock(side_effect=iter_by_repository)
+
+        def install_comment_post_patch(a_list):
+            def mock_post(a_new_comment):
+                # Like GitHub, fill in the fields of the newly created comment.
+                a_new_comment.update_from_dict(self.fake_comment(self.cappbot_user, a_new_comment.body))
+                a_list.entries.append(a_new_comment)
+            a_list.post = Mock(side_effect=mock_post)
 
         for n, issue in enumerate(issues):
             issue._mock_comments = mini_github3.Comments.from_dict(comments[n]) if n < len(comments) else mini_github3.Comments(entries=[])
             issue.comments = len(issue._mock_comments)
-            install_list_post_patch(issue._mock_comments)
+            install_comment_post_patch(issue._mock_comments)
 
         def get_comments(issue, **kwargs):
             return issue._mock_comments
 
         self.cappbot.github.Comments.by_issue = Mock(side_effect=get_comments)
+        self.cappbot.github.Comment = mini_github3.Comment
 
         return issues, labels, milestones
 
@@ -186,12 +211,207 @@ class TestCappBot(unittest.TestCase):
         self.assertEquals(issues[0]._mock_comments[-1].body, "**Milestone:** Someday.  **Label:** #new.  **What's next?** A reviewer should examine this issue.")
         issues[0]._mock_comments.post.assert_called_with(issues[0]._mock_comments[-1])
 
+    def test_incremental_sync(self):
+        issues, labels, milestones = self.configure_github_mock(load_fixture('issues.json')[7:8], load_fixture('labels.json'), load_fixture('milestones.json'))
+        self.database['issues_synced_until'] = '2012-04-01T00:00:00Z'
+
+        self.cappbot.run()
+
+        self.cappbot.github.Issues.iter_by_repository.assert_called_with("alice_tester", "blox", state='all', since='2012-04-01T00:00:00Z', on_page=self.cappbot.note_listing_page, per_page=100)
+        self.assertFalse(self.cappbot.github.Issues.iter_by_repository_all.called)
+        # The next run starts from when the listing started, less a minute, not from the newest update seen.
+        self.assertEquals(self.database['issues_synced_until'], '2012-04-25T11:59:00Z')
+
+    def test_incremental_sync_own_changes(self):
+        issues, labels, milestones = self.configure_github_mock(load_fixture('issues.json')[6:8], load_fixture('labels.json'), load_fixture('milestones.json'))
+        self.database['issues_synced_until'] = '2012-04-01T00:00:00Z'
+        patch_issue = issues[1].patch.side_effect
+
+        def patch_updating(**kwargs):
+            # Like GitHub, answer a PATCH with the issue as updated just now.
+            patch_issue(**kwargs)
+            issues[1].updated_at = '2012-04-25T12:00:05Z'
+        issues[1].patch.side_effect = patch_updating
+
+        self.cappbot.run()
+
+        self.assertTrue(issues[1].patch.called)
+        # A comment made on the first issue while the second one was being handled must be found next time.
+        self.assertEquals(self.database['issues_synced_until'], '2012-04-25T11:59:00Z')
+
+    def test_full_crawl(self):
+        issues, labels, milestones = self.configure_github_mock(load_fixture('issues.json')[7:8], load_fixture('labels.json'), load_fixture('milestones.json'))
+        self.database['issues_synced_until'] = '2012-04-01T00:00:00Z'
+        self.cappbot.full_crawl = True
+
+        self.cappbot.run()
+
+        self.assertTrue(self.cappbot.github.Issues.iter_by_repository_all.called)
+        self.assertFalse(self.cappbot.github.Issues.iter_by_repository.called)
+
+    def configure_events_mock(self, events):
+        """Make the events, given as (id, time of day created, type, issue number) in feed order, the only page of events."""
+
+        page = mini_github3.Events.from_dict([{'id': str(event_id), 'created_at': '2012-04-25T%s:00Z' % created_at, 'type': event_type, 'payload': {'pull_request' if event_type.startswith('PullRequest') else 'issue': {'number': number}} if number else {}} for event_id, created_at, event_type, number in events])
+        page.deliver = Mock()
+        page.next_page = Mock(return_value=None)
+        page._poll_interval = '60'
+        page._date = 'Wed, 25 Apr 2012 12:00:00 GMT'
+        self.cappbot.github.Events.by_repository = Mock(return_value=page)
+        self.settings.POLL_EVENTS = True
+
+    def test_poll_events(self):
+        issues, labels, milestones = self.configure_github_mock(load_fixture('issues.json')[7:8], load_fixture('labels.json'), load_fixture('milestones.json'))
+        self.cappbot.github.Issue.by_number = Mock(return_value=issues[0])
+        self.configure_events_mock([(104, '11:58', 'IssueCommentEvent', 1), (103, '11:57', 'WatchEvent', None), (102, '11:52', 'IssuesEvent', 1), (101, '11:50', 'IssuesEvent', 5), (100, '11:40', 'IssuesEvent', 3)])
+        self.database['issues_synced_until'] = '2012-04-01T00:00:00Z'
+        self.database['events_seen'] = {'newest_at': '2012-04-25T11:50:00Z', 'ids': ['101']}
+
+        self.cappbot.run()
+
+        self.cappbot.github.Issue.by_number.assert_called_once_with('alice_tester', 'blox', 1)
+        self.assertFalse(self.cappbot.github.Issues.iter_by_repository.called)
+        self.assertEquals(self.database['events_seen'], {'newest_at': '2012-04-25T11:58:00Z', 'ids': ['104', '103']})
+        # Only a listing of issues moves this on.
+        self.assertEquals(self.database['issues_synced_until'], '2012-04-01T00:00:00Z')
+        self.assertEquals(self.cappbot.events_poll_interval, 60)
+
+    def test_poll_events_late(self):
+        # Event 99 was published after event 101, which the previous poll saw.
+        self.configure_events_mock([(104, '11:58', 'IssueCommentEvent', 1), (101, '11:50', 'IssuesEvent', 5), (99, '11:48', 'IssueCommentEvent', 6), (100, '11:40', 'IssuesEvent', 3)])
+        self.database['events_seen'] = {'newest_at': '2012-04-25T11:50:00Z', 'ids': ['101']}
+
+        self.assertEquals(self.cappbot.poll_events(), set([1, 6]))
+
+    def test_poll_events_pull_requests(self):
+        self.configure_events_mock([(104, '11:58', 'PullRequestEvent', 9), (103, '11:57', 'PullRequestReviewCommentEvent', 7), (102, '11:52', 'IssueCommentEvent', 1), (101, '11:50', 'IssuesEvent', 5), (100, '11:40', 'IssuesEvent', 3)])
+        self.database['events_seen'] = {'newest_at': '2012-04-25T11:50:00Z', 'ids': ['101']}
+
+        self.assertEquals(self.cappbot.poll_events(), set([1, 7, 9]))
+
+    def test_poll_events_first(self):
+        self.configure_events_mock([(104, '11:58', 'IssueCommentEvent', 1), (103, '11:50', 'IssuesEvent', 5)])
+        page = self.cappbot.github.Events.by_repository.return_value
+
+        self.assertEquals(self.cappbot.poll_events(), None)
+
+        # Only the newest events matter the first time.
+        self.assertFalse(page.next_page.called)
+        self.assertEquals(self.cappbot.events_seen, {'newest_at': '2012-04-25T11:58:00Z', 'ids': ['104']})
+
+    def test_poll_events_dropped(self):
+        issues, labels, milestones = self.configure_github_mock(load_fixture('issues.json')[7:8], load_fixture('labels.json'), load_fixture('milestones.json'))
+        self.cappbot.github.Issue.by_number = Mock()
+        self.configure_events_mock([(104, '11:58', 'IssueCommentEvent', 1), (103, '11:50', 'IssuesEvent', 5)])
+        self.database['issues_synced_until'] = '2012-04-01T00:00:00Z'
+        self.database['events_seen'] = {'newest_at': '2012-04-25T11:00:00Z', 'ids': ['90']}
+
+        self.cappbot.run()
+
+        # The events between 10:55 and 11:50 are missing, so the changed issues have to be listed.
+        self.assertFalse(self.cappbot.github.Issue.by_number.called)
+        self.cappbot.github.Issues.iter_by_repository.assert_called_with("alice_tester", "blox", state='all', since='2012-04-01T00:00:00Z', on_page=self.cappbot.note_listing_page, per_page=100)
+        self.assertEquals(self.database['events_seen']['newest_at'], '2012-04-25T11:58:00Z')
+        self.assertEquals(self.database['issues_synced_until'], '2012-04-25T11:59:00Z')
+
+    def test_metadata_catalog(self):
+        issues, labels, milestones = self.configure_github_mock(load_fixture('issues.json')[7:8], load_fixture('labels.json'), load_fixture('milestones.json'))
+        self.cappbot.catalog = MetadataCatalog(ttl=60)
+
+        self.cappbot.run()
+        self.assertEquals(self.cappbot.get_label_by_name('foundation'), 'Foundation')
+        self.assertEquals(self.cappbot.get_assignee_login_by_name('Alice_Tester'), 'alice_tester')
+
+        # While the catalog is fresh the next run doesn't ask GitHub.
+        self.cappbot.metadata_refreshed = False
+        self.cappbot.github.Labels.by_repository.reset_mock()
+        self.cappbot.run()
+        self.assertEquals(self.cappbot.github.Labels.by_repository.call_count, 0)
+
+        # Until it meets a name it doesn't know.
+        labels.entries.append(mini_github3.Label.from_dict({'name': 'Regression'}))
+        self.assertEquals(self.cappbot.get_label_by_name('regression'), 'Regression')
+        self.assertEquals(self.cappbot.github.Labels.by_repository.call_count, 1)
+        self.assertEquals(self.cappbot.get_label_by_name('nonsense'), None)
+        self.assertEquals(self.cappbot.github.Labels.by_repository.call_count, 1)
+
+    def test_checkpoint(self):
+        issues, labels, milestones = self.configure_github_mock(load_fixture('issues.json')[5:8], load_fixture('labels.json'), load_fixture('milestones.json'))
+        self.settings.CHECKPOINT_ISSUES = 2
+        self.cappbot.comment_store.save = Mock()
+
+        self.cappbot.run()
+
+        # Saved after two of the three issues. Saving at the end is up to the caller.
+        self.assertEquals(self.cappbot.comment_store.save.call_count, 1)
+        self.assertEquals(self.cappbot.github.save.call_count, 1)
+        # A completed run leaves no checkpoint behind.
+        self.assertEquals(self.database['checkpoint'], None)
+
+    def test_interrupted_run(self):
+        issues, labels, milestones = self.configure_github_mock(load_fixture('issues.json')[7:8], load_fixture('labels.json'), load_fixture('milestones.json'))
+        self.database['checkpoint'] = {'started': '2012-04-01T00:00:00', 'at': '2012-04-01T00:10:00', 'issues': 50}
+
+        self.cappbot.run()
+
+        self.assertTrue(any(u'The previous run, started at 2012-04-01T00:00:00, was interrupted.' in record for record in self.log_handler.formatted_records))
+        self.assertTrue(any(u'Lost work: ' in record for record in self.log_handler.formatted_records))
+        self.assertEquals(self.database['interrupted_runs'], 1)
+
     def fake_comment(self, owner, body):
         number = getattr(self, 'fake_comment_number', 5207158) + 1
         self.fake_comment_number = number
         # Date doesn't increase with new comments which maybe isn't entirel realistic.
         return {'body': body, 'url': 'https://api.github.com/repos/alice_tester/blox/issues/comments/%d' % number, 'created_at': '2012-04-18T19:54:40Z', 'updated_at': '2012-04-18T19:54:40Z', 'user': owner.to_dict(), 'id': number}
 
+    def test_incremental_comments(self):
+        issues, labels, milestones = self.configure_github_mock(load_fixture('issues.json')[7:8], load_fixture('labels.json'), load_fixture('milestones.json'), [[self.fake_comment(self.alice_user, 'Hi.')]])
+
+        self.cappbot.run()
+        self.assertEquals(len(self.cappbot.comment_store.get(issues[0].id)), 2)
+        since = self.cappbot.comment_store.since(issues[0].id)
+
+        # Only the new comment is served when asked for comments since the last stored one.
+        new_comment = mini_github3.Comment.from_dict(self.fake_comment(self.alice_user, '+enhancement'))
+        issues[0]._mock_comments.entries.append(new_comment)
+        issues[0].comments = len(issues[0]._mock_comments)
+        issues[0].updated_at = '2012-04-20T00:00:00Z'
+        new_comments = mini_github3.Comments(entries=[new_comment])
+        new_comments.post = issues[0]._mock_comments.post
+        self.cappbot.github.Comments.by_issue = Mock(return_value=new_comments)
+
+        self.cappbot.run()
+
+        self.cappbot.github.Comments.by_issue.assert_called_once_with(issues[0], since=since, per_page=100, all_pages=True)
+        self.assertEquals(issues[0].patch.call_args, call(labels=[u'#new', u'enhancement']))
+
+    def test_incremental_votes(self):
+        issues, labels, milestones = self.configure_github_mock(load_fixture('issues.json')[7:8], load_fixture('labels.json'), load_fixture('milestones.json'), [[self.fake_comment(self.alice_user, '+1')]])
+
+        self.cappbot.run()
+        record = self.cappbot.database.get_issue(issues[0].id)
+        self.assertEquals((record.vote_map, record.votes, record.bot_commented), (((u'alice_tester', 1),), 1, True))
+
+        new_comment = mini_github3.Comment.from_dict(self.fake_comment(self.bob_user, 'Nah.\n-1'))
+        issues[0]._mock_comments.entries.append(new_comment)
+        issues[0].comments = len(issues[0]._mock_comments)
+        issues[0].updated_at = '2012-04-20T00:00:00Z'
+        new_comments = mini_github3.Comments(entries=[new_comment])
+        new_comments.post = issues[0]._mock_comments.post
+        self.cappbot.github.Comments.by_issue = Mock(return_value=new_comments)
+
+        with patch('command_scanner.scan', wraps=command_scanner.scan) as scan:
+            self.cappbot.run()
+
+        # Only the new comment was read.
+        self.assertEquals(scan.call_args_list, [call(u'Nah.\n-1')])
+        self.assertEquals((record.vote_map, record.votes), (((u'alice_tester', 1), (u'bob', -1)), 0))
+
+        # A repair comes to the same conclusion from all stored comments.
+        record.vote_map = ((u'alice_tester', 5),)
+        self.cappbot.repair_derived_state()
+        self.assertEquals((record.vote_map, record.bot_commented), (((u'alice_tester', 1), (u'bob', -1)), True))
+
     def test_ignore_deja_vu(self):
         cappbot_comment = [self.fake_comment(self.cappbot_user, 'Hello.')]
 
@@ -224,6 +444,130 @@ class TestCappBot(unittest.TestCase):
         issues[0].patch.assert_has_calls([call(labels=[u'#new'], milestone=2), call(labels=[u'#needs-test', u'#new'])])
         self.assertEquals(issues[0]._mock_comments[-1].body, "**Milestone:** Someday.  **Labels:** #needs-test, #new.  **What's next?** A reviewer should examine this issue.")
 
+    def test_analysis_processes(self):
+        issues, labels, milestones = self.configure_github_mock(load_fixture('issues.json')[6:8], load_fixture('labels.json'), load_fixture('milestones.json'), [
+            [self.fake_comment(self.alice_user, 'Enhancing.\n+enhancement\n+1'), self.fake_comment(self.bob_user, '-1')],
+            [self.fake_comment(self.alice_user, 'Very enhancing.\n\n+enhancement\n+#needs-test'), self.fake_comment(self.bob_user, '-enhancement\n\n-#needs-test\n+#new\n#acknowledged')],
+        ])
+        self.cappbot.pool = multiprocessing.Pool(2)
+        self.settings.ANALYSIS_BATCH = 2
+
+        try:
+            with patch('command_scanner.scan', wraps=command_scanner.scan) as scan:
+                self.cappbot.run()
+                # The pool is kept for the next run.
+                self.cappbot.run()
+        finally:
+            self.cappbot.pool.terminate()
+
+        # Only CappBot's own paper trail comments, posted after the pool was done, were scanned here.
+        self.assertEquals([args[0] for args, kwargs in scan.call_args_list if not args[0].startswith('**')], [])
+        self.assertEquals(self.cappbot.database.get_issue(issues[0].id).vote_map, ((u'alice_tester', 1), (u'bob', -1)))
+        issues[1].patch.assert_has_calls([call(labels=[u'#new'], milestone=2), call(labels=[u'#acknowledged'])])
+        self.assertEquals(issues[1]._mock_comments[-1].body, "**Milestone:** Someday.  **Label:** #acknowledged.  **What's next?** A reviewer should examine this issue.")
+
+    def test_analysis_processes_new_comments(self):
+        issues, labels, milestones = self.configure_github_mock(load_fixture('issues.json')[7:8], load_fixture('labels.json'), load_fixture('milestones.json'), [[self.fake_comment(self.alice_user, '+1')]])
+        self.cappbot.run()
+
+        new_comment = mini_github3.Comment.from_dict(self.fake_comment(self.bob_user, 'Nah.\n-1'))
+        issues[0]._mock_comments.entries.append(new_comment)
+        issues[0].comments = len(issues[0]._mock_comments)
+        issues[0].updated_at = '2012-04-20T00:00:00Z'
+        new_comments = mini_github3.Comments(entries=[new_comment])
+        new_comments.post = issues[0]._mock_comments.post
+        self.cappbot.github.Comments.by_issue = Mock(return_value=new_comments)
+        self.cappbot.pool = Mock()
+        self.cappbot.pool.map = Mock(side_effect=map)
+        self.cappbot.run()
+
+        # The stored comments, already taken into account, stay out of the pool.
+        self.cappbot.pool.map.assert_called_once_with(command_scanner.scan_bodies, [[u'Nah.\n-1']])
+        self.assertEquals(self.cappbot.database.get_issue(issues[0].id).vote_map, ((u'alice_tester', 1), (u'bob', -1)))
+
+    def test_serve(self):
+        issues, labels, milestones = self.configure_github_mock(load_fixture('issues.json')[7:8], load_fixture('labels.json'), load_fixture('milestones.json'), [[self.fake_comment(self.alice_user, 'Confirmed.\n\n+#accepted')]])
+        self.cappbot.github.Issue.by_number = Mock(return_value=issues[0])
+        queue = IssueQueue()
+        queue.put(1)
+
+        # Stop serving once the first issue has been handled.
+        self.assertRaises(KeyboardInterrupt, self.cappbot.serve, queue, save=Mock(side_effect=KeyboardInterrupt))
+
+        self.cappbot.github.Issue.by_number.assert_called_once_with('alice_tester', 'blox', 1)
+        self.assertFalse(self.cappbot.github.Issues.iter_by_repository_all.called)
+        issues[0].patch.assert_has_calls([call(labels=[u'#new'], milestone=2), call(labels=[u'#accepted'])])
+
+    def test_run_forever(self):
+        issues, labels, milestones = self.configure_github_mock(load_fixture('issues.json')[7:8], load_fixture('labels.json'), load_fixture('milestones.json'), [[self.fake_comment(self.alice_user, 'Confirmed.\n\n+#accepted')]])
+        cycles = []
+
+        def save():
+            cycles.append(self.cappbot.github.Labels.get_or_create_in_repository.call_count)
+            if len(cycles) == 2:
+                # Like SIGTERM would.
+                self.cappbot.stop()
+
+        self.cappbot.run_forever(0, save=save)
+
+        self.assertEquals(len(cycles), 2)
+        # The metadata learnt in the first run is still good for the second.
+        self.assertEquals(cycles[0], cycles[1])
+        issues[0].patch.assert_has_calls([call(labels=[u'#new'], milestone=2), call(labels=[u'#accepted'])])
+
+    def test_run_forever_survives_failed_run(self):
+        issues, labels, milestones = self.configure_github_mock(load_fixture('issues.json')[7:8], load_fixture('labels.json'), load_fixture('milestones.json'))
+        self.cappbot.github.current_user = Mock(side_effect=[IOError("Connection refused"), self.cappbot_user])
+        save = Mock(side_effect=lambda: len(save.mock_calls) == 2 and self.cappbot.stop())
+
+        self.cappbot.run_forever(0, save=save)
+
+        self.assertEquals(save.call_count, 2)
+        self.assertTrue(any(u'failed' in record for record in self.log_handler.formatted_records))
+        issues[0].patch.assert_called_with(labels=['#new'], milestone=2)
+
+    def test_collaborator_permissions_revoked(self):
+        issues, labels, milestones = self.configure_github_mock(load_fixture('issues.json')[7:8], load_fixture('labels.json'), load_fixture('milestones.json'))
+        self.cappbot.refresh_metadata()
+        self.assertTrue(self.cappbot.user_may_set_milestone(self.alice_user))
+
+        self.cappbot.github.Collaborators.by_repository = Mock(return_value=mini_github3.Collaborators.from_dict([{'login': 'cappbot'}]))
+        self.cappbot.refresh_metadata()
+
+        self.assertFalse(self.cappbot.user_may_set_milestone(self.alice_user))
+        # Permissions from the settings stay.
+        self.assertTrue(self.cappbot.user_may_alter_labels(self.bob_user))
+
+    def test_stop(self):
+        issues, labels, milestones = self.configure_github_mock(load_fixture('issues.json')[6:8], load_fixture('labels.json'), load_fixture('milestones.json'), [[], []])
+        handle_issue_changes = self.cappbot.handle_issue_changes
+
+        def stop_after(issue):
+            handle_issue_changes(issue)
+            self.cappbot.stop()
+
+        self.cappbot.handle_issue_changes = Mock(side_effect=stop_after)
+        self.cappbot.run()
+
+        self.assertEquals(self.cappbot.handle_issue_changes.call_count, 1)
+        # The issue which was not handled has to be looked at again next time.
+        self.assertEquals(self.cappbot.issues_synced_until, None)
+
+    def test_serve_new_label(self):
+        issues, labels, milestones = self.configure_github_mock(load_fixture('issues.json')[7:8], load_fixture('labels.json'), load_fixture('milestones.json'), [[self.fake_comment(self.alice_user, 'Confirmed.\n\n+#accepted')]])
+        self.cappbot.github.Issue.by_number = Mock(return_value=issues[0])
+        self.cappbot.catalog = MetadataCatalog(ttl=60)
+        # The label is created only after the catalog was last refreshed.
+        self.cappbot.github.Labels.by_repository = Mock(return_value=mini_github3.Labels.from_dict([label for label in load_fixture('labels.json') if label['name'] != '#accepted']))
+        self.cappbot.refresh_metadata()
+        self.cappbot.github.Labels.by_repository = Mock(return_value=labels)
+        queue = IssueQueue()
+        queue.put(1)
+
+        self.assertRaises(KeyboardInterrupt, self.cappbot.serve, queue, save=Mock(side_effect=KeyboardInterrupt))
+
+        issues[0].patch.assert_has_calls([call(labels=[u'#new'], milestone=2), call(labels=[u'#accepted'])])
+
     def test_action_by_comment_unauthorised(self):
         issues, labels, milestones = self.configure_github_mock(load_fixture('issues.json')[6:7], load_fixture('labels.json'), load_fixture('milestones.json'), [[self.fake_comment(self.chuck_user, 'I am Chuck and I accept this issue.\n\n+#accepted')]])
 
@@ -258,12 +602,19 @@ class TestCappBot(unittest.TestCase):
         # CappBot will record the issue as manually triaged and ignore any comment actions.
         self.cappbot.run()
         issues[0].patch.assert_has_calls([
-            call(labels=[]),
-            call(state='open')
+            call(labels=[], state='open')
         ])
 
         self.assertEquals(issues[0]._mock_comments[-1].body, "**What's next?** A reviewer should examine this issue.")
 
+    def test_actions_coalesced(self):
+        issues, labels, milestones = self.configure_github_mock(load_fixture('issues.json')[7:8], load_fixture('labels.json'), load_fixture('milestones.json'), [[self.fake_comment(self.alice_user, 'Mine.\n\n+enhancement\nassignee=alice_tester\nmilestone=1.0\n+1')]])
+
+        self.cappbot.run()
+
+        issues[0].patch.assert_has_calls([call(labels=[u'#new'], milestone=2), call(labels=[u'#new', u'enhancement'], milestone=1, assignee='alice_tester', title=u'Too few characters [+1]')])
+        self.assertEquals(issues[0].patch.call_count, 2)
+
     def test_action_by_comment_case_insensitive(self):
         issues, labels, milestones = self.configure_github_mock(load_fixture('issues.json')[7:8], load_fixture('labels.json'), load_fixture('milestones.json'), [[self.fake_comment(self.alice_user, 'Very enhancing.\n\n+foundation')]])
 
@@ -340,3 +691,8 @@ class TestCappBot(unittest.TestCase):
 
         issues[0].patch.assert_has_calls([call(labels=[u'#new'], milestone=2)])
         self.assertEquals(issues[0]._mock_comments[-1].body, """**Milestone:** Someday.  **Label:** #new.  **What's next?** A reviewer should examine this issue.""")
+
+
+def load_tests(loader, tests, pattern):
+    tests.addTests(doctest.DocTestSuite(metadata_catalog))
+    return tests
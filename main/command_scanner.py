@@ -0,0 +1,146 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+
+#
+# BSD License
+#
+# Copyright (c) 2012, Alexander Ljungberg
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""Recognise the commands and votes in comment bodies.
+
+A command is a line by itself, ignoring surrounding whitespace:
+
+    +1, -1, +0 or -0    vote
+    +label or #label    add a label
+    -label              remove a label
+    milestone=title     set the milestone
+    assignee=login      set the assignee (or clear it, if empty)
+
+Each body is scanned in a single pass, in time linear in its length: every line is classified by its first
+characters, and the rest of the line is checked with a single character class which never backtracks.
+
+"""
+
+from collections import namedtuple
+import re
+
+
+VOTE = 'vote'
+ADD_LABEL = 'add_label'
+REMOVE_LABEL = 'remove_label'
+SET_MILESTONE = 'set_milestone'
+SET_ASSIGNEE = 'set_assignee'
+
+Command = namedtuple('Command', 'kind argument')
+
+VOTES = {u'+1': 1, u'-1': -1, u'+0': 0, u'-0': 0}
+
+LABEL_CHARACTERS = re.compile(r'[-\w _#]+')
+ASSIGNEE_CHARACTERS = re.compile(r'[-\w#]*')
+
+
+def match_to_end(characters, line, start):
+    """Return true if everything in `line` from `start` on is made of the given characters."""
+
+    m = characters.match(line, start)
+    return m is not None and m.end() == len(line)
+
+
+def scan_line(line):
+    """Return the command on a stripped line, or None.
+
+    >>> scan_line(u'+1')
+    Command(kind='vote', argument=1)
+    >>> scan_line(u'+needs review')
+    Command(kind='add_label', argument=u'needs review')
+    >>> scan_line(u'#needs-review')
+    Command(kind='add_label', argument=u'#needs-review')
+    >>> scan_line(u'-#needs-review')
+    Command(kind='remove_label', argument=u'#needs-review')
+    >>> scan_line(u'milestone=1.0 Beta')
+    Command(kind='set_milestone', argument=u'1.0 Beta')
+    >>> scan_line(u'assignee=')
+    Command(kind='set_assignee', argument=u'')
+    >>> scan_line(u'+1 for this')
+    Command(kind='add_label', argument=u'1 for this')
+    >>> scan_line(u'#') is None
+    True
+    >>> scan_line(u'Looks good!') is None
+    True
+
+    """
+
+    if not line:
+        return None
+
+    first = line[0]
+    if first == u'+' or first == u'-':
+        if line in VOTES:
+            return Command(VOTE, VOTES[line])
+        if len(line) > 1 and match_to_end(LABEL_CHARACTERS, line, 1):
+            return Command(ADD_LABEL if first == u'+' else REMOVE_LABEL, line[1:])
+    elif first == u'#':
+        if len(line) > 1 and match_to_end(LABEL_CHARACTERS, line, 0):
+            return Command(ADD_LABEL, line)
+    elif line.startswith(u'milestone='):
+        return Command(SET_MILESTONE, line[len(u'milestone='):])
+    elif line.startswith(u'assignee='):
+        if match_to_end(ASSIGNEE_CHARACTERS, line, len(u'assignee=')):
+            return Command(SET_ASSIGNEE, line[len(u'assignee='):])
+    return None
+
+
+def scan(body):
+    """Return the list of commands in a comment body, in order."""
+
+    if not body:
+        return []
+
+    commands = []
+    for line in body.split(u'\n'):
+        command = scan_line(line.strip())
+        if command is not None:
+            commands.append(command)
+    return commands
+
+
+def comment_commands(comment):
+    """Return the commands of a comment, scanning its body only the first time."""
+
+    commands = getattr(comment, '_commands', None)
+    if commands is None:
+        commands = comment._commands = scan(comment.body)
+    return commands
+
+
+def scan_bodies(bodies):
+    """Return the commands of each of the comment bodies as lists of plain (kind, argument) tuples.
+
+    This runs in the worker processes of `analyse_comments`, so it returns what pickles compactly.
+
+    """
+
+    return [[tuple(command) for command in scan(body)] for body in bodies]
+
+
+def analyse_comments(pool, comment_lists):
+    """Scan the comments of several issues in a `multiprocessing.Pool`, one issue per task.
+
+    Afterwards `comment_commands` returns the same commands for each comment as if it had scanned the body itself.
+
+    """
+
+    comment_lists = [[comment for comment in comments if getattr(comment, '_commands', None) is None] for comments in comment_lists]
+    results = pool.map(scan_bodies, [[comment.body for comment in comments] for comments in comment_lists])
+    for comments, commands_lists in zip(comment_lists, results):
+        for comment, commands in zip(comments, commands_lists):
+            comment._commands = [Command(*command) for command in commands]
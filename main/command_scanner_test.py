@@ -0,0 +1,74 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+
+#
+# BSD License
+#
+# Copyright (c) 2012, Alexander Ljungberg
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+import doctest
+import multiprocessing
+import unittest
+
+from command_scanner import ADD_LABEL, REMOVE_LABEL, SET_ASSIGNEE, SET_MILESTONE, VOTE, Command, analyse_comments, comment_commands, scan
+from reference import scan_with_regexes
+import command_scanner
+
+
+class TestCommandScanner(unittest.TestCase):
+    def test_scan(self):
+        body = u"Thanks!\n\n+1\n +#needs-review \n-bug\nmilestone=1.0\nassignee=alice\n-0\nassignee=\n#enhancement"
+        self.assertEquals(scan(body), [
+            Command(VOTE, 1),
+            Command(ADD_LABEL, u'#needs-review'),
+            Command(REMOVE_LABEL, u'bug'),
+            Command(SET_MILESTONE, u'1.0'),
+            Command(SET_ASSIGNEE, u'alice'),
+            Command(VOTE, 0),
+            Command(SET_ASSIGNEE, u''),
+            Command(ADD_LABEL, u'#enhancement'),
+        ])
+        self.assertEquals(scan(None), [])
+
+    def test_same_as_regexes(self):
+        lines = [u'', u'+', u'-', u'#', u'##', u'+1', u'-1', u'+0', u'-0', u'+2', u'+10', u'+ 1', u'+1 ', u'+a b', u'+a ',
+            u'+a!', u'-a-b-c', u'--', u'+#', u'#a b', u'#a!', u'a#', u'milestone=', u'milestone= x ', u'milestone=1.0!',
+            u'Milestone=1', u'assignee=', u'assignee=a b', u'assignee=bob-2', u'assignee=#x', u'\t+bug\t', u'+bug\r',
+            u'+\xe9t\xe9', u'#☃', u'+_', u'-_ _']
+        for line in lines:
+            self.assertEquals(scan(line), scan_with_regexes(line), line)
+
+    def test_analyse_comments(self):
+        class FakeComment(object):
+            def __init__(self, body):
+                self.body = body
+
+        bodies = [u'+1', u'Nice.\n+#needs-review\nmilestone=1.0', None, u'', u'-bug\n-0\nassignee=']
+        issues = [[FakeComment(body) for body in bodies[n:]] for n in range(len(bodies))]
+        pool = multiprocessing.Pool(2)
+        try:
+            analyse_comments(pool, issues)
+        finally:
+            pool.terminate()
+
+        for comments in issues:
+            for comment in comments:
+                self.assertEquals(comment_commands(comment), scan(comment.body))
+
+
+def load_tests(loader, tests, pattern):
+    tests.addTests(doctest.DocTestSuite(command_scanner))
+    return tests
+
+
+if __name__ == '__main__':
+    unittest.main()
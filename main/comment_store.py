@@ -0,0 +1,125 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+
+#
+# BSD License
+#
+# Copyright (c) 2012, Alexander Ljungberg
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""A local copy of the comments of each issue, so that only new comments need to be downloaded."""
+
+import json
+import logbook
+import os
+import shutil
+
+def compact_comment(comment):
+    """Return the dict representation of a `Comment` to keep in the store.
+
+    Only the parts CappBot needs are kept. Everything else, like the full user record, is dropped
+    to keep the store small.
+
+    """
+
+    return {
+        'id': comment.id,
+        'url': comment.url,
+        'body': comment.body,
+        'created_at': comment.created_at,
+        'updated_at': comment.updated_at,
+        'user': {'id': comment.user.id, 'login': comment.user.login} if comment.user else None,
+    }
+
+
+class CommentStore(object):
+    """Comments by issue id, persisted in `path` (or only kept in memory if `path` is None.)
+
+    `path` is a JSON snapshot. Saving appends the comments of each issue changed since the last save to a journal
+    next to it, one line per issue, so that a save costs only as much as what changed. Once the journal is larger
+    than both the snapshot and `compact_size` bytes, the snapshot is rewritten and the journal starts over.
+
+    """
+
+    def __init__(self, path=None, compact_size=1024 * 1024):
+        self.path = path
+        self.journal_path = path + ".journal" if path else None
+        self.compact_size = compact_size
+        self._comments = {}
+        self._changed = set()
+
+        if path and os.path.exists(path):
+            with open(path, 'rb') as f:
+                self._comments = json.load(f)
+        if self.journal_path and os.path.exists(self.journal_path) and not self.replay():
+            # Start a clean journal rather than append to a damaged line.
+            self.compact()
+
+    def replay(self):
+        """Apply the journal to the comments loaded from the snapshot. Return false if it had a damaged entry."""
+
+        intact = True
+        with open(self.journal_path, 'rb') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Only the last line can be damaged, by a crash while it was being written.
+                    logbook.warning("Skipping a damaged entry in %s: %r" % (self.journal_path, line[:100]))
+                    intact = False
+                    continue
+                self._comments[entry['issue']] = entry['comments']
+        return intact
+
+    def get(self, issue_id):
+        """Return the list of stored comment dicts for the issue, or None if the issue's comments have never been stored."""
+
+        return self._comments.get(unicode(issue_id))
+
+    def put(self, issue_id, comments):
+        """Replace the stored comments of the issue with the given `Comment` objects."""
+
+        self._comments[unicode(issue_id)] = [compact_comment(comment) for comment in comments]
+        self._changed.add(unicode(issue_id))
+
+    def since(self, issue_id):
+        """Return the newest update time among the stored comments of the issue, or None."""
+
+        comments = self.get(issue_id)
+        if not comments:
+            return None
+        return max(comment['updated_at'] for comment in comments)
+
+    def save(self):
+        if not self.path or not self._changed:
+            return
+
+        with open(self.journal_path, 'ab') as f:
+            for issue_id in sorted(self._changed):
+                f.write(json.dumps({'issue': issue_id, 'comments': self._comments[issue_id]}) + "\n")
+            journal_size = f.tell()
+        self._changed.clear()
+
+        snapshot_size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if journal_size > max(self.compact_size, snapshot_size):
+            self.compact()
+
+    def compact(self):
+        """Write all comments out as a new snapshot and remove the journal."""
+
+        new_path = self.path + ".new"
+        with open(new_path, 'wb') as f:
+            json.dump(self._comments, f)
+        shutil.move(new_path, self.path)
+        # Should we crash right here, replaying the journal on top of the new snapshot changes nothing.
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        self._changed.clear()
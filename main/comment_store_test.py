@@ -0,0 +1,82 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+
+#
+# BSD License
+#
+# Copyright (c) 2012, Alexander Ljungberg
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+from mock import Mock
+import os
+import shutil
+import tempfile
+import unittest
+
+from comment_store import CommentStore
+
+
+def fake_comment(comment_id, body):
+    return Mock(id=comment_id, url='https://api.github.com/repos/alice_tester/blox/issues/comments/%d' % comment_id, body=body, created_at='2012-04-19T22:06:51Z', updated_at='2012-04-19T22:06:51Z', user=None)
+
+
+class TestCommentStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'comments.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_save_appends_changed_issues(self):
+        store = CommentStore(self.path)
+        store.put(1, [fake_comment(10, u'+1')])
+        store.put(2, [fake_comment(20, u'Looks good.')])
+        store.save()
+        store.put(2, [fake_comment(20, u'Looks good.'), fake_comment(21, u'#accepted')])
+        store.save()
+        # Nothing changed, nothing to write.
+        store.save()
+
+        with open(store.journal_path, 'rb') as f:
+            self.assertEquals(len(f.readlines()), 3)
+        self.assertFalse(os.path.exists(self.path))
+
+        reopened = CommentStore(self.path)
+        self.assertEquals([comment['body'] for comment in reopened.get(2)], [u'Looks good.', u'#accepted'])
+        self.assertEquals(reopened.get(1)[0]['id'], 10)
+        self.assertEquals(reopened.get(3), None)
+
+    def test_compacts_large_journal(self):
+        store = CommentStore(self.path, compact_size=0)
+        store.put(1, [fake_comment(10, u'+1')])
+        store.save()
+
+        self.assertTrue(os.path.exists(self.path))
+        self.assertFalse(os.path.exists(store.journal_path))
+        self.assertEquals(CommentStore(self.path).get(1)[0]['body'], u'+1')
+
+    def test_skips_damaged_entry(self):
+        store = CommentStore(self.path)
+        store.put(1, [fake_comment(10, u'+1')])
+        store.save()
+        with open(store.journal_path, 'ab') as f:
+            f.write('{"issue": "2", "comm')
+
+        reopened = CommentStore(self.path)
+
+        self.assertEquals(reopened.get(1)[0]['body'], u'+1')
+        self.assertEquals(reopened.get(2), None)
+        self.assertFalse(os.path.exists(reopened.journal_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
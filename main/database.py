@@ -0,0 +1,920 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+
+#
+# BSD License
+#
+# Copyright (c) 2012, Alexander Ljungberg
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""Storage for the CappBot database: what CappBot knows about each issue, and a few run wide values like
+the date of the first run.
+
+Three backends are available. `JSONDatabase` keeps everything in memory and appends each change to a journal
+next to a JSON snapshot of the database. `SQLiteDatabase` writes each issue record as it changes. `IndexedDatabase`
+only reads the records asked for, using an index of the records by issue id, so that opening it takes the same time
+however many issues it holds. With any of them, saving costs no more than what changed.
+
+"""
+
+import argparse
+import bz2
+import json
+import logbook
+import mmap
+import os
+import shutil
+import sqlite3
+import struct
+import threading
+import urllib
+import zlib
+
+
+# Label names are interned to bit numbers so that each record keeps its labels as a single integer.
+_label_bits = {}
+_label_names = []
+# Few combinations of labels are in use, so the masks of those seen are remembered.
+_label_masks = {}
+
+
+def label_mask(names):
+    """Return the bitmask for the given label names, allocating bits for names not seen before.
+
+    >>> label_mask([]) == 0
+    True
+    >>> label_mask([u'#zz-test-a', u'#zz-test-b']) == label_mask([u'#zz-test-b']) | label_mask([u'#zz-test-a'])
+    True
+
+    """
+
+    names = tuple(names)
+    mask = _label_masks.get(names)
+    if mask is not None:
+        return mask
+
+    mask = 0
+    for name in names:
+        bit = _label_bits.get(name)
+        if bit is None:
+            bit = _label_bits[name] = len(_label_names)
+            _label_names.append(name)
+        mask |= 1 << bit
+    _label_masks[names] = mask
+    return mask
+
+
+def label_names(mask):
+    """Return the sorted label names of a bitmask made by `label_mask`.
+
+    >>> label_names(label_mask([u'#zz-test-b', u'#zz-test-a']))
+    [u'#zz-test-a', u'#zz-test-b']
+
+    """
+
+    names = []
+    bit = 0
+    while mask:
+        if mask & 1:
+            names.append(_label_names[bit])
+        mask >>= 1
+        bit += 1
+    return sorted(names)
+
+
+def compact_string(value):
+    """Return ASCII strings as byte strings, which take a quarter of the memory of unicode ones on wide builds."""
+
+    if isinstance(value, unicode):
+        try:
+            return value.encode('ascii')
+        except UnicodeEncodeError:
+            pass
+    return value
+
+
+class IssueRecord(object):
+    """What CappBot knows about an issue. In the JSON database, each record is a dict with a key per field.
+
+    Labels are kept as a bitmask of interned label names. Keys CappBot doesn't know about are kept in `extra` so that
+    they survive a round trip.
+
+    Derived from the comments up to `latest_seen_comment_id` are `vote_map`, the latest vote of each user as a tuple of
+    (login, vote) pairs, and `bot_commented`, whether CappBot has commented. Both are None until first worked out.
+
+    """
+
+    __slots__ = ('id', 'number', 'comments_count', 'milestone_number', 'assignee_id', 'label_mask', 'updated_at', 'votes', 'latest_seen_comment_id', 'vote_map', 'bot_commented', 'extra')
+
+    FIELDS = ('id', 'number', 'comments_count', 'milestone_number', 'assignee_id', 'updated_at', 'votes', 'latest_seen_comment_id')
+    KEYS = frozenset(FIELDS + ('labels', 'vote_map', 'bot_commented'))
+
+    def __init__(self, **fields):
+        for field in self.__slots__:
+            setattr(self, field, None)
+        self.label_mask = 0
+        for field, value in fields.items():
+            setattr(self, field, value)
+
+    def get_labels(self):
+        return label_names(self.label_mask)
+
+    def set_labels(self, names):
+        self.label_mask = label_mask(names)
+    labels = property(get_labels, set_labels)
+
+    @classmethod
+    def from_dict(cls, d):
+        # Spelt out rather than looping over FIELDS since this runs for every issue when the database is loaded.
+        record = cls.__new__(cls)
+        get = d.get
+        record.id = get('id')
+        record.number = get('number')
+        record.comments_count = get('comments_count')
+        record.milestone_number = get('milestone_number')
+        record.assignee_id = get('assignee_id')
+        record.label_mask = label_mask(get('labels') or ())
+        record.updated_at = compact_string(get('updated_at'))
+        record.votes = get('votes')
+        record.latest_seen_comment_id = get('latest_seen_comment_id')
+        vote_map = get('vote_map')
+        record.vote_map = tuple(sorted(vote_map.items())) if vote_map is not None else None
+        record.bot_commented = get('bot_commented')
+        record.extra = None
+        if not cls.KEYS.issuperset(d):
+            record.extra = dict((key, value) for key, value in d.items() if key not in cls.KEYS)
+        return record
+
+    def to_dict(self):
+        r = dict(self.extra or {})
+        for field in self.FIELDS:
+            r[field] = getattr(self, field)
+        r['labels'] = self.labels
+        # Left out until worked out, so that records of older versions of CappBot read and write the same.
+        if self.vote_map is not None:
+            r['vote_map'] = dict(self.vote_map)
+        if self.bot_commented is not None:
+            r['bot_commented'] = self.bot_commented
+        return r
+
+    def __repr__(self):
+        return "IssueRecord(%r)" % self.to_dict()
+
+
+# Snapshot format, version 2. After the header comes the payload, possibly compressed:
+#
+#  - the length of, and a JSON object with, the meta values, the label combinations in use, the contents of the vote
+#    maps, and whatever doesn't fit in the columns below,
+#  - a column of 64-bit integers with the issue ids the records are stored under,
+#  - a column of 64-bit integers for each of SNAPSHOT_COLUMNS,
+#  - a column of 32-bit indexes into the label combinations,
+#  - the length of, and the updated_at strings joined by NUL.
+#
+# All numbers are little endian. Version 1 had no bot_commented and voters columns. The JSON databases of older
+# versions of CappBot count as version 0.
+SNAPSHOT_MAGIC = 'CBDB'
+SNAPSHOT_VERSION = 2
+# Magic, version, compression.
+SNAPSHOT_HEADER = struct.Struct('<4sHB')
+LENGTH = struct.Struct('<I')
+COMPRESSIONS = {
+    None: (0, lambda payload: payload, lambda payload: payload),
+    'zlib': (1, zlib.compress, zlib.decompress),
+    'bz2': (2, bz2.compress, bz2.decompress),
+}
+# The integer columns of each version. The voters column holds the number of entries in the vote map of each record.
+SNAPSHOT_COLUMNS = {
+    1: ('id', 'number', 'comments_count', 'milestone_number', 'assignee_id', 'votes', 'latest_seen_comment_id'),
+    2: ('id', 'number', 'comments_count', 'milestone_number', 'assignee_id', 'votes', 'latest_seen_comment_id', 'bot_commented', 'voters'),
+}
+# Stands in for None in integer columns.
+NULL = -2 ** 63
+
+
+def column_value(record, field):
+    if field == 'voters':
+        return len(record.vote_map) if record.vote_map is not None else None
+    return getattr(record, field)
+
+
+def encode_snapshot(data):
+    """Return the payload of a snapshot of the database `data`, in the JSON layout with `IssueRecord`s."""
+
+    keys = sorted(data.get('issues', {}), key=int)
+    records = [data['issues'][key] for key in keys]
+
+    header = {'count': len(keys), 'meta': dict((key, value) for key, value in data.items() if key != 'issues'), 'labels': [], 'vote_maps': {}, 'extra': {}, 'updated_at': {}}
+    combinations = {}
+    columns = [[int(key) for key in keys]]
+    for field in SNAPSHOT_COLUMNS[SNAPSHOT_VERSION]:
+        column = []
+        for record in records:
+            value = column_value(record, field)
+            column.append(NULL if value is None else value)
+        columns.append(column)
+
+    label_indexes = []
+    updated_at = []
+    for n, record in enumerate(records):
+        index = combinations.get(record.label_mask)
+        if index is None:
+            index = combinations[record.label_mask] = len(header['labels'])
+            header['labels'].append(record.labels)
+        label_indexes.append(index)
+
+        if record.vote_map:
+            header['vote_maps'][n] = dict(record.vote_map)
+        if record.extra:
+            header['extra'][n] = record.extra
+        if isinstance(record.updated_at, str) and record.updated_at and '\0' not in record.updated_at:
+            updated_at.append(record.updated_at)
+        else:
+            header['updated_at'][n] = record.updated_at
+            updated_at.append('')
+
+    header = json.dumps(header)
+    updated_at = '\0'.join(updated_at)
+    return ''.join([LENGTH.pack(len(header)), header] + [struct.pack('<%dq' % len(keys), *column) for column in columns] + [struct.pack('<%dI' % len(keys), *label_indexes), LENGTH.pack(len(updated_at)), updated_at])
+
+
+def compress_snapshot(payload, compression='zlib'):
+    """Return the snapshot file contents for the given payload."""
+
+    number, compress, decompress = COMPRESSIONS[compression]
+    return SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, number) + compress(payload)
+
+
+def decode_snapshot_payload(payload, version):
+    """Return the database in the payload of a snapshot of the given version."""
+
+    position = LENGTH.size + LENGTH.unpack_from(payload)[0]
+    header = json.loads(payload[LENGTH.size:position])
+    count = header['count']
+
+    def column(typecode, position):
+        column_format = '<%d%s' % (count, typecode)
+        return struct.unpack_from(column_format, payload, position), position + struct.calcsize(column_format)
+
+    keys, position = column('q', position)
+    columns = {}
+    for field in SNAPSHOT_COLUMNS[version]:
+        values, position = column('q', position)
+        columns[field] = [None if value == NULL else value for value in values]
+    label_indexes, position = column('I', position)
+    length = LENGTH.unpack_from(payload, position)[0]
+    updated_at = payload[position + LENGTH.size:position + LENGTH.size + length].split('\0') if count else []
+
+    masks = [label_mask(names) for names in header['labels']]
+    vote_maps = dict((int(n), tuple(sorted(value.items()))) for n, value in header.get('vote_maps', {}).items())
+    extra = dict((int(n), value) for n, value in header['extra'].items())
+    updated_at_exceptions = dict((int(n), value) for n, value in header['updated_at'].items())
+    # Columns missing from older versions.
+    unknown = [None] * count
+
+    issues = {}
+    new_record = IssueRecord.__new__
+    for n, (key, issue_id, number, comments_count, milestone_number, assignee_id, votes, latest_seen_comment_id, bot_commented, voters) in enumerate(zip(keys, *[columns.get(field, unknown) for field in SNAPSHOT_COLUMNS[SNAPSHOT_VERSION]])):
+        record = new_record(IssueRecord)
+        record.id = issue_id
+        record.number = number
+        record.comments_count = comments_count
+        record.milestone_number = milestone_number
+        record.assignee_id = assignee_id
+        record.votes = votes
+        record.latest_seen_comment_id = latest_seen_comment_id
+        record.bot_commented = bool(bot_commented) if bot_commented is not None else None
+        record.vote_map = vote_maps.get(n, ()) if voters is not None else None
+        record.label_mask = masks[label_indexes[n]]
+        record.updated_at = updated_at_exceptions[n] if n in updated_at_exceptions else updated_at[n]
+        record.extra = extra.get(n)
+        issues[unicode(key)] = record
+
+    data = header['meta']
+    data['issues'] = issues
+    return data
+
+
+def decode_snapshot(contents):
+    """Return the database in a snapshot file and the version of the snapshot."""
+
+    if not contents.startswith(SNAPSHOT_MAGIC):
+        # A plain JSON database.
+        return json.loads(contents), 0
+
+    magic, version, number = SNAPSHOT_HEADER.unpack_from(contents)
+    # Older versions are read too, so that they're migrated when the database is next written.
+    if version not in SNAPSHOT_COLUMNS:
+        raise Exception("Database snapshot version {} is not supported by this version of CappBot (supported: {}).".format(version, ", ".join(map(str, sorted(SNAPSHOT_COLUMNS)))))
+    decompress = dict((n, decompress) for n, compress, decompress in COMPRESSIONS.values())[number]
+    return decode_snapshot_payload(decompress(contents[SNAPSHOT_HEADER.size:]), version), version
+
+
+class Database(object):
+    """An in-memory database, stored in the same layout as the JSON file:
+
+        {"first_run": "...", "issues": {"<issue id>": {...}, ...}}
+
+    If `data` is given, that dict is used as the storage, with the issue records turned into `IssueRecord`s. Callers
+    should `put_issue` a record after changing it, since other backends don't hand out live records.
+
+    """
+
+    def __init__(self, data=None):
+        self.load(data if data is not None else {})
+
+    def load(self, data):
+        self.data = data
+        issues = self.data.get('issues')
+        if issues:
+            for key, record in issues.items():
+                if not isinstance(record, IssueRecord):
+                    issues[key] = IssueRecord.from_dict(record)
+
+    def get_meta(self, key, default=None):
+        return self.data.get(key, default)
+
+    def set_meta(self, key, value):
+        self.data[key] = value
+
+    def get_issue(self, issue_id):
+        """Return the record of the issue with the given id, or None if the issue hasn't been recorded."""
+
+        return self.data.get('issues', {}).get(unicode(issue_id))
+
+    def put_issue(self, issue_id, record):
+        """Store the record of an issue, given as an `IssueRecord` or as a dict in the JSON layout."""
+
+        if not isinstance(record, IssueRecord):
+            record = IssueRecord.from_dict(record)
+        # Note we need to use string keys for our JSON database's sake.
+        self.data.setdefault('issues', {})[unicode(issue_id)] = record
+
+    def iter_issues(self):
+        """Yield (issue id, record) for every recorded issue."""
+
+        for key, record in self.data.get('issues', {}).iteritems():
+            yield int(key), record
+
+    def to_dict(self):
+        """Return the whole database in the JSON layout."""
+
+        return json.loads(self.dumps())
+
+    def dumps(self, **kwargs):
+        return json.dumps(self.data, default=IssueRecord.to_dict, **kwargs)
+
+    def import_dict(self, data):
+        """Replace the contents of the database with a whole database in the JSON layout."""
+
+        self.load(data)
+
+    def save(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class JSONDatabase(Database):
+    """The database as a snapshot file plus a journal of the changes made since the snapshot.
+
+    Snapshots are written as JSON, or in the binary snapshot format, optionally compressed, if `snapshot_format` is
+    "binary". Either kind is read, and a snapshot which isn't in the configured format and version is rewritten when the
+    database is opened.
+
+    Each change is appended to the journal as one line of JSON, so saving costs only as much as what changed.
+    When the journal grows beyond `compact_size` bytes, the database is written out as a new snapshot in a
+    background thread and the journal starts over.
+
+    On opening, the journal is replayed on top of the snapshot. A crash can at worst leave a partly written last
+    line, which is skipped. Snapshots are written to a .new file and moved into place, and the journal covering
+    them is only removed after the move, so a crash while compacting loses nothing either.
+
+    """
+
+    def __init__(self, path, read_only=False, compact_size=1024 * 1024, snapshot_format='json', compression='zlib'):
+        if snapshot_format not in ('binary', 'json'):
+            raise ValueError("Unknown snapshot format %r. Use binary or json." % snapshot_format)
+        if compression not in COMPRESSIONS:
+            raise ValueError("Unknown compression %r. Use one of: %s." % (compression, ", ".join(str(c) for c in sorted(COMPRESSIONS))))
+
+        self.path = path
+        self.read_only = read_only
+        self.compact_size = compact_size
+        self.snapshot_format = snapshot_format
+        self.compression = compression
+        self.new_path = path + ".new"
+        self.journal_path = path + ".journal"
+        # The journal being folded into a snapshot by a compaction in progress.
+        self.old_journal_path = path + ".journal.old"
+        self.compaction = None
+        self.journal = None
+
+        if os.path.exists(self.new_path):
+            if not os.path.exists(self.old_journal_path):
+                # Not left by a compaction, so possibly by a version of CappBot without a journal. If we failed to mv the
+                # new database to the old name, that might have been because we crashed while writing the new one, in
+                # which case the old database might be better to preserve. Or it might be that we wrote .new but failed to
+                # mv() in which case the new is better to preserve. So this error situation requires manual intervention.
+                raise Exception("{} exists. Manually resolve if {} or {} is less bad and then mv and rm by hand to resolve.".format(self.new_path, self.path, self.new_path))
+            # A compaction was interrupted before the new snapshot was moved into place. The old snapshot and the
+            # journals still have everything, so the new snapshot is simply redone later.
+            if not read_only:
+                os.remove(self.new_path)
+
+        data = {}
+        migrate_from = None
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                data, version = decode_snapshot(f.read())
+            if version != (SNAPSHOT_VERSION if snapshot_format == 'binary' else 0):
+                migrate_from = version
+
+        super(JSONDatabase, self).__init__(data)
+
+        # Replaying a journal which is already in the snapshot is harmless since every entry is a whole value.
+        self.replayed = self.replay(self.old_journal_path) + self.replay(self.journal_path)
+        if self.replayed:
+            logbook.info("Replayed %d change(s) from the database journal." % self.replayed)
+
+        if not read_only:
+            self.journal = open(self.journal_path, 'ab')
+            if self.journal.tell() and not self.journal_ends_with_newline():
+                # End the damaged entry so that the next one isn't appended to it.
+                self.journal.write("\n")
+            if migrate_from is not None:
+                logbook.info("Migrating the database snapshot %s from version %d to the %s format." % (path, migrate_from, snapshot_format))
+                self.compact(wait=True)
+            elif os.path.exists(self.old_journal_path):
+                self.compact(wait=True)
+
+    def replay(self, journal_path):
+        """Apply the entries of the given journal file and return how many there were."""
+
+        if not os.path.exists(journal_path):
+            return 0
+
+        count = 0
+        with open(journal_path, 'rb') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    logbook.warning("Skipping a damaged entry in %s, probably left by a crash: %r" % (journal_path, line[:100]))
+                    continue
+
+                if 'issue' in entry:
+                    super(JSONDatabase, self).put_issue(entry['issue'], entry['record'])
+                else:
+                    super(JSONDatabase, self).set_meta(entry['meta'], entry['value'])
+                count += 1
+        return count
+
+    def journal_ends_with_newline(self):
+        with open(self.journal_path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == "\n"
+
+    def append(self, entry):
+        if self.read_only:
+            return
+
+        # Flushed right away so that if the process dies, only the entry being written can be lost. Syncing to disk
+        # happens on save().
+        self.journal.write(json.dumps(entry, sort_keys=True) + "\n")
+        self.journal.flush()
+
+        if self.journal.tell() > self.compact_size and not (self.compaction and self.compaction.is_alive()):
+            self.compact()
+
+    def set_meta(self, key, value):
+        super(JSONDatabase, self).set_meta(key, value)
+        self.append({'meta': key, 'value': value})
+
+    def put_issue(self, issue_id, record):
+        super(JSONDatabase, self).put_issue(issue_id, record)
+        self.append({'issue': unicode(issue_id), 'record': record.to_dict() if isinstance(record, IssueRecord) else record})
+
+    def import_dict(self, data):
+        super(JSONDatabase, self).import_dict(data)
+        self.compact(wait=True)
+
+    def compact(self, wait=False):
+        """Write the database out as a new snapshot and start a new journal. The snapshot is written in the
+        background unless `wait` is set.
+
+        """
+
+        self.wait_for_compaction()
+
+        # Serialising here rather than in the background thread captures the database as it is right now, at the same
+        # moment the journal is cut. Compressing, the slow part, is left to the background.
+        if self.snapshot_format == 'binary':
+            snapshot = encode_snapshot(self.data)
+        else:
+            snapshot = self.dumps(indent=1, sort_keys=True)
+        self.journal.close()
+        if os.path.exists(self.old_journal_path):
+            # The journal of an interrupted compaction. The snapshot being written includes it.
+            with open(self.old_journal_path, 'ab') as f, open(self.journal_path, 'rb') as journal:
+                shutil.copyfileobj(journal, f)
+            os.remove(self.journal_path)
+        else:
+            os.rename(self.journal_path, self.old_journal_path)
+        self.journal = open(self.journal_path, 'ab')
+
+        self.compaction = threading.Thread(target=self.write_snapshot, args=(snapshot,), name="database-compaction")
+        self.compaction.daemon = True
+        self.compaction.start()
+        if wait:
+            self.wait_for_compaction()
+
+    def write_snapshot(self, snapshot):
+        if self.snapshot_format == 'binary':
+            snapshot = compress_snapshot(snapshot, self.compression)
+        with open(self.new_path, 'wb') as f:
+            f.write(snapshot)
+            f.flush()
+            os.fsync(f.fileno())
+        shutil.move(self.new_path, self.path)
+        os.remove(self.old_journal_path)
+
+    def wait_for_compaction(self):
+        if self.compaction is not None:
+            self.compaction.join()
+            self.compaction = None
+
+    def save(self):
+        if self.read_only:
+            return
+
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+
+    def close(self):
+        if self.read_only:
+            return
+
+        self.save()
+        self.wait_for_compaction()
+        self.journal.close()
+
+
+class SQLiteDatabase(Database):
+    """The database in SQLite, in WAL mode. Each issue record is upserted in its own transaction as soon as it's put.
+
+    With `read_only`, the file is opened read only, or not at all if it doesn't exist, and changes are kept in memory.
+
+    """
+
+    def __init__(self, path, read_only=False):
+        self.path = path
+        self.read_only = read_only
+        self._pending_meta = {}
+        self._pending_issues = {}
+
+        if not read_only:
+            self.connection = sqlite3.connect(path)
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            # In WAL mode NORMAL is still safe against corruption; a power loss may only lose the latest transactions.
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+            self.create_tables()
+        elif os.path.exists(path):
+            # The Python 2 sqlite3 module has no uri parameter, but SQLite itself understands URI file names.
+            self.connection = sqlite3.connect('file:%s?mode=ro' % urllib.quote(os.path.abspath(path)))
+        else:
+            # An empty database which is never written anywhere.
+            self.connection = sqlite3.connect(':memory:')
+            self.create_tables()
+
+    def create_tables(self):
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS issues (id INTEGER PRIMARY KEY, number INTEGER, updated_at TEXT, record TEXT NOT NULL)')
+
+    def get_meta(self, key, default=None):
+        if key in self._pending_meta:
+            return self._pending_meta[key]
+
+        row = self.connection.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_meta(self, key, value):
+        if self.read_only:
+            self._pending_meta[key] = value
+            return
+
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, json.dumps(value)))
+
+    def get_issue(self, issue_id):
+        if int(issue_id) in self._pending_issues:
+            return IssueRecord.from_dict(self._pending_issues[int(issue_id)])
+
+        row = self.connection.execute('SELECT record FROM issues WHERE id = ?', (int(issue_id),)).fetchone()
+        return IssueRecord.from_dict(json.loads(row[0])) if row else None
+
+    def put_issue(self, issue_id, record):
+        if isinstance(record, IssueRecord):
+            record = record.to_dict()
+
+        if self.read_only:
+            self._pending_issues[int(issue_id)] = record
+            return
+
+        with self.connection:
+            self.put_issue_row(issue_id, record)
+
+    def put_issue_row(self, issue_id, record):
+        self.connection.execute('INSERT OR REPLACE INTO issues (id, number, updated_at, record) VALUES (?, ?, ?, ?)', (int(issue_id), record.get('number'), record.get('updated_at'), json.dumps(record, sort_keys=True)))
+
+    def iter_issues(self):
+        for issue_id, record in self.connection.execute('SELECT id, record FROM issues ORDER BY id'):
+            if issue_id not in self._pending_issues:
+                yield issue_id, IssueRecord.from_dict(json.loads(record))
+        for issue_id, record in self._pending_issues.items():
+            yield issue_id, IssueRecord.from_dict(record)
+
+    def to_dict(self):
+        r = dict((key, json.loads(value)) for key, value in self.connection.execute('SELECT key, value FROM meta'))
+        r.update(self._pending_meta)
+        r['issues'] = dict((unicode(issue_id), record.to_dict()) for issue_id, record in self.iter_issues())
+        return r
+
+    def import_dict(self, data):
+        """Import a whole database in the JSON layout, in a single transaction."""
+
+        with self.connection:
+            for key, value in data.items():
+                if key != 'issues':
+                    self.connection.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, json.dumps(value)))
+            for key, record in data.get('issues', {}).items():
+                self.put_issue_row(key, record.to_dict() if isinstance(record, IssueRecord) else record)
+
+    def close(self):
+        self.connection.close()
+
+
+class IndexedDatabase(Database):
+    """The database as a file of issue records with an index sorted by issue id, so that opening it doesn't mean
+    reading it.
+
+    Records are stored as JSON, one per line, in the file at `path`. The index in `path`.index starts with a header
+    and the entries of a sorted section, found by binary search over a memory map, followed by a short unsorted tail
+    of entries for issues added since the index was last sorted. Other values go to a small JSON file, `path`.meta.
+
+    A record is only read and decoded when it is asked for. On save, changed records are written back in place if
+    they fit and appended otherwise, and the index entries pointing to them are updated.
+
+    """
+
+    INDEX_MAGIC = 'CBIX'
+    INDEX_VERSION = 1
+    # Magic, version, number of entries in the sorted section.
+    INDEX_HEADER = struct.Struct('<4sIQ')
+    # Issue id, offset and length of the record.
+    INDEX_ENTRY = struct.Struct('<qQI')
+
+    def __init__(self, path, read_only=False):
+        self.path = path
+        self.index_path = path + ".index"
+        self.meta_path = path + ".meta"
+        self.read_only = read_only
+        # Records read or put during this run, by issue id, and which of them need to be written.
+        self.records = {}
+        self.dirty = set()
+        self.meta_dirty = False
+
+        self.meta = {}
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, 'rb') as f:
+                self.meta = json.load(f)
+
+        if not os.path.exists(self.index_path):
+            if read_only:
+                self.records_file = self.index_file = self.index_map = None
+                self.sorted_count = 0
+                self.tail = {}
+                return
+            open(path, 'ab').close()
+            with open(self.index_path, 'wb') as f:
+                f.write(self.INDEX_HEADER.pack(self.INDEX_MAGIC, self.INDEX_VERSION, 0))
+
+        self.records_file = open(path, 'rb' if read_only else 'r+b')
+        self.open_index()
+
+    def open_index(self):
+        self.index_file = open(self.index_path, 'rb' if self.read_only else 'r+b')
+        self.index_map = mmap.mmap(self.index_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.sorted_count = self.INDEX_HEADER.unpack_from(self.index_map)
+        if magic != self.INDEX_MAGIC or version != self.INDEX_VERSION:
+            raise Exception("{} is not a CappBot database index of version {}.".format(self.index_path, self.INDEX_VERSION))
+
+        # The tail is kept short by sorting it into the index now and then, so it's fine to read it in full.
+        self.tail = {}
+        position = self.INDEX_HEADER.size + self.sorted_count * self.INDEX_ENTRY.size
+        while position + self.INDEX_ENTRY.size <= len(self.index_map):
+            issue_id, offset, length = self.INDEX_ENTRY.unpack_from(self.index_map, position)
+            self.tail[issue_id] = (position, offset, length)
+            position += self.INDEX_ENTRY.size
+
+    def find(self, issue_id):
+        """Return the position of the index entry of the issue, and the offset and length of its record, or None."""
+
+        if issue_id in self.tail:
+            return self.tail[issue_id]
+
+        lo, hi = 0, self.sorted_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            position = self.INDEX_HEADER.size + mid * self.INDEX_ENTRY.size
+            entry_id, offset, length = self.INDEX_ENTRY.unpack_from(self.index_map, position)
+            if entry_id < issue_id:
+                lo = mid + 1
+            elif entry_id > issue_id:
+                hi = mid
+            else:
+                return position, offset, length
+        return None
+
+    def read_record(self, offset, length):
+        self.records_file.seek(offset)
+        return IssueRecord.from_dict(json.loads(self.records_file.read(length)))
+
+    def get_meta(self, key, default=None):
+        return self.meta.get(key, default)
+
+    def set_meta(self, key, value):
+        self.meta[key] = value
+        self.meta_dirty = True
+
+    def get_issue(self, issue_id):
+        issue_id = int(issue_id)
+        record = self.records.get(issue_id)
+        if record is None and self.index_map is not None:
+            entry = self.find(issue_id)
+            if entry is not None:
+                record = self.records[issue_id] = self.read_record(*entry[1:])
+        return record
+
+    def put_issue(self, issue_id, record):
+        if not isinstance(record, IssueRecord):
+            record = IssueRecord.from_dict(record)
+        self.records[int(issue_id)] = record
+        self.dirty.add(int(issue_id))
+
+    def iter_ids(self):
+        ids = set(self.records)
+        if self.index_map is not None:
+            ids.update(self.tail)
+            for n in range(self.sorted_count):
+                ids.add(self.INDEX_ENTRY.unpack_from(self.index_map, self.INDEX_HEADER.size + n * self.INDEX_ENTRY.size)[0])
+        return sorted(ids)
+
+    def iter_issues(self):
+        for issue_id in self.iter_ids():
+            record = self.records.get(issue_id)
+            if record is None:
+                record = self.read_record(*self.find(issue_id)[1:])
+            yield issue_id, record
+
+    def to_dict(self):
+        r = dict(self.meta)
+        r['issues'] = dict((unicode(issue_id), record.to_dict()) for issue_id, record in self.iter_issues())
+        return r
+
+    def import_dict(self, data):
+        for key, value in data.items():
+            if key != 'issues':
+                self.set_meta(key, value)
+        for key, record in data.get('issues', {}).items():
+            self.put_issue(key, record)
+        self.save()
+
+    def save(self):
+        if self.read_only:
+            return
+
+        # Write the records first so that the index never points at a record which isn't there.
+        entries = []
+        self.records_file.seek(0, os.SEEK_END)
+        end = self.records_file.tell()
+        for issue_id in sorted(self.dirty):
+            data = json.dumps(self.records[issue_id].to_dict(), sort_keys=True)
+            entry = self.find(issue_id)
+            if entry is not None and len(data) <= entry[2]:
+                # Blank out what's left of the old record. JSON doesn't mind.
+                position, offset, line = entry[0], entry[1], data.ljust(entry[2])
+            else:
+                position, offset, line = (entry[0] if entry else None), end, data + "\n"
+                end += len(line)
+            self.records_file.seek(offset)
+            self.records_file.write(line)
+            entries.append((position, issue_id, offset, len(data)))
+        self.records_file.flush()
+        os.fsync(self.records_file.fileno())
+
+        self.index_file.seek(0, os.SEEK_END)
+        tail_end = self.index_file.tell()
+        for position, issue_id, offset, length in entries:
+            if position is None:
+                position = tail_end
+                tail_end += self.INDEX_ENTRY.size
+            self.index_file.seek(position)
+            self.index_file.write(self.INDEX_ENTRY.pack(issue_id, offset, length))
+            if position >= self.INDEX_HEADER.size + self.sorted_count * self.INDEX_ENTRY.size:
+                self.tail[issue_id] = (position, offset, length)
+        self.index_file.flush()
+        os.fsync(self.index_file.fileno())
+        self.dirty.clear()
+
+        if entries:
+            # Remap so that lookups see the new tail and the entries changed in place.
+            self.index_map.close()
+            self.index_map = mmap.mmap(self.index_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self.tail) > max(1024, self.sorted_count // 8):
+            self.sort_index()
+
+        if self.meta_dirty:
+            with open(self.meta_path + ".new", 'wb') as f:
+                json.dump(self.meta, f, indent=1, sort_keys=True)
+            shutil.move(self.meta_path + ".new", self.meta_path)
+            self.meta_dirty = False
+
+    def sort_index(self):
+        """Rewrite the index with all entries in the sorted section."""
+
+        entries = [self.INDEX_ENTRY.unpack_from(self.index_map, self.INDEX_HEADER.size + n * self.INDEX_ENTRY.size) for n in range(self.sorted_count)]
+        entries.extend((issue_id, offset, length) for issue_id, (position, offset, length) in self.tail.items())
+        entries.sort()
+
+        new_path = self.index_path + ".new"
+        with open(new_path, 'wb') as f:
+            f.write(self.INDEX_HEADER.pack(self.INDEX_MAGIC, self.INDEX_VERSION, len(entries)))
+            for entry in entries:
+                f.write(self.INDEX_ENTRY.pack(*entry))
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.index_map.close()
+        self.index_file.close()
+        shutil.move(new_path, self.index_path)
+        self.open_index()
+
+    def close(self):
+        self.save()
+        if self.index_map is not None:
+            self.index_map.close()
+            self.index_file.close()
+            self.records_file.close()
+
+
+BACKENDS = {
+    'json': JSONDatabase,
+    'sqlite': SQLiteDatabase,
+    'indexed': IndexedDatabase,
+}
+
+
+def open_database(backend, path, read_only=False, **options):
+    """Open the database at `path` with the named backend. Any `options` are passed on to the backend."""
+
+    try:
+        cls = BACKENDS[backend]
+    except KeyError:
+        raise ValueError("Unknown database backend %r. Use one of: %s." % (backend, ", ".join(sorted(BACKENDS))))
+    return cls(path, read_only=read_only, **options)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convert a CappBot database between backends. For example, import an existing JSON database into SQLite.")
+    parser.add_argument('source', help='database to read')
+    parser.add_argument('destination', help='database to write (must not exist yet)')
+    parser.add_argument('--from', dest='source_backend', default='json', choices=sorted(BACKENDS),
+        help='backend of the source database (default: json)')
+    parser.add_argument('--to', dest='destination_backend', default='sqlite', choices=sorted(BACKENDS),
+        help='backend of the destination database (default: sqlite)')
+
+    args = parser.parse_args()
+
+    if os.path.exists(args.destination):
+        parser.error("%s already exists." % args.destination)
+
+    source = open_database(args.source_backend, args.source, read_only=True)
+    data = source.to_dict()
+    destination = open_database(args.destination_backend, args.destination)
+    destination.import_dict(data)
+    destination.close()
+    source.close()
+
+    print "Copied %d issue record(s) from %s to %s." % (len(data.get('issues', {})), args.source, args.destination)
@@ -0,0 +1,317 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+
+#
+# BSD License
+#
+# Copyright (c) 2012, Alexander Ljungberg
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+from mock import patch
+import doctest
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from database import Database, IndexedDatabase, IssueRecord, JSONDatabase, SQLiteDatabase, compress_snapshot, decode_snapshot, encode_snapshot
+import database
+
+
+RECORD = {
+    'id': 5001,
+    'number': 1,
+    'comments_count': 2,
+    'milestone_number': None,
+    'assignee_id': None,
+    'labels': [u'#needs-review'],
+    'updated_at': '2012-05-01T10:00:00Z',
+    'votes': None,
+    'latest_seen_comment_id': 7,
+}
+
+
+class TestDatabase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_dict_layout(self):
+        data = {}
+        database = Database(data)
+        database.set_meta('first_run', '2012-04-01T00:00:00')
+        database.put_issue(5001, RECORD)
+
+        self.assertEquals(database.to_dict(), {'first_run': '2012-04-01T00:00:00', 'issues': {u'5001': RECORD}})
+        self.assertTrue(data['issues'][u'5001'] is database.get_issue(5001))
+        self.assertEquals(database.get_issue(5001).to_dict(), RECORD)
+        self.assertEquals(database.get_issue(5002), None)
+
+    def test_record_round_trip(self):
+        record = IssueRecord.from_dict(dict(RECORD, labels=[u'enhancement', u'#needs-review'], future_field=[1]))
+
+        self.assertEquals(record.labels, [u'#needs-review', u'enhancement'])
+        self.assertEquals(record.to_dict(), dict(RECORD, labels=[u'#needs-review', u'enhancement'], future_field=[1]))
+        self.assertEquals(IssueRecord.from_dict(json.loads(json.dumps(record.to_dict()))).to_dict(), record.to_dict())
+
+        derived = dict(RECORD, vote_map={u'alice_tester': 1, u'bob': -1}, bot_commented=False)
+        self.assertEquals(IssueRecord.from_dict(derived).to_dict(), derived)
+
+    def test_json_refuses_leftover_new_file(self):
+        path = os.path.join(self.directory, 'db.json')
+        open(path + '.new', 'w').close()
+
+        self.assertRaises(Exception, JSONDatabase, path)
+
+    def test_json_journal_replay(self):
+        path = os.path.join(self.directory, 'db.json')
+        database = JSONDatabase(path)
+        database.set_meta('first_run', '2012-04-01T00:00:00')
+        database.put_issue(5001, RECORD)
+        database.put_issue(5001, dict(RECORD, votes=3))
+        # Crash without closing: nothing but the journal has been written.
+        self.assertFalse(os.path.exists(path))
+
+        database = JSONDatabase(path)
+        self.assertEquals(database.replayed, 3)
+        self.assertEquals(database.get_meta('first_run'), '2012-04-01T00:00:00')
+        self.assertEquals(database.get_issue(5001).to_dict(), dict(RECORD, votes=3))
+        database.close()
+
+    def test_json_journal_damaged_entry(self):
+        path = os.path.join(self.directory, 'db.json')
+        database = JSONDatabase(path)
+        database.put_issue(5001, RECORD)
+        database.close()
+        with open(path + '.journal', 'ab') as f:
+            f.write('{"issue": "5002", "rec')
+
+        database = JSONDatabase(path)
+        self.assertEquals(database.replayed, 1)
+        database.put_issue(5003, RECORD)
+        database.close()
+
+        database = JSONDatabase(path)
+        self.assertEquals(database.get_issue(5001).to_dict(), RECORD)
+        self.assertEquals(database.get_issue(5002), None)
+        self.assertEquals(database.get_issue(5003).to_dict(), RECORD)
+        database.close()
+
+    def test_json_compaction(self):
+        path = os.path.join(self.directory, 'db.json')
+        database = JSONDatabase(path, compact_size=1000)
+        for n in range(10):
+            database.put_issue(n, dict(RECORD, id=n))
+        database.close()
+
+        with open(path, 'rb') as f:
+            snapshot, version = decode_snapshot(f.read())
+        self.assertTrue(len(snapshot['issues']) >= 4)
+        self.assertFalse(os.path.exists(path + '.journal.old'))
+
+        database = JSONDatabase(path)
+        self.assertEquals(sorted(issue_id for issue_id, record in database.iter_issues()), range(10))
+        database.close()
+
+    def test_json_interrupted_compaction(self):
+        path = os.path.join(self.directory, 'db.json')
+        database = JSONDatabase(path)
+        database.put_issue(5001, RECORD)
+        database.close()
+        # As if we crashed while writing a new snapshot.
+        os.rename(path + '.journal', path + '.journal.old')
+        with open(path + '.new', 'wb') as f:
+            f.write('{"issu')
+
+        database = JSONDatabase(path)
+        self.assertEquals(database.get_issue(5001).to_dict(), RECORD)
+        database.close()
+        self.assertFalse(os.path.exists(path + '.new'))
+        self.assertFalse(os.path.exists(path + '.journal.old'))
+        with open(path, 'rb') as f:
+            self.assertEquals(Database(decode_snapshot(f.read())[0]).to_dict()['issues'], {u'5001': RECORD})
+
+    def test_snapshot_round_trip(self):
+        data = {'first_run': '2012-04-01T00:00:00', 'issues': {
+            u'5001': RECORD,
+            u'5002': dict(RECORD, id=5002, labels=[], votes=-1, updated_at=None, future_field=True),
+            u'5003': dict(RECORD, id=5003, labels=[u'#needs-review', u'enhancement'], vote_map={u'alice': 1, u'bob': -1}, votes=0, bot_commented=True),
+            u'5004': dict(RECORD, id=5004, vote_map={}, bot_commented=False),
+        }}
+
+        for compression in (None, 'zlib', 'bz2'):
+            snapshot = compress_snapshot(encode_snapshot(Database(json.loads(json.dumps(data))).data), compression)
+            decoded, version = decode_snapshot(snapshot)
+            self.assertEquals(version, 2)
+            self.assertEquals(Database(decoded).to_dict(), data)
+
+        self.assertEquals(decode_snapshot(compress_snapshot(encode_snapshot({}))), ({'issues': {}}, 2))
+        self.assertRaises(Exception, decode_snapshot, 'CBDB\x63\x00\x00')
+
+    def test_snapshot_version_1(self):
+        data = Database({'issues': {u'5001': dict(RECORD, vote_map={u'alice': 1}, bot_commented=True)}}).data
+        with patch('database.SNAPSHOT_VERSION', 1):
+            snapshot = compress_snapshot(encode_snapshot(data))
+
+        decoded, version = decode_snapshot(snapshot)
+        self.assertEquals(version, 1)
+        # Version 1 didn't store the derived state.
+        self.assertEquals(Database(decoded).to_dict(), {'issues': {u'5001': RECORD}})
+
+    def test_snapshot_migration(self):
+        path = os.path.join(self.directory, 'db.json')
+        with open(path, 'wb') as f:
+            json.dump({'first_run': '2012-04-01T00:00:00', 'issues': {u'5001': RECORD}}, f, indent=1, sort_keys=True)
+
+        # A JSON database stays JSON by default...
+        database = JSONDatabase(path)
+        database.close()
+        with open(path, 'rb') as f:
+            self.assertEquals(json.load(f)['first_run'], '2012-04-01T00:00:00')
+
+        # ...is rewritten in the binary format when so configured...
+        database = JSONDatabase(path, snapshot_format='binary')
+        database.close()
+        with open(path, 'rb') as f:
+            self.assertTrue(f.read().startswith('CBDB'))
+
+        # ...and back again.
+        database = JSONDatabase(path)
+        self.assertEquals(database.get_issue(5001).to_dict(), RECORD)
+        database.close()
+        with open(path, 'rb') as f:
+            self.assertEquals(json.load(f)['issues'], {u'5001': RECORD})
+
+    def test_sqlite_round_trip(self):
+        path = os.path.join(self.directory, 'db.sqlite')
+        database = SQLiteDatabase(path)
+        database.set_meta('first_run', '2012-04-01T00:00:00')
+        database.put_issue(5001, RECORD)
+        database.put_issue(5001, dict(RECORD, votes=3))
+        database.close()
+
+        database = SQLiteDatabase(path)
+        self.assertEquals(database.get_meta('first_run'), '2012-04-01T00:00:00')
+        self.assertEquals(database.get_meta('issues_synced_until'), None)
+        self.assertEquals(database.get_issue(5001).to_dict(), dict(RECORD, votes=3))
+        self.assertEquals(database.get_issue(u'5001').to_dict(), dict(RECORD, votes=3))
+        self.assertEquals(database.get_issue(5002), None)
+        database.close()
+
+    def test_sqlite_read_only(self):
+        path = os.path.join(self.directory, 'db.sqlite')
+        database = SQLiteDatabase(path, read_only=True)
+        # Not even created.
+        self.assertFalse(os.path.exists(path))
+        database.set_meta('first_run', '2012-04-01T00:00:00')
+        database.put_issue(5001, RECORD)
+        # Changes are visible to the run itself...
+        self.assertEquals(database.get_issue(5001).to_dict(), RECORD)
+        self.assertEquals(database.to_dict()['issues'], {u'5001': RECORD})
+        database.close()
+
+        # ...but never written.
+        database = SQLiteDatabase(path)
+        self.assertEquals(database.get_meta('first_run'), None)
+        self.assertEquals(database.get_issue(5001), None)
+        database.set_meta('first_run', '2012-04-01T00:00:00')
+        database.close()
+
+        with open(path, 'rb') as f:
+            contents = f.read()
+        database = SQLiteDatabase(path, read_only=True)
+        self.assertEquals(database.get_meta('first_run'), '2012-04-01T00:00:00')
+        database.set_meta('first_run', '2012-05-01T00:00:00')
+        database.put_issue(5001, RECORD)
+        self.assertEquals(database.to_dict()['issues'], {u'5001': RECORD})
+        database.close()
+        with open(path, 'rb') as f:
+            self.assertEquals(f.read(), contents)
+
+    def test_indexed_round_trip(self):
+        path = os.path.join(self.directory, 'db.idx')
+        database = IndexedDatabase(path)
+        database.set_meta('first_run', '2012-04-01T00:00:00')
+        for n in (5003, 5001, 5002):
+            database.put_issue(n, dict(RECORD, id=n))
+        database.close()
+
+        database = IndexedDatabase(path)
+        # Nothing is read until asked for.
+        self.assertEquals(database.records, {})
+        self.assertEquals(database.get_meta('first_run'), '2012-04-01T00:00:00')
+        self.assertEquals(database.get_issue(5002).to_dict(), dict(RECORD, id=5002))
+        self.assertEquals(database.records.keys(), [5002])
+        self.assertEquals(database.get_issue(5004), None)
+        self.assertEquals([issue_id for issue_id, record in database.iter_issues()], [5001, 5002, 5003])
+        database.close()
+
+    def test_indexed_update(self):
+        path = os.path.join(self.directory, 'db.idx')
+        database = IndexedDatabase(path)
+        database.put_issue(5001, dict(RECORD, votes=10))
+        database.put_issue(5002, RECORD)
+        database.save()
+        size = os.path.getsize(path)
+
+        # A record which fits is written in place, a longer one is appended.
+        database.put_issue(5001, dict(RECORD, votes=2))
+        database.save()
+        self.assertEquals(os.path.getsize(path), size)
+        database.put_issue(5002, dict(RECORD, labels=[u'#needs-review', u'enhancement']))
+        database.close()
+        self.assertTrue(os.path.getsize(path) > size)
+
+        database = IndexedDatabase(path)
+        self.assertEquals(database.get_issue(5001).votes, 2)
+        self.assertEquals(database.get_issue(5002).labels, [u'#needs-review', u'enhancement'])
+        database.close()
+
+    def test_indexed_sort_index(self):
+        path = os.path.join(self.directory, 'db.idx')
+        database = IndexedDatabase(path)
+        for n in range(2000, 0, -1):
+            database.put_issue(n, dict(RECORD, id=n))
+        database.save()
+        # The tail grew too long and was sorted into the index.
+        self.assertEquals((database.sorted_count, database.tail), (2000, {}))
+        database.put_issue(3000, dict(RECORD, id=3000))
+        database.close()
+
+        database = IndexedDatabase(path)
+        self.assertEquals(database.tail.keys(), [3000])
+        self.assertEquals([database.get_issue(n).id for n in (1, 1000, 2000, 3000)], [1, 1000, 2000, 3000])
+        database.close()
+
+    def test_import_json(self):
+        json_path = os.path.join(self.directory, 'db.json')
+        data = {'first_run': '2012-04-01T00:00:00', 'issues': {u'5001': RECORD}}
+        with open(json_path, 'wb') as f:
+            json.dump(data, f)
+
+        database = SQLiteDatabase(os.path.join(self.directory, 'db.sqlite'))
+        database.import_dict(JSONDatabase(json_path, read_only=True).to_dict())
+
+        self.assertEquals(database.to_dict(), data)
+        self.assertEquals([(issue_id, record.to_dict()) for issue_id, record in database.iter_issues()], [(5001, RECORD)])
+        database.close()
+
+
+def load_tests(loader, tests, pattern):
+    tests.addTests(doctest.DocTestSuite(database))
+    return tests
+
+
+if __name__ == '__main__':
+    unittest.main()
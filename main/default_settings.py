@@ -2,10 +2,54 @@
 
 GITHUB_USER = "cappbot"
 GITHUB_TOKEN = ""
+
+# Tokens of other accounts whose rate limit budgets CappBot may use for
+# reading. Reads go with whichever token has the most budget left. Anything
+# CappBot writes is still written as GITHUB_USER, using GITHUB_TOKEN.
+GITHUB_EXTRA_TOKENS = []
 GITHUB_REPOSITORY = "cappuccino/cappuccino"
 
 DATABASE = "cappbot-%s-db.json" % GITHUB_REPOSITORY.replace('/', '-')
 
+# How DATABASE is stored:
+#  "json": a snapshot of the database and a journal of the changes since
+#          (see below.)
+#  "sqlite": an SQLite database, written to as soon as each issue has been
+#          handled.
+#  "indexed": a file of issue records with an index by issue id, so that only
+#          the records of the issues looked at are read. Startup time doesn't
+#          grow with the number of issues.
+# To move an existing JSON database to another backend, run e.g.
+# `python database.py --to sqlite cappbot-x-db.json cappbot-x-db.sqlite` and
+# point DATABASE at the new file.
+DATABASE_BACKEND = "json"
+
+# With the "json" backend, each change is appended to a journal file next to
+# DATABASE. Once the journal grows beyond this many bytes, the database is
+# written out as a new snapshot in the background and the journal restarts.
+DATABASE_COMPACT_SIZE = 1024 * 1024
+
+# The format of those snapshots: "json", or "binary" for a compact versioned
+# format. A snapshot in another format or an older version is converted when
+# the database is opened, so an older CappBot can't read a database after it
+# has been opened with "binary". Use `cappbot.py --export-json FILE` to look
+# inside a binary snapshot.
+DATABASE_SNAPSHOT_FORMAT = "json"
+
+# Compression of binary snapshots: "zlib", "bz2" or None.
+DATABASE_COMPRESSION = "zlib"
+
+# Pages of labels, milestones, collaborators and issues are cached in this file
+# together with their ETags. On the next run each page is requested
+# conditionally and unchanged pages are served from the cache. Such requests
+# don't count against the API rate limit. Set to None to disable.
+PAGE_CACHE = "cappbot-%s-page-cache.json" % GITHUB_REPOSITORY.replace('/', '-')
+
+# The most pages to keep in the page cache, dropping those not used for the
+# longest time first. Listings of what changed since the previous run are never
+# kept, since the next run asks for a later time. Set to None for no limit.
+PAGE_CACHE_SIZE = 2000
+
 # Ignore all closed issues not updated since before the CappBot database was
 # created. This will prevent CappBot from causing a flood of needless
 # notifications by addings its paper trail to issues long finished on its
@@ -13,15 +57,105 @@ DATABASE = "cappbot-%s-db.json" % GITHUB_REPOSITORY.replace('/', '-')
 # CappBot will work with them.
 IGNORE_CLOSED_ISSUES_NOT_UPDATED_SINCE_FIRST_RUN = True
 
-# If True, if the remaining rate limit drops below 3600, CappBot will wait
-# (1.0 / remaining_limit) at the beginning of handling a new issue.
+# If True, pace all API requests so that the remaining rate limit budget is
+# spread evenly over the time left until the budget resets. Up to
+# RATE_LIMIT_BURST requests can be made back to back before pacing kicks in,
+# so small runs are not slowed down.
 AVOID_RATE_LIMIT = True
-
-# Wait this many seconds after each update. This is separate and in addition
-# to any delay caused by AVOID_RATE_LIMIT. The purpose of UPDATE_DELAY is to
-# limit the maximum trouble per hour caused by CappBot if some bug causes it
-# to post over and over to the same issue.
-UPDATE_DELAY = 10
+RATE_LIMIT_BURST = 100
+
+# Make at most this many writes (comments, label, milestone, assignee, title
+# and state changes) per hour, with bursts of up to WRITE_BURST. This is
+# separate from and in addition to AVOID_RATE_LIMIT. The purpose is to limit
+# the maximum trouble per hour caused by CappBot if some bug causes it to post
+# over and over to the same issue. Set to None for no limit.
+WRITES_PER_HOUR = 1200
+WRITE_BURST = 10
+
+# All API requests are made over a small pool of persistent (keep-alive)
+# connections so that each request doesn't pay for a new TCP and TLS
+# handshake. HTTP_POOL_SIZE is the maximum number of simultaneous connections.
+HTTP_POOL_SIZE = 4
+
+# Close and reopen a pooled connection which has been unused for this many
+# seconds rather than risk reusing a connection the server has dropped.
+HTTP_POOL_IDLE_TIMEOUT = 60
+
+# If True, log every request with the statistics of the connection it used,
+# and a per connection summary at the end of each run (debug level.)
+HTTP_POOL_STATS = False
+
+# When all pages of a list are needed, fetch up to this many pages at the same
+# time once the first page reveals how many pages there are. The number of
+# simultaneous requests is also bounded by HTTP_POOL_SIZE.
+PAGE_FETCH_CONCURRENCY = 4
+
+# The comments of each issue are kept in this file so that when an issue
+# changes only its new comments need to be downloaded. Saving appends the
+# comments of the changed issues to a journal next to it, which is folded back
+# into the file once it's grown larger than the file itself. Set to None to keep
+# them in memory only.
+COMMENT_STORE = "cappbot-%s-comments.json" % GITHUB_REPOSITORY.replace('/', '-')
+
+# The labels, milestones and collaborators of the repository are kept in this
+# file. For METADATA_TTL seconds after they were last read from GitHub they are
+# used as they are; after that they are read again, using conditional requests.
+# A name missing from the catalog, like a label created since, also causes them
+# to be read again. --full-crawl always reads them. Set METADATA_CATALOG to None
+# to keep them in memory only.
+METADATA_CATALOG = "cappbot-%s-metadata.json" % GITHUB_REPOSITORY.replace('/', '-')
+METADATA_TTL = 60 * 60
+
+# During a run, save the database, the comment store and the page cache after
+# every CHECKPOINT_ISSUES examined issues or CHECKPOINT_SECONDS seconds,
+# whichever comes first, so that a run which is killed part way doesn't lose
+# its work.
+CHECKPOINT_ISSUES = 50
+CHECKPOINT_SECONDS = 60
+
+# Only ask GitHub for issues updated since the newest issue update fully
+# processed by the previous run, instead of listing every open and closed
+# issue each time. Use --full-crawl to occasionally reconcile with a full
+# listing anyway.
+INCREMENTAL_SYNC = True
+
+# With INCREMENTAL_SYNC, read the repository events feed to find the issues
+# changed since the previous run and fetch just those. When nothing happened
+# this is a single conditional request. If more has happened than GitHub keeps
+# in the feed, the issues updated since the previous run are listed instead.
+# With --daemon, runs are spaced out further if GitHub's X-Poll-Interval asks
+# for it.
+POLL_EVENTS = False
+
+# GitHub sometimes publishes an event later than newer ones. Each poll reads the
+# events feed back this many seconds before the newest event seen by the
+# previous poll, skipping the events it saw, so that such events aren't missed.
+EVENTS_OVERLAP_SECONDS = 300
+
+# Scan comments for commands and votes in this many processes. This only pays
+# off when very many comments have to be read, like on the first run against a
+# repository with a long history, or with --memorise-forgotten after losing the
+# database. The comments of ANALYSIS_BATCH issues at a time are downloaded and
+# then scanned side by side. Can be overridden with --processes.
+ANALYSIS_PROCESSES = 1
+ANALYSIS_BATCH = 100
+
+# With --daemon, CappBot keeps running and looks for changed issues every
+# DAEMON_INTERVAL seconds. Everything learnt in between, like the metadata
+# catalog and cached pages, stays in memory, so a check of a repository where
+# nothing happened takes a single conditional request. Changes are saved after
+# every check. On SIGTERM CappBot finishes the issue at hand, saves and exits.
+DAEMON_INTERVAL = 60
+
+# With --serve, CappBot listens for GitHub webhook deliveries on this address
+# and handles each issue an `issues` or `issue_comment` event is about right
+# away. Add a webhook for those events to the repository with the URL
+# http://WEBHOOK_HOST:WEBHOOK_PORT/ (usually behind a reverse proxy), content
+# type application/json and WEBHOOK_SECRET as the secret. Deliveries without a
+# valid signature are rejected, so a secret is required.
+WEBHOOK_HOST = "127.0.0.1"
+WEBHOOK_PORT = 8321
+WEBHOOK_SECRET = ""
 
 ## Issue Life Cycle ##
 
@@ -32,7 +166,10 @@ NEW_ISSUE_DEFAULTS = {
     'assignee': None
 }
 
-# When the given label has been set, clear these other labels.
+# When the given label has been set, clear these other labels. If a label
+# clearing another label is itself cleared by a third label, it has no effect.
+# CappBot refuses to start if labels clear themselves or each other in a
+# cycle, or if the rules would clear any of the new issue default labels.
 WHEN_LABEL_REMOVE_LABELS = {
     '#acknowledged': [
         '#needs-confirmation',
@@ -121,6 +258,11 @@ PERMISSIONS = {
 
 ## Messages and Paper Trail ##
 
+# If getPaperTrailMessage below is replaced, remember this many of the messages
+# it rendered recently, since the same combinations of assignee, milestone,
+# labels and votes come up over and over.
+PAPER_TRAIL_CACHE_SIZE = 1024
+
 LABEL_EXPLANATIONS = {
     '#needs-confirmation':  'This issue needs a volunteer to independently reproduce the issue.',
     '#needs-info':          'Additional information should be added as a comment to this isuse.',
@@ -182,6 +324,10 @@ def getPaperTrailMessage(assignee, milestone, labels, votes=None):
 
     return r.strip()
 
+# CappBot renders the messages of the stock paper trail functions from precompiled tables. Define
+# your own getPaperTrailMessage in your settings to have CappBot call it instead.
+getPaperTrailMessage.stock = True
+
 
 def getWhatsNextMessage(assignee, milestone, labels):
     who = "[%s](https://github.com/%s)" % (assignee, assignee) if assignee else None
@@ -197,3 +343,5 @@ def getWhatsNextMessage(assignee, milestone, labels):
         return '\n\n * %s' % ('\n * '.join(LABEL_EXPLANATIONS[label] for label in needs))
 
     return "A reviewer should examine this issue."
+
+getWhatsNextMessage.stock = True
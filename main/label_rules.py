@@ -0,0 +1,160 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+
+#
+# BSD License
+#
+# Copyright (c) 2012, Alexander Ljungberg
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""The label settings compiled into a table of bitmasks, applied to the labels of an issue at once."""
+
+
+class LabelRules(object):
+    """The label removal, mutual exclusion and open/close rules.
+
+    Each label named by a rule gets a bit. Every removal rule becomes a trigger bit and a mask of
+    labels to remove, ordered so that a rule whose trigger is removed by another rule comes after
+    that rule. Rules which contradict themselves or each other raise a ValueError.
+
+    >>> rules = LabelRules({'#fixed': ['#needs-patch']}, ['#new', '#fixed'])
+    >>> rules.apply(['#fixed', 'bug', '#needs-patch', '#new'])
+    (['bug', '#new'], [('#needs-patch', '#fixed'), ('#fixed', '#new')])
+
+    """
+
+    MAX_OUTCOMES = 4096
+
+    def __init__(self, remove_labels, exclusive_labels, close_labels=(), open_labels=(), default_labels=()):
+        self.ids = {}
+        self.names = {}
+
+        for trigger, labels in remove_labels.items():
+            if trigger in labels:
+                raise ValueError("The label %s removes itself." % trigger)
+
+        self.removal_rules = [(self.bit(trigger), self.mask(remove_labels[trigger])) for trigger in self.rule_order(remove_labels)]
+        self.exclusive_mask = self.mask(exclusive_labels)
+        # The outcome of the removal rules by the mask of labels present. Few combinations occur in practice.
+        self.outcomes = {}
+        self.close_labels = frozenset(label.lower() for label in close_labels)
+        self.open_labels = frozenset(label.lower() for label in open_labels)
+
+        default_labels = list(default_labels)
+        if self.apply(default_labels)[0] != default_labels:
+            raise ValueError("The default labels %s are not allowed together by the label rules." % ", ".join(default_labels))
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(settings.WHEN_LABEL_REMOVE_LABELS, settings.MUTUALLY_EXCLUSIVE_LABELS, settings.CLOSE_ISSUE_WHEN_CAPPBOT_ADDS_LABEL, settings.OPEN_ISSUE_WHEN_CAPPBOT_REMOVES_LABEL, settings.NEW_ISSUE_DEFAULTS.get('labels') or ())
+
+    def bit(self, label):
+        if label not in self.ids:
+            self.ids[label] = 1 << len(self.ids)
+            self.names[self.ids[label]] = label
+        return self.ids[label]
+
+    def mask(self, labels):
+        mask = 0
+        for label in labels:
+            mask |= self.bit(label)
+        return mask
+
+    @staticmethod
+    def rule_order(remove_labels):
+        """Order the triggers of the removal rules so that each comes after every trigger which removes it.
+
+        >>> LabelRules.rule_order({'b': ['c'], 'a': ['b'], 'c': []})
+        ['a', 'b', 'c']
+        >>> LabelRules.rule_order({'a': ['b'], 'b': ['a']})
+        Traceback (most recent call last):
+            ...
+        ValueError: The label rules for a, b remove each other.
+
+        """
+
+        removed_by = dict((trigger, set(other for other in remove_labels if trigger in remove_labels[other])) for trigger in remove_labels)
+        order = []
+        while removed_by:
+            ready = sorted(trigger for trigger, others in removed_by.items() if not others)
+            if not ready:
+                raise ValueError("The label rules for %s remove each other." % ", ".join(sorted(removed_by)))
+            for trigger in ready:
+                del removed_by[trigger]
+                for others in removed_by.values():
+                    others.discard(trigger)
+            order.extend(ready)
+        return order
+
+    def apply(self, labels):
+        """Apply the removal and mutual exclusion rules to a list of labels, last added last.
+
+        Return the labels to keep, in the same order, and a list of (removed label, label causing the removal)
+        pairs.
+
+        """
+
+        ids = self.ids
+        present = 0
+        for label in labels:
+            present |= ids.get(label, 0)
+
+        outcome = self.outcomes.get(present)
+        if outcome is None:
+            if len(self.outcomes) >= self.MAX_OUTCOMES:
+                self.outcomes.clear()
+            outcome = self.outcomes[present] = self.removals(present)
+        removed_mask, removals, exclusive = outcome
+
+        # Of mutually exclusive labels only the last added one stays.
+        if exclusive & (exclusive - 1):
+            for label in reversed(labels):
+                bit = ids.get(label, 0)
+                if bit & exclusive:
+                    removals = removals + [(other, label) for other in self.label_names(exclusive & ~bit)]
+                    removed_mask |= exclusive & ~bit
+                    break
+
+        if not removed_mask:
+            return labels, removals
+
+        return [label for label in labels if not ids.get(label, 0) & removed_mask], removals
+
+    def removals(self, present):
+        """Return what the removal rules do to the labels in `present`.
+
+        That's the mask of labels removed, a list of (removed label, trigger label) pairs, and the mask of the mutually
+        exclusive labels left.
+
+        """
+
+        removed_mask = 0
+        removals = []
+        for trigger_bit, remove_mask in self.removal_rules:
+            if present & trigger_bit and present & remove_mask:
+                removals.extend((label, self.names[trigger_bit]) for label in self.label_names(present & remove_mask))
+                removed_mask |= present & remove_mask
+                present &= ~remove_mask
+        return removed_mask, removals, present & self.exclusive_mask
+
+    def label_names(self, mask):
+        names = []
+        while mask:
+            bit = mask & -mask
+            names.append(self.names[bit])
+            mask ^= bit
+        return names
+
+    def closes_issue(self, label):
+        return label.lower() in self.close_labels
+
+    def opens_issue(self, label):
+        return label.lower() in self.open_labels
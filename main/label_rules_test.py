@@ -0,0 +1,62 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+
+#
+# BSD License
+#
+# Copyright (c) 2012, Alexander Ljungberg
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+import doctest
+import imp
+import unittest
+
+from label_rules import LabelRules
+from reference import apply_rules_by_scanning, random_label_sets
+import label_rules
+
+
+class TestLabelRules(unittest.TestCase):
+    def setUp(self):
+        self.settings = imp.load_source('settings', 'default_settings.py')
+        self.rules = LabelRules.from_settings(self.settings)
+
+    def test_same_as_scanning(self):
+        for labels in random_label_sets(self.settings, 2000):
+            kept, removed = self.rules.apply(labels)
+            expected_kept, expected_removed = apply_rules_by_scanning(self.settings, labels)
+            self.assertEquals(kept, expected_kept, labels)
+            self.assertEquals(sorted(removed), sorted(expected_removed), labels)
+
+    def test_chained_rules(self):
+        # b is removed by a before it gets to remove c, whatever the order of the settings.
+        rules = LabelRules({'b': ['c'], 'a': ['b']}, [])
+        self.assertEquals(rules.apply(['c', 'b', 'a']), (['c', 'a'], [('b', 'a')]))
+
+    def test_contradictions(self):
+        self.assertRaises(ValueError, LabelRules, {'a': ['a']}, [])
+        self.assertRaises(ValueError, LabelRules, {'a': ['b'], 'b': ['c'], 'c': ['a']}, [])
+        self.assertRaises(ValueError, LabelRules, {'#fixed': ['#new']}, [], default_labels=['#new', '#fixed'])
+        self.assertRaises(ValueError, LabelRules, {}, ['#new', '#fixed'], default_labels=['#new', '#fixed'])
+
+    def test_open_close(self):
+        self.assertTrue(self.rules.closes_issue('#Fixed'))
+        self.assertFalse(self.rules.closes_issue('#new'))
+        self.assertTrue(self.rules.opens_issue('#duplicate'))
+
+
+def load_tests(loader, tests, pattern):
+    tests.addTests(doctest.DocTestSuite(label_rules))
+    return tests
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+
+#
+# BSD License
+#
+# Copyright (c) 2012, Alexander Ljungberg
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""Labels, milestones and collaborators of the repository, kept between runs."""
+
+import json
+import logbook
+import os
+import shutil
+import time
+
+
+def lower_index(names):
+    """Map the lower case form of each name to the name.
+
+    >>> lower_index(['Foundation', 'bug'])['foundation']
+    'Foundation'
+
+    """
+
+    return dict((name.lower(), name) for name in names)
+
+
+class MetadataCatalog(object):
+    """The label names, milestone titles and collaborator logins of a repository.
+
+    Names are looked up case insensitively through indexes by lower case name. If `path` is
+    given the catalog is loaded from and saved to that JSON file. It is considered fresh for
+    `ttl` seconds after it was last refreshed from GitHub.
+
+    """
+
+    def __init__(self, path=None, ttl=0, clock=time.time):
+        self.path = path
+        self.ttl = ttl
+        self.clock = clock
+        self.refreshed_at = None
+        self._dirty = False
+        self._set([], [], [])
+
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'rb') as f:
+                    data = json.load(f)
+                self._set(data['labels'], data['milestones'], data['collaborators'])
+                self.refreshed_at = data['refreshed_at']
+            except (ValueError, KeyError):
+                # It's all on GitHub anyway. Refresh rather than refusing to run.
+                logbook.warning(u"Ignoring unreadable metadata catalog %s." % path)
+
+    def is_fresh(self):
+        return self.refreshed_at is not None and self.clock() - self.refreshed_at < self.ttl
+
+    def update(self, labels, milestones, collaborators):
+        """Replace the contents of the catalog with what was just read from GitHub."""
+
+        self._set(labels, milestones, collaborators)
+        self.refreshed_at = self.clock()
+        self._dirty = True
+
+    def _set(self, labels, milestones, collaborators):
+        self.labels = set(labels)
+        self.milestones = set(milestones)
+        self.collaborators = set(collaborators)
+        self._labels_by_lower = lower_index(self.labels)
+        self._milestones_by_lower = lower_index(self.milestones)
+        self._collaborators_by_lower = lower_index(self.collaborators)
+
+    def add_label(self, name):
+        self.labels.add(name)
+        self._labels_by_lower[name.lower()] = name
+        self._dirty = True
+
+    def add_milestone(self, title):
+        self.milestones.add(title)
+        self._milestones_by_lower[title.lower()] = title
+        self._dirty = True
+
+    def label(self, name):
+        """Return the label called `name` in any capitalisation, or None."""
+
+        return self._labels_by_lower.get(name.lower())
+
+    def milestone(self, title):
+        """Return the milestone titled `title` in any capitalisation, or None."""
+
+        return self._milestones_by_lower.get(title.lower())
+
+    def collaborator(self, login):
+        """Return the collaborator with the login `login` in any capitalisation, or None."""
+
+        return self._collaborators_by_lower.get(login.lower())
+
+    def save(self):
+        if not self.path or not self._dirty:
+            return
+
+        new_path = self.path + ".new"
+        with open(new_path, 'wb') as f:
+            json.dump({'refreshed_at': self.refreshed_at, 'labels': sorted(self.labels), 'milestones': sorted(self.milestones), 'collaborators': sorted(self.collaborators)}, f)
+        shutil.move(new_path, self.path)
+        self._dirty = False
@@ -23,27 +23,507 @@ from link_header import parse_link_value
 from urllib import quote_plus
 from urlparse import urljoin
 import argparse
+import collections
+import copy
+import datetime
+import email.utils
+import httplib
 import httplib2
 import json
 import logbook
+import os
+import Queue
+import shutil
+import sys
+import threading
+import time
 import urllib
 import urlparse
 
 
 from remoteobjects import RemoteObject, fields, ListObject
+from remoteobjects.promise import PromiseError
+
+class PooledConnection(object):
+    """One persistent `httplib2.Http` user agent and the statistics of the requests made through it."""
+
+    def __init__(self, number, timeout=None):
+        self.number = number
+        self.http = httplib2.Http(timeout=timeout)
+        self.created_at = time.time()
+        self.last_used_at = self.created_at
+        self.requests = 0
+        self.errors = 0
+        self.reconnects = 0
+        self.seconds = 0.0
+        self.bytes_received = 0
+
+    def close(self):
+        """Close the underlying sockets. The next request will reconnect."""
+
+        for connection in self.http.connections.values():
+            connection.close()
+        self.http.connections.clear()
+
+    def stats(self):
+        return {
+            'connection': self.number,
+            'requests': self.requests,
+            'errors': self.errors,
+            'reconnects': self.reconnects,
+            'seconds': self.seconds,
+            'bytes_received': self.bytes_received,
+        }
+
+
+class ConnectionPool(object):
+    """A bounded pool of persistent HTTP connections.
+
+    The pool can be used anywhere remoteobjects accepts an `http` user agent since it
+    implements the `httplib2.Http.request` interface. Each pooled user agent keeps its
+    connection to the API open between requests so only the first request through it pays
+    for the TCP and TLS handshakes. At most `size` requests are in flight at once; further
+    callers wait for a connection to be returned.
+
+    A connection which has been idle for more than `idle_timeout` seconds is closed before
+    being reused, since GitHub will likely have hung up on it by then anyway.
+
+    """
+
+    def __init__(self, size=4, idle_timeout=60, track_stats=False, timeout=None):
+        self.size = max(1, int(size))
+        self.idle_timeout = idle_timeout
+        self.track_stats = track_stats
+        self.timeout = timeout
+
+        self._lock = threading.Lock()
+        self._available = threading.BoundedSemaphore(self.size)
+        self._idle = []
+        self._connections = []
+
+    def _checkout(self):
+        self._available.acquire()
+        with self._lock:
+            if self._idle:
+                # Reuse the most recently used connection first, it's the least likely to have gone stale.
+                connection = self._idle.pop()
+            else:
+                connection = PooledConnection(len(self._connections) + 1, timeout=self.timeout)
+                self._connections.append(connection)
+
+        if self.idle_timeout is not None and connection.requests and time.time() - connection.last_used_at > self.idle_timeout:
+            connection.close()
+            connection.reconnects += 1
+
+        return connection
+
+    def _checkin(self, connection):
+        connection.last_used_at = time.time()
+        with self._lock:
+            self._idle.append(connection)
+        self._available.release()
+
+    def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+        connection = self._checkout()
+        start = time.time()
+        try:
+            response, content = connection.http.request(uri, method=method, body=body, headers=headers, **kwargs)
+        except:
+            # Whatever state the socket is in now, don't hand it to the next caller.
+            connection.close()
+            connection.errors += 1
+            raise
+        else:
+            connection.bytes_received += len(content or '')
+        finally:
+            # Another thread may take the connection as soon as it's back in the pool, so count everything first.
+            connection.requests += 1
+            connection.seconds += time.time() - start
+            requests, seconds = connection.requests, connection.seconds
+            self._checkin(connection)
+
+        if self.track_stats:
+            logbook.debug(u"%s %s via connection %d (%d request(s), %.2fs total)" % (method, uri, connection.number, requests, seconds))
+
+        return response, content
+
+    def stats(self):
+        """Return the request statistics of each connection ever opened by this pool."""
+
+        with self._lock:
+            return [connection.stats() for connection in self._connections]
+
+    def close(self):
+        """Close all idle connections. The pool remains usable."""
+
+        with self._lock:
+            for connection in self._idle:
+                connection.close()
+
+
+class TokenBucket(object):
+    """Hands out request tokens at a steady `rate` per second, allowing bursts of up to `capacity` tokens.
+
+    A `rate` of None means no limit is known yet and tokens are free.
+
+    """
+
+    def __init__(self, capacity, rate=None):
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.rate = rate
+        self.reset_at = None
+        self.updated_at = None
+
+    def refill(self, now):
+        if self.updated_at is not None and self.rate:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def take(self, now):
+        """Take a token. Return the number of seconds to wait before it may be used."""
+
+        if self.rate is None:
+            return 0
+
+        self.refill(now)
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0
+        if self.rate > 0:
+            return -self.tokens / self.rate
+        # The budget is spent. Nothing to do but wait for the reset.
+        return max(0, self.reset_at - now) if self.reset_at else 0
+
+    def set_budget(self, remaining, reset_at, now):
+        """Spread `remaining` tokens evenly until `reset_at`, minus what's already in the bucket."""
+
+        self.refill(now)
+        self.tokens = min(self.tokens, remaining)
+        self.rate = max(0, remaining - max(0, self.tokens)) / max(1.0, reset_at - now)
+        self.reset_at = reset_at
+
+
+class RateLimiter(object):
+    """Paces all API requests.
+
+    Every response carries the remaining request budget and the time the budget resets in
+    its `X-RateLimit-Remaining` and `X-RateLimit-Reset` headers, which are passed on to
+    `set_budget`. The remaining budget is
+    spread evenly over the time left until the reset, with bursts of up to `burst` requests
+    allowed so that small runs aren't slowed down at all. If `burst` is None reads are not
+    paced.
+
+    Writes (anything but GET and HEAD) are additionally paced to at most `writes_per_hour`,
+    with bursts of up to `write_burst`. This limits the damage per hour should a bug cause
+    CappBot to post over and over to the same issue.
+
+    """
+
+    def __init__(self, burst=100, writes_per_hour=None, write_burst=10, clock=time.time, sleep=time.sleep):
+        self.reads = TokenBucket(burst) if burst is not None else None
+        self.writes = TokenBucket(write_burst, rate=writes_per_hour / 3600.0) if writes_per_hour else None
+        self.remaining = None
+        self.limit = None
+        self.reset_at = None
+        self.clock = clock
+        self.sleep = sleep
+        self._lock = threading.Lock()
+
+    def wait(self, method='GET'):
+        with self._lock:
+            now = self.clock()
+            delay = self.reads.take(now) if self.reads else 0
+            if self.writes and method not in ('GET', 'HEAD'):
+                delay = max(delay, self.writes.take(now))
+
+        if delay > 0:
+            logbook.debug(u"Pacing %s request: %s of %s requests remaining. Sleeping for %.1fs." % (method, self.remaining, self.limit, delay))
+            self.sleep(delay)
+
+    def set_budget(self, remaining, limit, reset_at):
+        if remaining is None:
+            return
+
+        with self._lock:
+            self.remaining = remaining
+            self.limit = limit
+            if reset_at is not None:
+                self.reset_at = reset_at
+                if self.reads:
+                    self.reads.set_budget(remaining, reset_at, self.clock())
+
+
+class TokenPool(object):
+    """A set of API tokens and what is known about the rate limit budget of each.
+
+    The first token is the primary token: the account CappBot acts as. Requests which must
+    be made as that account go with it. Any other request goes with the token with the most
+    remaining budget, so that several accounts' budgets can be used by one CappBot.
+
+    """
+
+    def __init__(self, tokens):
+        self.tokens = list(tokens)
+        self._budgets = dict((token, (None, None, None)) for token in self.tokens)
+        self._lock = threading.Lock()
+
+    @property
+    def primary(self):
+        return self.tokens[0]
+
+    def choose(self, primary=False):
+        if primary or len(self.tokens) == 1:
+            return self.primary
+
+        now = time.time()
 
-# TODO Don't use a global since this only allows one token at a time.
-SharedGitHub = None
+        def remaining(token):
+            remaining, limit, reset_at = self._budgets[token]
+            if remaining is None:
+                # Never used. As good as a full budget.
+                return float('inf')
+            if reset_at is not None and reset_at <= now:
+                return limit if limit is not None else float('inf')
+            return remaining
+
+        with self._lock:
+            # On a tie, max() picks the first token, preferring the primary one.
+            return max(self.tokens, key=remaining)
+
+    def update(self, token, response):
+        """Note the budget left for `token` according to the `X-RateLimit-*` headers of the response."""
+
+        remaining = response.get('x-ratelimit-remaining')
+        if remaining is None:
+            return
+
+        limit = response.get('x-ratelimit-limit')
+        reset_at = response.get('x-ratelimit-reset')
+        with self._lock:
+            self._budgets[token] = (int(remaining), int(limit) if limit is not None else None, float(reset_at) if reset_at is not None else None)
+
+    def budget(self):
+        """Return the total (remaining, limit, reset_at) over all tokens with a known budget, reset_at being the latest reset time.
+
+        Returns (None, None, None) if nothing is known yet.
+
+        """
+
+        with self._lock:
+            known = [budget for budget in self._budgets.values() if budget[0] is not None]
+
+        if not known:
+            return None, None, None
+
+        limits = [limit for remaining, limit, reset_at in known if limit is not None]
+        resets = [reset_at for remaining, limit, reset_at in known if reset_at is not None]
+        return sum(remaining for remaining, limit, reset_at in known), sum(limits) if limits else None, max(resets) if resets else None
+
+
+class PageCache(object):
+    """A persistent cache of list pages for conditional requests.
+
+    For each page URL the cache keeps the `ETag` and the decoded body of the last full
+    response, as well as its `Link` header so the following pages can still be found.
+    The next request for the same URL sends `If-None-Match` and a `304 Not Modified`
+    answer is served from the cache. GitHub doesn't count 304s against the rate limit.
+
+    Listings with a `since` parameter are not kept, since the next listing will ask for a later
+    time. Of the other pages at most `size` are kept, forgetting those not used for the longest time.
+
+    If `path` is given the cache is loaded from and saved to that JSON file.
+
+    """
+
+    def __init__(self, path=None, size=None):
+        self.path = path
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # From least to most recently used.
+        self._pages = collections.OrderedDict()
+        self._dirty = False
+
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'rb') as f:
+                    pages = json.load(f)
+            except ValueError:
+                # It's only a cache. Start over rather than refusing to run.
+                logbook.warning(u"Ignoring unreadable page cache %s." % path)
+            else:
+                # Older caches were saved as an object, in no particular order.
+                for url, page in (pages.items() if isinstance(pages, dict) else pages):
+                    if self.cacheable(url):
+                        self._pages[url] = page
+                self._dirty = self.evict() or len(self._pages) != len(pages)
+
+    @staticmethod
+    def cacheable(url):
+        """Return true unless `url` lists what changed since some time, which won't be asked for again.
+
+        >>> PageCache.cacheable('https://api.github.com/repos/alice_tester/blox/issues?state=open&page=2')
+        True
+        >>> PageCache.cacheable('https://api.github.com/repos/alice_tester/blox/issues?state=all&since=2012-04-01T00%3A00%3A00Z')
+        False
+
+        """
+
+        return 'since' not in urlparse.parse_qs(urlparse.urlparse(url).query)
+
+    def evict(self):
+        """Forget the least recently used pages beyond `size`. Return true if any were forgotten."""
+
+        evicted = False
+        while self.size is not None and len(self._pages) > self.size:
+            self._pages.popitem(last=False)
+            evicted = True
+        return evicted
+
+    def get(self, url):
+        with self._lock:
+            page = self._pages.pop(url, None)
+            if page is not None:
+                self._pages[url] = page
+            return page
+
+    def store(self, url, etag, data, link=None):
+        if not self.cacheable(url):
+            return
+
+        with self._lock:
+            self._pages.pop(url, None)
+            self._pages[url] = {'etag': etag, 'data': data, 'link': link}
+            self.evict()
+            self._dirty = True
+
+    def discard(self, url):
+        with self._lock:
+            if self._pages.pop(url, None) is not None:
+                self._dirty = True
+
+    def __len__(self):
+        return len(self._pages)
+
+    def save(self):
+        if not self.path or not self._dirty:
+            return
+
+        with self._lock:
+            new_path = self.path + ".new"
+            with open(new_path, 'wb') as f:
+                json.dump(self._pages.items(), f)
+            shutil.move(new_path, self.path)
+            self._dirty = False
+
+
+class ObjectCache(object):
+    """Labels and milestones of repositories by name, so that `get_or_create_in_repository` needn't list them every time.
+
+    Entries are grouped by a key like `('labels', user_name, repo_name)`. A group is filled from
+    a full listing, and objects created through CappBot are added as they are posted. The whole
+    cache is dropped when GitHub rejects a write, since that may be down to a stale entry.
+
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._groups = {}
+
+    def get(self, key, name):
+        with self._lock:
+            obj = self._groups.get(key, {}).get(name)
+            if obj is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return obj
+
+    def fill(self, key, objects):
+        with self._lock:
+            self._groups[key] = objects
+
+    def add(self, key, name, obj):
+        with self._lock:
+            self._groups.setdefault(key, {})[name] = obj
+
+    def clear(self):
+        with self._lock:
+            self._groups = {}
+
+
+def page_range_urls(next_url, last_url):
+    """Return the URLs of all pages from `next_url` up to and including `last_url`.
+
+    Only works when the pages are numbered with a `page` query parameter, like GitHub does.
+    Otherwise returns an empty list.
+
+    >>> page_range_urls('https://api.github.com/x?page=2&state=open', 'https://api.github.com/x?page=4&state=open')
+    ['https://api.github.com/x?state=open&page=2', 'https://api.github.com/x?state=open&page=3', 'https://api.github.com/x?state=open&page=4']
+
+    """
+
+    if not next_url or not last_url:
+        return []
+
+    try:
+        first = int(urlparse.parse_qs(urlparse.urlparse(next_url)[4])['page'][0])
+        last_parts = list(urlparse.urlparse(last_url))
+        query = urlparse.parse_qsl(last_parts[4])
+        last = int(dict(query)['page'])
+    except (KeyError, ValueError):
+        return []
+
+    query = [(k, v) for k, v in query if k != 'page']
+    urls = []
+    for page in range(first, last + 1):
+        last_parts[4] = urllib.urlencode(query + [('page', page)])
+        urls.append(urlparse.urlunparse(last_parts))
+    return urls
+
+
+class BackgroundCall(threading.Thread):
+    """Call `function` on a background thread. `result()` waits for its return value, or reraises its exception."""
+
+    def __init__(self, function, *args, **kwargs):
+        super(BackgroundCall, self).__init__()
+        self.daemon = True
+        self._call = (function, args, kwargs)
+        self._result = None
+        self._error = None
+        self.start()
+
+    def run(self):
+        function, args, kwargs = self._call
+        try:
+            self._result = function(*args, **kwargs)
+        except:
+            self._error = sys.exc_info()
+
+    def result(self):
+        self.join()
+        if self._error:
+            raise self._error[0], self._error[1], self._error[2]
+        return self._result
 
 
 class GitHubRemoteObject(RemoteObject):
-    def get_request(self, headers=None, **kwargs):
-        request = super(GitHubRemoteObject, self).get_request(headers=headers, **kwargs)
+    # The `GitHub` instance which authenticates, paces and sends the requests of this object. It's set
+    # on the classes bound by each `GitHub` instance, and passed on to the objects received through them.
+    _github = None
 
-        # Add authentication header.
-        request['headers']['Authorization'] = 'token ' + SharedGitHub.api_token
+    @classmethod
+    def get(cls, url, http=None, **kwargs):
+        return super(GitHubRemoteObject, cls).get(url, http=http if http is not None else cls._github, **kwargs)
 
-        return request
+    def post(self, obj, http=None):
+        if obj._github is None:
+            obj._github = self._github
+        return super(GitHubRemoteObject, self).post(obj, http=http if http is not None else self._github)
 
     def update_from_response(self, url, response, content):
         try:
@@ -73,9 +553,7 @@ class GitHubRemoteObject(RemoteObject):
         headers['content-type'] = self.content_types[0]
 
         request = self.get_request(url=location, method='PATCH', body=body, headers=headers)
-        if http is None:
-            http = httplib2.Http()
-        response, content = http.request(**request)
+        response, content = (http if http is not None else self._github).request(**request)
 
         # print body, response, content
 
@@ -95,14 +573,46 @@ class GitHubRemoteListObject(ListObject, GitHubRemoteObject):
         r = super(GitHubRemoteObject, self).update_from_response(url, response, content)
 
         self._rate_limit = (response.get('x-ratelimit-remaining'), response.get('x-ratelimit-limit'))
+        self._date = response.get('date')
+        self.update_page_links(response.get('link'))
+        self.bind_entries()
+
+        return r
+
+    def update_from_cache(self, url, response, cached):
+        """Fill the list from a cached page after a `304 Not Modified` response."""
+
+        # Copy so that changes to the delivered objects don't leak into the cache.
+        self.update_from_dict(copy.deepcopy(cached['data']))
+        self._location = url
+        self._etag = cached['etag']
+        self._delivered = True
+        self._rate_limit = (response.get('x-ratelimit-remaining'), response.get('x-ratelimit-limit'))
+        # The date of the 304, not of the cached page: this is when the page was known to be current.
+        self._date = response.get('date')
+        self.update_page_links(cached.get('link'))
+        self.bind_entries()
 
+    @property
+    def server_date(self):
+        """The time GitHub sent this page, as a UTC datetime according to its `Date` header, or None."""
+
+        parsed = email.utils.parsedate_tz(getattr(self, '_date', None) or '')
+        return datetime.datetime.utcfromtimestamp(email.utils.mktime_tz(parsed)) if parsed else None
+
+    def bind_entries(self):
+        """Make the entries of the list use the same `GitHub` instance as the list itself."""
+
+        if self._github is not None:
+            for entry in self.entries:
+                entry._github = self._github
+
+    def update_page_links(self, links):
         # GitHub sends paging information as a response header like this:
         # <https://api.github.com/repos/cappuccino/cappuccino/issues?page=2&state=open>; rel="next", <https://api.github.com/repos/cappuccino/cappuccino/issues?page=11&state=open>; rel="last"
         #
         # <https://api.github.com/repos/cappuccino/cappuccino/issues?page=2&state=closed>; rel="next", <https://api.github.com/repos/cappuccino/cappuccino/issues?page=51&state=closed>; rel="last"
 
-        links = response.get('link')
-
         self._next_page_url = None
         self._last_page_url = None
         if links:
@@ -114,7 +624,38 @@ class GitHubRemoteListObject(ListObject, GitHubRemoteObject):
                     elif attrs['rel'] == 'last':
                         self._last_page_url = url
 
-        return r
+    def deliver(self):
+        """Fetch the page, revalidating a previously cached copy with `If-None-Match` if there is one."""
+
+        if self._delivered:
+            raise PromiseError('%s instance %r has already been delivered' % (type(self).__name__, self))
+        if self._location is None:
+            raise PromiseError('Instance %r has no URL from which to deliver' % (self,))
+
+        url = self._location
+        cache = self._github.page_cache if self._github is not None else None
+        cached = cache.get(url) if cache is not None else None
+
+        headers = {}
+        if cached:
+            headers['if-none-match'] = cached['etag']
+
+        request = self.get_request(headers=headers)
+        response, content = (self._http if self._http is not None else self._github).request(**request)
+
+        if cached and response.status == httplib.NOT_MODIFIED:
+            cache.hits += 1
+            self.update_from_cache(url, response, cached)
+            return
+
+        self.update_from_response(url, response, content)
+
+        if cache is not None:
+            cache.misses += 1
+            if 'etag' in response:
+                cache.store(url, response['etag'], json.loads(content), response.get('link'))
+            else:
+                cache.discard(url)
 
     @classmethod
     def get(cls, url, **kwargs):
@@ -128,6 +669,11 @@ class GitHubRemoteListObject(ListObject, GitHubRemoteObject):
             all_pages = kwargs['all_pages']
             del kwargs['all_pages']
 
+        concurrency = cls._github.page_concurrency if cls._github is not None else 1
+        if 'concurrency' in kwargs:
+            concurrency = kwargs['concurrency']
+            del kwargs['concurrency']
+
         r = None
         while url:
             url_parts = list(urlparse.urlparse(url))
@@ -155,8 +701,88 @@ class GitHubRemoteListObject(ListObject, GitHubRemoteObject):
 
             url = new_r._next_page_url
 
+            # Once the first page tells us where the last page is, all the remaining page URLs are known
+            # and can be fetched side by side.
+            page_urls = page_range_urls(url, new_r._last_page_url)
+            if concurrency > 1 and len(page_urls) > 1:
+                for page in cls.get_pages_concurrently(page_urls, concurrency, **kwargs):
+                    r.entries.extend(page.entries)
+                    # If pages were added while crawling, pick up the rest one by one.
+                    url = page._next_page_url
+
         return r
 
+    @classmethod
+    def get_pages_concurrently(cls, urls, concurrency, **kwargs):
+        """Fetch and deliver the pages at the given URLs using at most `concurrency` threads.
+
+        Pages are returned in the order of `urls`. If any page fails, the first error is reraised
+        once all threads are done.
+
+        """
+
+        pages = [None] * len(urls)
+        errors = []
+        work = Queue.Queue()
+        for n, url in enumerate(urls):
+            work.put((n, url))
+
+        def fetch():
+            while not errors:
+                try:
+                    n, url = work.get_nowait()
+                except Queue.Empty:
+                    return
+
+                try:
+                    page = super(ListObject, cls).get(url, **kwargs)
+                    page.deliver()
+                except:
+                    errors.append(sys.exc_info())
+                    return
+                pages[n] = page
+
+        threads = [threading.Thread(target=fetch) for n in range(min(concurrency, len(urls)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if errors:
+            raise errors[0][0], errors[0][1], errors[0][2]
+
+        return pages
+
+    @classmethod
+    def get_delivered(cls, url, **kwargs):
+        page = cls.get(url, **kwargs)
+        page.deliver()
+        return page
+
+    @classmethod
+    def iter_pages(cls, url, **kwargs):
+        """Yield the pages of the list at `url` one at a time, as soon as each arrives.
+
+        While the caller works with one page the next page is fetched in the background, so
+        at most two pages are held in memory no matter how long the list is.
+
+        """
+
+        kwargs.pop('all_pages', None)
+
+        next_page = BackgroundCall(cls.get_delivered, url, **kwargs)
+        try:
+            while next_page:
+                page = next_page.result()
+                # The next page URL from GitHub already carries the per_page parameter.
+                next_page = BackgroundCall(cls.get_delivered, page._next_page_url, http=kwargs.get('http')) if page._next_page_url else None
+                yield page
+        finally:
+            # When the caller stops early, wait out the download of the next page rather than leave it running
+            # unread on a connection of the pool.
+            if next_page:
+                next_page.join()
+
 
 class User(GitHubRemoteObject):
     """A GitHub user account.
@@ -213,7 +839,7 @@ class User(GitHubRemoteObject):
             url = '/users/%s' % quote_plus(kwargs['id'])
         else:
             url = '/user'
-        return cls.get(urljoin(SharedGitHub.endpoint, url), http=http)
+        return cls.get(urljoin(GitHub.endpoint, url), http=http)
 
     def __unicode__(self):
         return u"<User %d>" % self.id
@@ -259,7 +885,15 @@ class Labels(GitHubRemoteListObject):
 
     @classmethod
     def get_or_create_in_repository(cls, user_name, repo_name, label_name):
+        cache = cls._github.object_cache if cls._github is not None else None
+        key = ('labels', user_name, repo_name)
+        label = cache.get(key, label_name) if cache is not None else None
+        if label is not None:
+            return label
+
         labels = cls.by_repository(user_name, repo_name, per_page=100, all_pages=True)
+        if cache is not None:
+            cache.fill(key, dict((label.name, label) for label in labels))
         for label in labels:
             if label.name == label_name:
                 return label
@@ -267,6 +901,8 @@ class Labels(GitHubRemoteListObject):
         label = Label()
         label.name = label_name
         labels.post(label)
+        if cache is not None:
+            cache.add(key, label.name, label)
 
         return label
 
@@ -344,7 +980,15 @@ class Milestones(GitHubRemoteListObject):
         if milestone_title is None:
             return None
 
+        cache = cls._github.object_cache if cls._github is not None else None
+        key = ('milestones', user_name, repo_name)
+        milestone = cache.get(key, milestone_title) if cache is not None else None
+        if milestone is not None:
+            return milestone
+
         milestones = cls.by_repository_all(user_name, repo_name, per_page=100, all_pages=True)
+        if cache is not None:
+            cache.fill(key, dict((milestone.title, milestone) for milestone in milestones))
         for milestone in milestones:
             if milestone.title == milestone_title:
                 return milestone
@@ -352,6 +996,8 @@ class Milestones(GitHubRemoteListObject):
         milestone = Milestone()
         milestone.title = milestone_title
         milestones.post(milestone)
+        if cache is not None:
+            cache.add(key, milestone.title, milestone)
 
         return milestone
 
@@ -395,8 +1041,8 @@ class Comments(GitHubRemoteListObject):
         return self.entries.__getitem__(key)
 
     @classmethod
-    def by_issue(cls, issue, **kwargs):
-        """Get comments by issue.
+    def by_issue(cls, issue, since=None, **kwargs):
+        """Get comments by issue, optionally only those updated at or after `since` (an ISO 8601 timestamp).
 
         `GET /repos/:user/:repo/issues/:number/comments`
 
@@ -409,8 +1055,21 @@ class Comments(GitHubRemoteListObject):
             return comments
 
         url = '%s/comments' % issue.url
+        if since:
+            url += '?since=%s' % quote_plus(since)
         return cls.get(url, **kwargs)
 
+    @classmethod
+    def iter_by_issue(cls, issue, **kwargs):
+        """Yield the comments of an issue page by page, see `GitHubRemoteListObject.iter_pages`."""
+
+        if issue.comments == 0:
+            return
+
+        for page in cls.iter_pages('%s/comments' % issue.url, **kwargs):
+            for comment in page:
+                yield comment
+
 
 class Event(GitHubRemoteObject):
     """A GitHub event.
@@ -466,9 +1125,30 @@ class Events(GitHubRemoteListObject):
     def __getitem__(self, key):
         return self.entries.__getitem__(key)
 
+    def update_from_response(self, url, response, content):
+        r = super(Events, self).update_from_response(url, response, content)
+        self._poll_interval = response.get('x-poll-interval')
+        return r
+
+    def update_from_cache(self, url, response, cached):
+        super(Events, self).update_from_cache(url, response, cached)
+        self._poll_interval = response.get('x-poll-interval')
+
+    @property
+    def poll_interval(self):
+        """The number of seconds GitHub asks us to wait before asking for events again, according to `X-Poll-Interval`."""
+
+        r = getattr(self, '_poll_interval', None)
+        return int(r) if not r is None else None
+
+    def next_page(self):
+        """Return the next, older page of events, or None if this is the last one GitHub keeps."""
+
+        return type(self).get_delivered(self._next_page_url) if self._next_page_url else None
+
     @classmethod
     def by_repository(cls, repo_user, repo_name, **kwargs):
-        """Get events by repository.
+        """Get events by repository, newest first.
 
         `GET /repos/:user/:repo/events`
 
@@ -562,20 +1242,39 @@ class Issue(GitHubRemoteObject):
     def __unicode__(self):
         return u"<Issue %d>" % self.number
 
+    @classmethod
+    def by_number(cls, user_name, repo_name, number, **kwargs):
+        """Get an issue by its number.
+
+        `GET /repos/:user/:repo/issues/:number`
+
+        """
+
+        url = '/repos/%s/%s/issues/%d' % (user_name, repo_name, number)
+        issue = cls.get(urljoin(GitHub.endpoint, url), **kwargs)
+        issue.deliver()
+        return issue
+
 
 class Issues(GitHubRemoteListObject):
     entries = fields.List(fields.Object(Issue))
 
     @classmethod
-    def by_repository(cls, user_name, repo_name, state='open', **kwargs):
-        """Get issues by repository.
+    def repository_url(cls, user_name, repo_name, state='open', since=None):
+        url = '/repos/%s/%s/issues?state=%s' % (user_name, repo_name, state)
+        if since:
+            url += '&since=%s' % quote_plus(since)
+        return urljoin(GitHub.endpoint, url)
+
+    @classmethod
+    def by_repository(cls, user_name, repo_name, state='open', since=None, **kwargs):
+        """Get issues by repository, optionally only those updated at or after `since` (an ISO 8601 timestamp).
 
         `GET /repos/:user/:repo/issues`
 
         """
 
-        url = '/repos/%s/%s/issues?state=%s' % (user_name, repo_name, state)
-        return cls.get(urljoin(GitHub.endpoint, url), **kwargs)
+        return cls.get(cls.repository_url(user_name, repo_name, state, since), **kwargs)
 
     @classmethod
     def by_repository_all(cls, user_name, repo_name, **kwargs):
@@ -587,6 +1286,28 @@ class Issues(GitHubRemoteListObject):
         open_issues.entries.extend(closed_issues.entries)
         return open_issues
 
+    @classmethod
+    def iter_by_repository(cls, user_name, repo_name, state='open', since=None, on_page=None, **kwargs):
+        """Yield issues by repository page by page, see `GitHubRemoteListObject.iter_pages`.
+
+        If given, `on_page` is called with each page as it arrives, before its issues are yielded.
+
+        """
+
+        for page in cls.iter_pages(cls.repository_url(user_name, repo_name, state, since), **kwargs):
+            if on_page:
+                on_page(page)
+            for issue in page:
+                yield issue
+
+    @classmethod
+    def iter_by_repository_all(cls, user_name, repo_name, **kwargs):
+        """Yield all issues by repository (open and closed) page by page."""
+
+        for state in ('open', 'closed'):
+            for issue in cls.iter_by_repository(user_name, repo_name, state=state, **kwargs):
+                yield issue
+
 
 class Collaborator(GitHubRemoteObject):
     """A GitHub repo collaborator.
@@ -638,29 +1359,79 @@ class GitHub(object):
 
     endpoint = 'https://api.github.com/'
 
-    def __init__(self, api_token):
-        # TODO Don't use a global.
-        global SharedGitHub
-
+    def __init__(self, api_token, extra_tokens=(), pool_size=4, pool_idle_timeout=60, pool_stats=False, page_cache_path=None, page_cache_size=None, page_concurrency=1, rate_limit_burst=100, writes_per_hour=None, write_burst=10):
         self.api_token = api_token
-        SharedGitHub = self
-
-        self.User = User
-        self.Event = Event
-        self.Events = Events
-        self.Issue = Issue
-        self.Issues = Issues
-        self.Label = Label
-        self.Labels = Labels
-        self.Milestone = Milestone
-        self.Milestones = Milestones
-        self.Comment = Comment
-        self.Comments = Comments
-        self.Collaborator = Collaborator
-        self.Collaborators = Collaborators
+        self.tokens = TokenPool([api_token] + list(extra_tokens))
+        self.page_concurrency = page_concurrency
+        self.http = ConnectionPool(size=pool_size, idle_timeout=pool_idle_timeout, track_stats=pool_stats)
+        self.rate_limiter = RateLimiter(burst=rate_limit_burst, writes_per_hour=writes_per_hour, write_burst=write_burst)
+        self.page_cache = PageCache(page_cache_path, page_cache_size)
+        self.object_cache = ObjectCache()
+
+        self.User = self.bind(User)
+        self.Event = self.bind(Event)
+        self.Events = self.bind(Events)
+        self.Issue = self.bind(Issue)
+        self.Issues = self.bind(Issues)
+        self.Label = self.bind(Label)
+        self.Labels = self.bind(Labels)
+        self.Milestone = self.bind(Milestone)
+        self.Milestones = self.bind(Milestones)
+        self.Comment = self.bind(Comment)
+        self.Comments = self.bind(Comments)
+        self.Collaborator = self.bind(Collaborator)
+        self.Collaborators = self.bind(Collaborators)
+
+    def bind(self, cls):
+        """Return a subclass of the `GitHubRemoteObject` class `cls` whose requests are made through this instance."""
+
+        return type(cls.__name__, (cls,), {'_github': self, '__module__': cls.__module__})
+
+    def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+        """Make a request through the rate limiter and the connection pool, authenticated with one of our tokens.
+
+        This is the `httplib2.Http.request` interface, so the `GitHub` instance itself is the
+        user agent of all remote objects.
+
+        """
+
+        # Writes, and anything about the authenticated user, must be done as the account CappBot acts as.
+        token = self.tokens.choose(primary=method not in ('GET', 'HEAD') or uri == urljoin(self.endpoint, 'user'))
+        headers = dict(headers or {})
+        headers['Authorization'] = 'token ' + token
+
+        self.rate_limiter.wait(method)
+        response, content = self.http.request(uri, method=method, body=body, headers=headers, **kwargs)
+
+        self.tokens.update(token, response)
+        self.rate_limiter.set_budget(*self.tokens.budget())
+
+        # A rejected write may have been based on a label or milestone which no longer exists, or on a
+        # missing one which does by now.
+        if method not in ('GET', 'HEAD') and response.status in (httplib.NOT_FOUND, httplib.UNPROCESSABLE_ENTITY):
+            logbook.debug(u"Dropping cached labels and milestones after a %d response to %s %s." % (response.status, method, uri))
+            self.object_cache.clear()
+
+        return response, content
 
     def current_user(self, **kwargs):
-        return User.get_user(**kwargs)
+        return self.User.get_user(**kwargs)
+
+    def connection_stats(self):
+        """Return per connection request statistics for the connection pool."""
+
+        return self.http.stats()
+
+    def save(self):
+        """Write the page cache to disk."""
+
+        self.page_cache.save()
+
+    def close(self):
+        logbook.debug(u"Page cache: %d hit(s), %d miss(es)." % (self.page_cache.hits, self.page_cache.misses))
+        logbook.debug(u"Label and milestone cache: %d hit(s), %d miss(es)." % (self.object_cache.hits, self.object_cache.misses))
+        self.save()
+        self.http.close()
 
 
 if __name__ == '__main__':
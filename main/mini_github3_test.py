@@ -0,0 +1,273 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+
+#
+# BSD License
+#
+# Copyright (c) 2012, Alexander Ljungberg
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+from mock import Mock, patch
+import doctest
+import httplib2
+import json
+import threading
+import unittest
+import urlparse
+
+import mini_github3
+
+
+def fake_response(status=200, headers=None):
+    response = httplib2.Response(dict(headers or {}, status=status))
+    response['content-type'] = 'application/json; charset=utf-8'
+    return response
+
+
+class TestConnectionPool(unittest.TestCase):
+    def test_reuses_connection(self):
+        with patch('httplib2.Http') as Http:
+            Http.return_value.request = Mock(return_value=(fake_response(), '[]'))
+            Http.return_value.connections = {}
+            pool = mini_github3.ConnectionPool(size=2)
+
+            for n in range(3):
+                pool.request('https://api.github.com/user')
+
+        # Serial requests should all go over a single kept-alive connection.
+        self.assertEquals(Http.call_count, 1)
+        self.assertEquals([stats['requests'] for stats in pool.stats()], [3])
+
+    def test_counts_before_checkin(self):
+        with patch('httplib2.Http') as Http:
+            Http.return_value.request = Mock(return_value=(fake_response(), '[1, 2]'))
+            Http.return_value.connections = {}
+            pool = mini_github3.ConnectionPool(size=1)
+            checked_in = []
+            checkin = pool._checkin
+            pool._checkin = lambda connection: (checked_in.append(connection.stats()), checkin(connection))
+
+            pool.request('https://api.github.com/user')
+
+        # By the time another thread can take the connection, its statistics are complete.
+        self.assertEquals([(stats['requests'], stats['bytes_received']) for stats in checked_in], [(1, 6)])
+
+    def test_idle_timeout_reconnects(self):
+        with patch('httplib2.Http') as Http:
+            connection = Mock()
+            Http.return_value.request = Mock(return_value=(fake_response(), '[]'))
+            Http.return_value.connections = {'https:api.github.com': connection}
+            pool = mini_github3.ConnectionPool(size=1, idle_timeout=0)
+
+            pool.request('https://api.github.com/user')
+            pool._idle[0].last_used_at -= 1
+            pool.request('https://api.github.com/user')
+
+        connection.close.assert_called_once_with()
+        self.assertEquals(pool.stats()[0]['reconnects'], 1)
+
+
+class TestPageCache(unittest.TestCase):
+    def setUp(self):
+        self.github = mini_github3.GitHub('token')
+        self.github.http = Mock()
+
+    def test_not_modified_served_from_cache(self):
+        url = 'https://api.github.com/repos/alice_tester/blox/labels'
+        labels = [{'name': '#new', 'color': 'ededed', 'url': url + '/%23new'}]
+
+        self.github.http.request.return_value = (fake_response(headers={'etag': '"abc"'}), '[{"name": "#new", "color": "ededed", "url": "%s/%%23new"}]' % url)
+        first = self.github.Labels.get(url, all_pages=True)
+        self.assertEquals(first.to_dict(), labels)
+
+        not_modified = httplib2.Response({'status': 304})
+        self.github.http.request.return_value = (not_modified, '')
+        second = self.github.Labels.get(url, all_pages=True)
+
+        self.assertEquals(self.github.http.request.call_args[1]['headers']['if-none-match'], '"abc"')
+        self.assertEquals(second.to_dict(), labels)
+        self.assertEquals((self.github.page_cache.hits, self.github.page_cache.misses), (1, 1))
+
+    def test_keeps_recently_used_pages(self):
+        cache = mini_github3.PageCache(size=2)
+        url = 'https://api.github.com/repos/alice_tester/blox/labels?page=%d'
+        cache.store(url % 1, '"1"', [])
+        cache.store(url % 2, '"2"', [])
+        cache.get(url % 1)
+        cache.store(url % 3, '"3"', [])
+        cache.store('https://api.github.com/repos/alice_tester/blox/issues?state=all&since=2012-04-01T00%3A00%3A00Z', '"4"', [])
+
+        self.assertEquals([page['etag'] for page in (cache.get(url % 1), cache.get(url % 3))], ['"1"', '"3"'])
+        self.assertEquals(cache.get(url % 2), None)
+        self.assertEquals(len(cache), 2)
+
+    def test_events_poll_interval(self):
+        self.github.http.request.return_value = (fake_response(headers={'etag': '"abc"', 'x-poll-interval': '60'}), '[{"id": "12", "type": "IssuesEvent", "payload": {"issue": {"number": 1}}}]')
+        events = self.github.Events.by_repository('alice_tester', 'blox', per_page=100)
+        events.deliver()
+        self.assertEquals(events.poll_interval, 60)
+
+        # An unchanged feed is served from the cache, still following the latest poll interval.
+        self.github.http.request.return_value = (httplib2.Response({'status': 304, 'x-poll-interval': '120'}), '')
+        events = self.github.Events.by_repository('alice_tester', 'blox', per_page=100)
+        events.deliver()
+        self.assertEquals([event.id for event in events], ['12'])
+        self.assertEquals(events.poll_interval, 120)
+        self.assertEquals(events.next_page(), None)
+
+
+class TestObjectCache(unittest.TestCase):
+    def setUp(self):
+        self.github = mini_github3.GitHub('token')
+        self.github.http = Mock()
+
+    def test_get_or_create_lists_once(self):
+        url = 'https://api.github.com/repos/alice_tester/blox/milestones'
+
+        def request(uri, method='GET', **kwargs):
+            if method == 'POST':
+                return fake_response(status=201, headers={'location': url + '/3'}), json.dumps({'number': 3, 'title': '2.0'})
+            if method == 'PATCH':
+                return fake_response(status=422), '{"message": "Validation Failed"}'
+            state = urlparse.parse_qs(urlparse.urlparse(uri).query)['state'][0]
+            return fake_response(), json.dumps([{'number': 1, 'title': 'Someday'}] if state == 'open' else [{'number': 2, 'title': '1.0'}])
+
+        self.github.http.request = Mock(side_effect=request)
+        milestones = self.github.Milestones
+
+        for n in range(3):
+            self.assertEquals(milestones.get_or_create_in_repository('alice_tester', 'blox', 'Someday').number, 1)
+        self.assertEquals(milestones.get_or_create_in_repository('alice_tester', 'blox', '1.0').number, 2)
+        # One listing of open and one of closed milestones.
+        self.assertEquals(self.github.http.request.call_count, 2)
+
+        # A new milestone is listed again first, then created and remembered.
+        self.assertEquals(milestones.get_or_create_in_repository('alice_tester', 'blox', '2.0').number, 3)
+        self.assertEquals(self.github.http.request.call_count, 5)
+        self.assertEquals(milestones.get_or_create_in_repository('alice_tester', 'blox', '2.0').number, 3)
+        self.assertEquals(self.github.http.request.call_count, 5)
+
+        # A rejected write drops the cache.
+        self.github.request(url + '/1', method='PATCH', body='{}')
+        milestones.get_or_create_in_repository('alice_tester', 'blox', 'Someday')
+        self.assertEquals(self.github.http.request.call_count, 8)
+
+
+class TestConcurrentPages(unittest.TestCase):
+    def setUp(self):
+        self.github = mini_github3.GitHub('token', page_concurrency=3)
+        self.github.http = Mock()
+
+    def test_all_pages_in_order(self):
+        url = 'https://api.github.com/repos/alice_tester/blox/labels'
+
+        def request(uri, **kwargs):
+            page = int(urlparse.parse_qs(urlparse.urlparse(uri).query).get('page', ['1'])[0])
+            headers = {}
+            if page == 1:
+                headers['link'] = '<%s?page=2>; rel="next", <%s?page=5>; rel="last"' % (url, url)
+            return fake_response(headers=headers), json.dumps([{'name': 'label %d' % page}])
+
+        self.github.http.request = Mock(side_effect=request)
+        labels = self.github.Labels.get(url, all_pages=True)
+
+        self.assertEquals([label.name for label in labels], ['label %d' % n for n in range(1, 6)])
+        self.assertEquals(self.github.http.request.call_count, 5)
+
+    def test_iter_pages(self):
+        url = 'https://api.github.com/repos/alice_tester/blox/issues'
+
+        def request(uri, **kwargs):
+            page = int(urlparse.parse_qs(urlparse.urlparse(uri).query).get('page', ['1'])[0])
+            headers = {}
+            if page < 3:
+                headers['link'] = '<%s?page=%d>; rel="next", <%s?page=3>; rel="last"' % (url, page + 1, url)
+            return fake_response(headers=headers), json.dumps([{'number': page}])
+
+        self.github.http.request = Mock(side_effect=request)
+        issues = self.github.Issues.iter_by_repository('alice_tester', 'blox')
+
+        self.assertEquals(next(issues).number, 1)
+        self.assertEquals([issue.number for issue in issues], [2, 3])
+
+    def test_iter_pages_stopped_early(self):
+        url = 'https://api.github.com/repos/alice_tester/blox/issues'
+        release = threading.Event()
+
+        def request(uri, **kwargs):
+            if 'page=2' in uri:
+                release.wait()
+            return fake_response(headers={'link': '<%s?page=2>; rel="next", <%s?page=2>; rel="last"' % (url, url)}), json.dumps([{'number': 1}])
+
+        self.github.http.request = Mock(side_effect=request)
+        issues = self.github.Issues.iter_by_repository('alice_tester', 'blox')
+        self.assertEquals(next(issues).number, 1)
+        prefetch = [thread for thread in threading.enumerate() if isinstance(thread, mini_github3.BackgroundCall)]
+        self.assertEquals(len(prefetch), 1)
+
+        threading.Timer(0.05, release.set).start()
+        issues.close()
+        self.assertFalse(prefetch[0].is_alive())
+
+
+class TestRateLimiter(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.sleeps = []
+        self.limiter = mini_github3.RateLimiter(burst=2, writes_per_hour=3600, write_burst=1, clock=lambda: self.now, sleep=self.sleeps.append)
+
+    def test_spreads_remaining_budget_until_reset(self):
+        # 12 requests left for the next 10 seconds, 2 of which may be used in a burst.
+        self.limiter.set_budget(12, 5000, 1010.0)
+
+        for n in range(4):
+            self.limiter.wait()
+
+        self.assertEquals(self.sleeps, [1.0, 2.0])
+
+    def test_writes_paced_separately(self):
+        self.limiter.wait('POST')
+        self.limiter.wait('PATCH')
+        self.limiter.wait('GET')
+
+        self.assertEquals(self.sleeps, [1.0])
+
+
+class TestTokenPool(unittest.TestCase):
+    def setUp(self):
+        self.github = mini_github3.GitHub('primary', extra_tokens=['extra'])
+        self.github.http = Mock()
+        self.github.http.request.return_value = (fake_response(headers={'x-ratelimit-remaining': '10', 'x-ratelimit-limit': '5000', 'x-ratelimit-reset': '9999999999'}), '{}')
+
+    def used_token(self):
+        return self.github.http.request.call_args[1]['headers']['Authorization']
+
+    def test_reads_use_token_with_most_budget(self):
+        self.github.request('https://api.github.com/repos/alice_tester/blox/issues')
+        self.assertEquals(self.used_token(), 'token primary')
+
+        # The primary token now has 10 requests left while the budget of the extra token is untouched.
+        self.github.request('https://api.github.com/repos/alice_tester/blox/issues')
+        self.assertEquals(self.used_token(), 'token extra')
+
+    def test_writes_use_primary_token(self):
+        self.github.tokens.update('primary', {'x-ratelimit-remaining': '1'})
+
+        self.github.request('https://api.github.com/repos/alice_tester/blox/issues/1', method='PATCH')
+        self.assertEquals(self.used_token(), 'token primary')
+
+        self.github.request('https://api.github.com/user')
+        self.assertEquals(self.used_token(), 'token primary')
+
+
+def load_tests(loader, tests, pattern):
+    tests.addTests(doctest.DocTestSuite(mini_github3))
+    return tests
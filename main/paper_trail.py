@@ -0,0 +1,141 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+
+#
+# BSD License
+#
+# Copyright (c) 2012, Alexander Ljungberg
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""Rendering of paper trail messages from precompiled tables."""
+
+
+class PaperTrailRenderer(object):
+    """Render paper trail messages exactly like `settings.getPaperTrailMessage`.
+
+    If the settings use the stock `getPaperTrailMessage` and `getWhatsNextMessage`, the label explanations they
+    use are compiled into lookup tables, and the parts of the message which only depend on the labels are kept
+    by label list.
+
+    A custom `getPaperTrailMessage` is called as it is, remembering up to `size` recent messages. These are kept
+    in two halves. Once the newer half is full it replaces the older half, so the messages forgotten are those
+    not used for the longest time, roughly.
+
+    """
+
+    # The label dependent parts of messages are kept for at most this many label lists.
+    MAX_LABEL_SETS = 4096
+
+    def __init__(self, settings, size=1024):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._recent = {}
+        self._older = {}
+        self._label_parts = {}
+
+        render = settings.getPaperTrailMessage
+        # The tables the stock functions really use are those of the module they were defined in.
+        tables = getattr(render, 'func_globals', {})
+        if getattr(render, 'stock', False) and getattr(tables.get('getWhatsNextMessage'), 'stock', False):
+            explanations = tables['LABEL_EXPLANATIONS']
+            self.explanations = explanations
+            self.final_word_ranks = {}
+            for rank, label in enumerate(tables['FINAL_WORD_LABELS']):
+                self.final_word_ranks.setdefault(label, rank)
+            self.final_word_labels = tables['FINAL_WORD_LABELS']
+            self.needs_labels = frozenset(label for label in explanations if label.startswith('#needs'))
+            self.render_message = self.render_compiled
+            # Putting a message together from the compiled parts is cheaper than looking up the whole message.
+            self.render = self.render_compiled
+        else:
+            self.render_message = render
+
+    def render(self, assignee, milestone, labels, votes=None):
+        # The label order matters when more than one explanation is given.
+        key = (assignee, milestone, tuple(labels), votes)
+        message = self._recent.get(key)
+        if message is not None:
+            self.hits += 1
+            return message
+
+        message = self._older.get(key)
+        if message is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            message = self.render_message(assignee, milestone, labels, votes)
+
+        if self.size:
+            # Messages not used since the older half was set aside are forgotten with it.
+            if len(self._recent) >= max(1, self.size // 2):
+                self._older = self._recent
+                self._recent = {}
+            self._recent[key] = message
+        return message
+
+    def render_compiled(self, assignee, milestone, labels, votes=None):
+        key = tuple(labels)
+        parts = self._label_parts.get(key)
+        if parts is None:
+            if len(self._label_parts) >= self.MAX_LABEL_SETS:
+                self._label_parts.clear()
+            parts = self._label_parts[key] = self.compile_labels(labels)
+        labels_part, next, by_whom = parts
+
+        r = ""
+
+        if assignee:
+            r = "**Assignee:** [%s](https://github.com/%s).  " % (assignee, assignee)
+        if milestone:
+            r += "**Milestone:** %s.  " % milestone
+
+        if votes is not None:
+            r += "**Vote%s:** %d.  " % ('s' if votes != 1 else '', votes)
+
+        r += labels_part
+
+        if by_whom:
+            next = next % ("[%s](https://github.com/%s)" % (assignee, assignee) if assignee else "a member of the core team")
+        if next:
+            r += '''**What's next?** %s''' % next
+
+        if not r:
+            r = 'This issue has not been labeled.'
+
+        return r.strip()
+
+    def compile_labels(self, labels):
+        """Return the parts of the message which only depend on the labels.
+
+        That's the list of labels, the what's next message and whether the what's next message still needs to be
+        told who will act on the issue.
+
+        """
+
+        labels_part = "**Label%s:** %s.  " % ('s' if len(labels) != 1 else '', ", ".join(sorted(labels))) if labels else ""
+
+        final_rank = None
+        for label in labels:
+            rank = self.final_word_ranks.get(label)
+            if rank is not None and (final_rank is None or rank < final_rank):
+                final_rank = rank
+        if final_rank is not None:
+            return labels_part, self.explanations[self.final_word_labels[final_rank]], False
+        if '#ready-to-commit' in labels:
+            return labels_part, "The changes for this issue are ready to be committed by %s.", True
+        needs = [label for label in labels if label in self.needs_labels]
+        if needs:
+            if len(needs) == 1:
+                return labels_part, self.explanations[needs[0]], False
+            return labels_part, '\n\n * %s' % ('\n * '.join(self.explanations[label] for label in needs)), False
+
+        return labels_part, "A reviewer should examine this issue.", False
@@ -0,0 +1,56 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+
+#
+# BSD License
+#
+# Copyright (c) 2012, Alexander Ljungberg
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+import imp
+import random
+import unittest
+
+from paper_trail import PaperTrailRenderer
+
+
+LABELS = [u'#new', u'#needs-review', u'#needs-patch', u'#needs-docs', u'#accepted', u'#ready-to-commit', u'#fixed', u'#duplicate', u'#wont-fix', u'#works-for-me', u'bug', u'enhancement', u'Foundation']
+
+
+class TestPaperTrailRenderer(unittest.TestCase):
+    def setUp(self):
+        self.settings = imp.load_source('settings', 'default_settings.py')
+
+    def test_same_as_settings(self):
+        renderer = PaperTrailRenderer(self.settings, 50)
+        self.assertEquals(renderer.render_message, renderer.render_compiled)
+
+        rng = random.Random(0)
+        for n in range(2000):
+            args = (rng.choice([None, u'alice_tester']), rng.choice([None, u'1.0', u'Someday']), rng.sample(LABELS, rng.randint(0, 4)), rng.choice([None, 0, 1, 3]))
+            self.assertEquals(renderer.render(*args), self.settings.getPaperTrailMessage(*args), args)
+
+    def test_custom_message(self):
+        self.settings.getPaperTrailMessage = lambda assignee, milestone, labels, votes=None: u'Labels: %s' % u' '.join(labels)
+        renderer = PaperTrailRenderer(self.settings, 4)
+
+        for n in range(3):
+            self.assertEquals(renderer.render(None, None, [u'bug', u'#new']), u'Labels: bug #new')
+            self.assertEquals(renderer.render(None, None, [u'#new', u'bug']), u'Labels: #new bug')
+        self.assertEquals((renderer.hits, renderer.misses), (4, 2))
+
+        for n in range(10):
+            renderer.render(None, None, [u'label %d' % n])
+        self.assertTrue(len(renderer._recent) + len(renderer._older) <= 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+
+#
+# BSD License
+#
+# Copyright (c) 2012, Alexander Ljungberg
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""The straightforward implementations which optimised parts of CappBot replaced.
+
+The tests check that the optimised code comes to the same results, and benchmark.py measures how much faster it is.
+
+"""
+
+import random
+import re
+
+from command_scanner import ADD_LABEL, REMOVE_LABEL, SET_ASSIGNEE, SET_MILESTONE, VOTE, Command
+from label_rules import LabelRules
+
+
+# The regular expressions the scanner replaced, to check that it understands exactly the same commands.
+ADD_LABEL_REGEX = re.compile(r'^\+([-\w\d _#]*[-\w\d_#]+)$|^(#[-\w\d _#]*[-\w\d_#]+)$')
+REMOVE_LABEL_REGEX = re.compile(r'^-([-\w\d _#]*[-\w\d_#]+)$')
+SET_MILESTONE_REGEX = re.compile(r'^milestone=(.*)$')
+SET_ASSIGNEE_REGEX = re.compile(r'^assignee=([-\w\d_#]*)$')
+VOTE_REGEX = re.compile(r'^[-\+][01]$')
+
+
+def scan_with_regexes(body):
+    r = []
+    for line in body.split('\n'):
+        line = line.strip()
+        if VOTE_REGEX.match(line):
+            r.append(Command(VOTE, int(line)))
+            continue
+        for kind, regex in ((ADD_LABEL, ADD_LABEL_REGEX), (REMOVE_LABEL, REMOVE_LABEL_REGEX), (SET_MILESTONE, SET_MILESTONE_REGEX), (SET_ASSIGNEE, SET_ASSIGNEE_REGEX)):
+            m = regex.match(line)
+            if m:
+                r.append(Command(kind, next(group for group in m.groups() if group is not None)))
+                break
+    return r
+
+
+def apply_rules_by_scanning(settings, labels, order=None):
+    """Apply the removal and mutual exclusion rules by scanning lists, as before they were compiled, for comparison.
+
+    The rules are taken in the compiled order rather than the arbitrary order of the settings dict.
+
+    """
+
+    labels = list(labels)
+    removed = []
+    for trigger_label in order or LabelRules.rule_order(settings.WHEN_LABEL_REMOVE_LABELS):
+        if trigger_label in labels:
+            for label in settings.WHEN_LABEL_REMOVE_LABELS[trigger_label]:
+                if label in labels:
+                    labels.remove(label)
+                    removed.append((label, trigger_label))
+
+    backwards = list(reversed(labels))
+    for n, label in enumerate(backwards):
+        if label in settings.MUTUALLY_EXCLUSIVE_LABELS:
+            for other_label in backwards[n + 1:]:
+                if other_label in settings.MUTUALLY_EXCLUSIVE_LABELS:
+                    labels.remove(other_label)
+                    removed.append((other_label, label))
+            break
+
+    return labels, removed
+
+
+def random_label_sets(settings, count, seed=0):
+    rng = random.Random(seed)
+    names = sorted(set(settings.LABEL_EXPLANATIONS) | set(settings.MUTUALLY_EXCLUSIVE_LABELS) | set(['bug', 'enhancement', 'Foundation']))
+    for n in xrange(count):
+        yield rng.sample(names, rng.randint(0, 6))
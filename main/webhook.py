@@ -0,0 +1,173 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+
+#
+# BSD License
+#
+# Copyright (c) 2012, Alexander Ljungberg
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""A receiver of GitHub webhook deliveries, which queues the numbers of the issues they are about.
+
+Only `issues` and `issue_comment` events of the configured repository are queued. Every delivery must carry a
+valid `X-Hub-Signature-256` (or the older `X-Hub-Signature`) HMAC signature made with the webhook secret.
+
+"""
+
+import BaseHTTPServer
+import hashlib
+import hmac
+import json
+import logbook
+import Queue
+import SocketServer
+import threading
+
+
+EVENTS = ('issues', 'issue_comment')
+
+# GitHub caps payloads at 25 MB. Anything bigger isn't read at all, since it can't have been signed yet.
+MAX_BODY = 25 * 1024 * 1024
+
+SIGNATURE_HEADERS = (('X-Hub-Signature-256', 'sha256', hashlib.sha256), ('X-Hub-Signature', 'sha1', hashlib.sha1))
+
+
+def verify_signature(secret, body, headers):
+    """Return true if the headers carry a valid signature of `body` made with `secret`.
+
+    >>> verify_signature('s3cret', '{}', {'X-Hub-Signature': 'sha1=' + hmac.new('s3cret', '{}', hashlib.sha1).hexdigest()})
+    True
+    >>> verify_signature('s3cret', '{}', {'X-Hub-Signature-256': 'sha256=0000'})
+    False
+
+    """
+
+    for header, name, digest in SIGNATURE_HEADERS:
+        signature = headers.get(header)
+        if signature:
+            expected = '%s=%s' % (name, hmac.new(secret, body, digest).hexdigest())
+            return hmac.compare_digest(expected, signature)
+    return False
+
+
+class IssueQueue(object):
+    """A queue of issue numbers in which each issue is waiting at most once."""
+
+    def __init__(self):
+        self._queue = Queue.Queue()
+        self._waiting = set()
+        self._lock = threading.Lock()
+
+    def put(self, number):
+        with self._lock:
+            if number in self._waiting:
+                return
+            self._waiting.add(number)
+        self._queue.put(number)
+
+    def get(self, timeout=None):
+        """Return the next issue number, or None if none arrives within `timeout` seconds."""
+
+        try:
+            number = self._queue.get(timeout=timeout)
+        except Queue.Empty:
+            return None
+        with self._lock:
+            self._waiting.discard(number)
+        return number
+
+    def __len__(self):
+        return self._queue.qsize()
+
+
+class WebhookHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # Seconds a client may take over each read, so that a stalled one doesn't hold on to its thread forever.
+    timeout = 10
+
+    def do_POST(self):
+        server = self.server
+        try:
+            length = int(self.headers.get('Content-Length'))
+        except (TypeError, ValueError):
+            self.close_connection = True
+            return self.respond(411, 'Content-Length required.')
+        if not 0 <= length <= MAX_BODY:
+            logbook.warning(u"Rejecting webhook delivery %s of %d bytes." % (self.headers.get('X-GitHub-Delivery'), length))
+            # The body is left unread, so the connection can't be used again.
+            self.close_connection = True
+            return self.respond(413, 'Payload too large.')
+        body = self.rfile.read(length)
+
+        if not verify_signature(server.secret, body, self.headers):
+            logbook.warning(u"Rejecting webhook delivery %s with a missing or bad signature." % self.headers.get('X-GitHub-Delivery'))
+            return self.respond(401, 'Bad signature.')
+
+        event = self.headers.get('X-GitHub-Event')
+        if event not in EVENTS:
+            return self.respond(204)
+
+        try:
+            payload = json.loads(body)
+            repository = payload['repository']['full_name']
+            number = int(payload['issue']['number'])
+        except (ValueError, KeyError, TypeError):
+            return self.respond(400, 'Not an issue event.')
+
+        if repository.lower() != server.repository.lower():
+            logbook.debug(u"Ignoring %s event for %s." % (event, repository))
+            return self.respond(204)
+
+        logbook.info(u"Queueing issue %d after %s event %s." % (number, event, payload.get('action')))
+        server.issues.put(number)
+        self.respond(202)
+
+    def respond(self, status, message=None):
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(message or '')))
+        self.end_headers()
+        if message:
+            self.wfile.write(message)
+
+    def log_message(self, format, *args):
+        logbook.debug(u"Webhook %s: %s" % (self.client_address[0], format % args))
+
+
+class WebhookServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Receive webhook deliveries for `repository` at `address`, putting issue numbers on `issues`.
+
+    The server runs on a background thread from `start()` until `stop()`, and handles each delivery on a thread of
+    its own, so that a slow client doesn't hold up GitHub's deliveries.
+
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, secret, repository, issues=None):
+        if not secret:
+            raise ValueError("A webhook secret is required to verify deliveries.")
+        BaseHTTPServer.HTTPServer.__init__(self, address, WebhookHandler)
+        self.secret = secret
+        self.repository = repository
+        self.issues = issues if issues is not None else IssueQueue()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        logbook.info(u"Receiving webhooks for %s at http://%s:%d/." % ((self.repository,) + self.server_address[:2]))
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread:
+            self._thread.join()
@@ -0,0 +1,108 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+
+#
+# BSD License
+#
+# Copyright (c) 2012, Alexander Ljungberg
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+import doctest
+import hashlib
+import hmac
+import httplib
+import json
+import os
+import unittest
+
+from webhook import MAX_BODY, WebhookServer
+import webhook
+
+
+def load_payload(name):
+    with open(os.path.join(os.path.dirname(__file__), 'test_fixtures', name), 'rb') as inf:
+        return inf.read()
+
+
+class TestWebhookServer(unittest.TestCase):
+    def setUp(self):
+        self.server = WebhookServer(('127.0.0.1', 0), 's3cret', 'alice_tester/blox')
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def post(self, body, event='issue_comment', secret='s3cret'):
+        headers = {'Content-Type': 'application/json', 'X-GitHub-Event': event, 'X-GitHub-Delivery': '72d3162e'}
+        if secret:
+            headers['X-Hub-Signature-256'] = 'sha256=' + hmac.new(secret, body, hashlib.sha256).hexdigest()
+        connection = httplib.HTTPConnection(*self.server.server_address)
+        connection.request('POST', '/', body, headers)
+        status = connection.getresponse().status
+        connection.close()
+        return status
+
+    def test_queues_issue(self):
+        body = load_payload('webhook_issue_comment.json')
+
+        self.assertEquals(self.post(body), 202)
+        self.assertEquals(self.post(body, event='issues'), 202)
+        # The issue is only waiting once.
+        self.assertEquals(len(self.server.issues), 1)
+        self.assertEquals(self.server.issues.get(), 1)
+        self.assertEquals(self.server.issues.get(timeout=0), None)
+
+    def test_rejects_bad_signature(self):
+        body = load_payload('webhook_issue_comment.json')
+
+        self.assertEquals(self.post(body, secret=None), 401)
+        self.assertEquals(self.post(body, secret='guess'), 401)
+        self.assertEquals(len(self.server.issues), 0)
+
+    def test_rejects_large_body(self):
+        connection = httplib.HTTPConnection(*self.server.server_address)
+        connection.putrequest('POST', '/')
+        connection.putheader('X-GitHub-Event', 'issue_comment')
+        connection.putheader('Content-Length', str(MAX_BODY + 1))
+        connection.endheaders()
+        # Answered without waiting for the body.
+        status = connection.getresponse().status
+        connection.close()
+
+        self.assertEquals(status, 413)
+
+    def test_stalled_client(self):
+        stalled = httplib.HTTPConnection(*self.server.server_address)
+        stalled.putrequest('POST', '/')
+        stalled.putheader('Content-Length', '1000')
+        stalled.endheaders()
+
+        # Handled while the other client has yet to send its body.
+        self.assertEquals(self.post(load_payload('webhook_issue_comment.json')), 202)
+        stalled.close()
+
+    def test_ignores_other_events(self):
+        payload = json.loads(load_payload('webhook_issue_comment.json'))
+
+        self.assertEquals(self.post(json.dumps(payload), event='push'), 204)
+        payload['repository']['full_name'] = 'mallory/blox'
+        self.assertEquals(self.post(json.dumps(payload)), 204)
+        self.assertEquals(self.post('{"zen": "Keep it logically awesome."}'), 400)
+        self.assertEquals(len(self.server.issues), 0)
+
+
+def load_tests(loader, tests, pattern):
+    tests.addTests(doctest.DocTestSuite(webhook))
+    return tests
+
+
+if __name__ == '__main__':
+    unittest.main()
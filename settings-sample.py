@@ -7,3 +7,6 @@ GITHUB_TOKEN = "12345678901234567890"
 GITHUB_REPOSITORY = "aljungberg/bottest2"
 
 DATABASE = "bottest2-db.json"
+PAGE_CACHE = "bottest2-page-cache.json"
+COMMENT_STORE = "bottest2-comments.json"
+METADATA_CATALOG = "bottest2-metadata.json"